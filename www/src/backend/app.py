@@ -10,6 +10,10 @@
         - editdata
         - deepseek
         - sms
+        - dbstats (slow-query log / EXPLAIN capture, /admin/dbstats)
+        - session_token (signed session tokens -> g.identity, no DB lookup)
+        - sync (/sync/records: per-user change log, deltas and tombstones since a token)
+        - response_pipeline (fast JSON provider, gzip/brotli, Server-Timing)
 """
 from flask import Flask, request, g, jsonify
 from werkzeug.exceptions import HTTPException
@@ -28,9 +32,15 @@ from routes.square import square_blueprint
 from routes.report import report_blueprint
 from routes.block import block_blueprint
 from routes.logs import logs_blueprint
+from routes.dbstats import dbstats_blueprint
+from routes.sync import sync_blueprint
+from routes.log_pipeline import LOG_ASYNC, install_log_pipeline
+from routes.session_token import load_identity
+from routes.response_pipeline import install_response_pipeline
 import logging
 import time, uuid
 import os
+import re
 from concurrent_log_handler import ConcurrentRotatingFileHandler as RotatingFileHandler
 
 # make blue prints
@@ -49,6 +59,8 @@ app.register_blueprint(square_blueprint)
 app.register_blueprint(report_blueprint)
 app.register_blueprint(block_blueprint)
 app.register_blueprint(logs_blueprint)
+app.register_blueprint(dbstats_blueprint)
+app.register_blueprint(sync_blueprint)
 
 # *CORS rule，Prevent unauthorized requests, enhance security
 CORS(app, resources={r"/*": {"origins": "*"}}, supports_credentials=True)
@@ -65,6 +77,74 @@ def _should_log(path: str) -> bool:
         pass
     return True
 
+# Request body preview: the first LOG_BODY_PREVIEW_BYTES of the body are copied while the route
+# reads it, and only formatted (redacted, data: URIs collapsed) if the log line is emitted.
+LOG_BODY_PREVIEW_BYTES = int(os.getenv("LOG_BODY_PREVIEW_BYTES", "512"))
+_SENSITIVE_KEY = r"[^\"=&]*(?:password|passwd|pwd|token|secret|authorization)[^\"=&]*|code|otp"
+_SENSITIVE_JSON_RE = re.compile(r'("(?:%s)"\s*:\s*)(?:"(?:[^"\\]|\\.)*"?|[^,}\s]+)' % _SENSITIVE_KEY, re.IGNORECASE)
+_SENSITIVE_FORM_RE = re.compile(r'((?:^|&)(?:%s)=)[^&]*' % _SENSITIVE_KEY, re.IGNORECASE)
+_DATA_URI_RE = re.compile(r'data:[\w.+/-]+;base64,[A-Za-z0-9+/=\\]*')
+
+
+class _BodyHeadRecorder:
+    """wsgi.input wrapper that keeps a copy of the first `limit` bytes read through it."""
+
+    def __init__(self, stream, limit: int):
+        self._stream = stream
+        self._limit = limit
+        self.head = bytearray()
+
+    def _keep(self, data) -> None:
+        room = self._limit - len(self.head)
+        if room > 0 and data:
+            self.head += data[:room]
+
+    def read(self, *args):
+        data = self._stream.read(*args)
+        self._keep(data)
+        return data
+
+    def readline(self, *args):
+        data = self._stream.readline(*args)
+        self._keep(data)
+        return data
+
+    def readinto(self, b):
+        readinto = getattr(self._stream, "readinto", None)
+        if readinto is None:
+            data = self._stream.read(len(b))
+            n = len(data)
+            b[:n] = data
+        else:
+            n = readinto(b)
+        if n:
+            self._keep(memoryview(b)[:n])
+        return n
+
+    def __iter__(self):
+        return iter(self.readline, b"")
+
+    def __getattr__(self, name):
+        return getattr(self._stream, name)
+
+
+class _BodyPreview:
+    """Formats a recorded body head lazily (only when a log record is actually emitted)."""
+
+    def __init__(self, head: bytes, total: int):
+        self.head = head
+        self.total = total
+
+    def __str__(self) -> str:
+        text = bytes(self.head).decode("utf-8", errors="ignore")
+        text = _SENSITIVE_JSON_RE.sub(r'\1"***"', text)
+        text = _SENSITIVE_FORM_RE.sub(r"\1***", text)
+        text = _DATA_URI_RE.sub(lambda m: m.group(0)[:m.group(0).index(",") + 1] + "...", text)
+        if self.total > len(self.head):
+            text += f"...(+{self.total - len(self.head)} bytes)"
+        return text
+
+
 @app.before_request
 def _start_timer() -> None:
     g._ts = time.perf_counter()
@@ -72,7 +152,16 @@ def _start_timer() -> None:
     rid = g.request_id
     rid_short = (rid.split("-")[0] if isinstance(rid, str) and "-" in rid else str(rid)[:8])
     if _should_log(request.path):
-        logging.getLogger("app").info("%s -> %s %s len=%s", rid_short, request.method, request.path, request.content_length or 0)
+        logger = logging.getLogger("app")
+        logger.info("%s -> %s %s len=%s", rid_short, request.method, request.path, request.content_length or 0)
+        if LOG_BODY_PREVIEW_BYTES > 0 and request.content_length and logger.isEnabledFor(logging.INFO):
+            # Route has not touched the body yet; record its head as the route reads it
+            recorder = _BodyHeadRecorder(request.environ["wsgi.input"], LOG_BODY_PREVIEW_BYTES)
+            request.environ["wsgi.input"] = recorder
+            g._body_head = recorder
+
+# Verify "Authorization: Bearer <token>" once per request; routes read g.identity
+app.before_request(load_identity)
 
 @app.after_request
 def _log_response(resp)-> None:
@@ -82,10 +171,17 @@ def _log_response(resp)-> None:
         dur_ms = -1
     rid = getattr(g, "request_id", "-")
     resp.headers["X-Request-ID"] = rid
-    resp.headers["Server-Timing"] = f"app;dur={dur_ms:.1f}"
+    # keep entries added by later-registered hooks (json / compression timings)
+    timings = resp.headers.get("Server-Timing")
+    resp.headers["Server-Timing"] = f"app;dur={dur_ms:.1f}" + (f", {timings}" if timings else "")
     rid_short = (rid.split("-")[0] if isinstance(rid, str) and "-" in rid else str(rid)[:8])
     if _should_log(request.path):
-        logging.getLogger("app").info("%s <- %s %.1fms %s", rid_short, request.path, dur_ms, resp.status_code)
+        recorder = getattr(g, "_body_head", None)
+        if recorder is not None and recorder.head:
+            logging.getLogger("app").info("%s <- %s %.1fms %s body=%s", rid_short, request.path, dur_ms, resp.status_code,
+                                          _BodyPreview(recorder.head, request.content_length or 0))
+        else:
+            logging.getLogger("app").info("%s <- %s %.1fms %s", rid_short, request.path, dur_ms, resp.status_code)
     return resp
 
 
@@ -151,19 +247,30 @@ file_handler.setFormatter(plain_formatter)
 def _has_file_handler(base_name: str) -> bool:
     return any(isinstance(h, RotatingFileHandler) and getattr(h, "baseFilename", "").endswith(base_name) for h in root.handlers)
 
-if not _has_file_handler("app.out"):
-    root.addHandler(file_handler)
-
 def _has_console_handler() -> bool:
     return any(isinstance(h, logging.StreamHandler) for h in root.handlers)
 
-if not _has_console_handler():
+if LOG_ASYNC:
+    # Request threads only enqueue; a per-worker listener writes batches to file and console
+    # (routes/log_pipeline.py), so workers no longer contend on the file lock for every line
     console_handler = logging.StreamHandler()
     console_handler.setFormatter(console_formatter)
-    root.addHandler(console_handler)
+    if not install_log_pipeline(root, [file_handler, console_handler]):
+        file_handler.close()
+else:
+    if not _has_file_handler("app.out"):
+        root.addHandler(file_handler)
+
+    if not _has_console_handler():
+        console_handler = logging.StreamHandler()
+        console_handler.setFormatter(console_formatter)
+        root.addHandler(console_handler)
 
 # use app to replace root, enhance logging
 _app_logger = logging.getLogger("app")
 _app_logger.setLevel(logging.INFO)
 
+# JSON provider + compression; registered after _log_response so it runs first and app;dur covers it
+install_response_pipeline(app)
+
 # !Do not run a dev server in production. Use Gunicorn/Uvicorn, e.g.:
@@ -0,0 +1,158 @@
+"""
+Synthetic health-record corpus for the benchmarks
+- payload generators that mirror what metrics.js / diet.js / case_record.js / metrics.js(symptoms)
+  upload to /uploadjson/<kind> (same exportInfo + *Data layout)
+- deterministic for a given seed so runs are comparable
+"""
+import json
+import base64
+import random
+from datetime import datetime, timedelta
+
+FOODS = ["米饭", "青菜", "鸡蛋", "牛奶", "苹果", "面条", "豆腐", "鱼", "西红柿炒蛋", "小米粥", "馒头", "香蕉"]
+HOSPITALS = ["北京协和医院", "上海儿童医学中心", "浙江大学医学院附属儿童医院", "四川大学华西医院"]
+DEPARTMENTS = ["儿科", "肾内科", "风湿免疫科", "皮肤科"]
+DIAGNOSES = ["过敏性紫癜", "紫癜性肾炎", "皮肤型紫癜", "关节型紫癜复查"]
+PRESCRIPTIONS = ["维生素C 每日两次", "氯雷他定 每晚一次", "泼尼松 按医嘱减量", "双嘧达莫 每日三次"]
+SYMPTOM_TYPES = ["skin-type", "joint-type", "abdominal-type", "renal-type", "other"]
+BLEEDING_POINTS = ["joints", "thighs", "calves", "arms", "other"]
+URINALYSIS_ITEMS = ["protein", "glucose", "ketones", "blood", "ph", "sg"]
+
+CHAT_PROMPTS = [
+    "你好",
+    "最近皮肤上出现了出血点，饮食上需要注意什么？",
+    "孩子紫癜复发了，运动建议是什么？可以跑步和游泳吗？",
+    "晚上总是失眠多梦，有什么睡眠建议和作息调整的方法？",
+    "尿蛋白偏高，血压控制和饮食调理应该怎么做？",
+    "最近压力很大，焦虑缓解和情绪管理有什么建议？",
+]
+
+REPLY_SENTENCES = [
+    "建议您保持营养均衡，多吃蔬菜水果，适量补充维生素和蛋白质。",
+    "饮食建议方面，应该避免辛辣刺激和容易过敏的食物。",
+    "运动建议：病情稳定后可以进行散步、快走等有氧运动，避免剧烈运动。",
+    "睡眠质量对恢复很重要，建议规律作息，保持良好的睡眠习惯。",
+    "如果出现腹痛、关节肿痛或尿液颜色改变，需要及时就医。",
+    "心理健康同样重要，可以尝试冥想和正念练习来缓解压力。",
+    "对于血压控制和血糖控制，需要定期复查并遵医嘱用药。",
+    "以上内容仅供参考，建议咨询专业医生获得个性化的诊疗方案。",
+]
+
+
+def _ts(rng: random.Random, base: datetime) -> datetime:
+    return base - timedelta(days=rng.randint(0, 89), hours=rng.randint(0, 23), minutes=rng.randint(0, 59))
+
+
+def _fmt(dt: datetime, sep: str = "-") -> str:
+    return dt.strftime(f"%Y{sep}%m{sep}%d %H:%M:%S")
+
+
+def _export_info(rng: random.Random, when: datetime, data_type: str, with_record_time: bool = True) -> dict:
+    info = {
+        # zh-CN toLocaleString output, e.g. 2025/10/09 21:03:11
+        "exportTime": _fmt(when + timedelta(minutes=rng.randint(0, 30)), "/"),
+        "version": "1.0",
+        "appName": "紫癜精灵",
+        "dataType": data_type,
+    }
+    if with_record_time:
+        info["recordTime"] = _fmt(when)
+    return info
+
+
+def fake_image_data_uri(rng: random.Random, size: int) -> str:
+    """A data:image URI of roughly `size` bytes (random payload, not a decodable image)."""
+    raw = bytes(rng.getrandbits(8) for _ in range(max(0, size * 3 // 4)))
+    return "data:image/jpeg;base64," + base64.b64encode(raw).decode("ascii")
+
+
+def metrics_payload(rng: random.Random, when: datetime) -> dict:
+    data = {
+        "symptoms": {"items": [{"type": rng.choice(SYMPTOM_TYPES), "description": "双下肢散在出血点"}]},
+        "temperature": {"temperature": round(rng.uniform(36.0, 38.5), 1)},
+        "urinalysis": {"protein": rng.choice(["-", "+", "++"]), "glucose": "-", "ketones": "-", "blood": rng.choice(["-", "+"])},
+        "proteinuria": {"proteinuria24h": round(rng.uniform(0.05, 1.5), 2)},
+        "blood-test": {"wbc": round(rng.uniform(4, 11), 1), "rbc": round(rng.uniform(3.8, 5.5), 2), "hb": rng.randint(100, 160), "plt": rng.randint(120, 400)},
+        "bleeding-point": {"bleedingPoint": rng.choice(BLEEDING_POINTS)},
+        "self-rating": {"selfRating": rng.randint(0, 10)},
+        "urinalysis-matrix": {
+            "urinalysisMatrix": [
+                {"item": it, "value": str(round(rng.uniform(0, 10), 2)), "index": i}
+                for i, it in enumerate(rng.sample(URINALYSIS_ITEMS, rng.randint(1, len(URINALYSIS_ITEMS))))
+            ]
+        },
+    }
+    return {"exportInfo": _export_info(rng, when, "health_metrics"), "metricsData": data}
+
+
+def diet_payload(rng: random.Random, when: datetime, meals: int = 3, image_bytes: int = 0) -> dict:
+    diet = {}
+    for i in range(meals):
+        meal_time = when.replace(hour=7 + (i * 5) % 16, minute=rng.randint(0, 59))
+        diet[f"meal_{i + 1}"] = {
+            "mealId": i + 1,
+            "time": meal_time.strftime("%H:%M"),
+            "food": "、".join(rng.sample(FOODS, 3)),
+            "images": [fake_image_data_uri(rng, image_bytes)] if image_bytes else [],
+            "date": meal_time.strftime("%Y-%m-%d"),
+            "timestamp": _fmt(meal_time),
+        }
+    return {"exportInfo": _export_info(rng, when, "diet_record", with_record_time=False), "dietData": diet}
+
+
+def case_payload(rng: random.Random, when: datetime, image_bytes: int = 0) -> dict:
+    case = {
+        "hospital": rng.choice(HOSPITALS),
+        "department": rng.choice(DEPARTMENTS),
+        "doctor": "王医生",
+        "diagnosis": rng.choice(DIAGNOSES),
+        "prescription": rng.choice(PRESCRIPTIONS),
+        "images": [fake_image_data_uri(rng, image_bytes)] if image_bytes else [],
+        "timestamp": _fmt(when),
+        "id": f"case_{rng.getrandbits(40):x}",
+    }
+    return {"exportInfo": _export_info(rng, when, "case_record"), "caseData": case}
+
+
+def symptoms_payload(rng: random.Random, when: datetime) -> dict:
+    codes = sorted(set(rng.randint(0, 5) for _ in range(rng.randint(1, 3))))
+    return {"exportInfo": _export_info(rng, when, "symptom_tracking"), "symptomData": {"symptoms": codes}}
+
+
+GENERATORS = {
+    "metrics": metrics_payload,
+    "diet": diet_payload,
+    "case": case_payload,
+    "symptoms": symptoms_payload,
+}
+
+
+def payload(kind: str, rng: random.Random, when: datetime = None, **kwargs) -> dict:
+    when = when or _ts(rng, datetime.now())
+    return GENERATORS[kind](rng, when, **kwargs)
+
+
+def records(kind: str, n: int, seed: int = 7, **kwargs) -> list:
+    """n payloads of one kind, spread over the last 90 days."""
+    rng = random.Random(f"{kind}:{seed}")
+    now = datetime(2025, 10, 1, 12, 0, 0)
+    return [GENERATORS[kind](rng, _ts(rng, now), **kwargs) for _ in range(n)]
+
+
+def db_rows(kind: str, n: int, seed: int = 7, **kwargs) -> list:
+    """Rows shaped like `SELECT id, user_id, username, file_name, content, created_at FROM <kind>_files`."""
+    rows = []
+    for i, p in enumerate(records(kind, n, seed, **kwargs)):
+        rows.append({
+            "id": f"{kind}-{i:06d}",
+            "user_id": "bench-user",
+            "username": "bench",
+            "file_name": f"bench_{kind}_{i}.json",
+            "content": json.dumps(p, ensure_ascii=False, separators=(",", ":")),
+            "created_at": datetime(2025, 10, 1) - timedelta(hours=i),
+        })
+    return rows
+
+
+def reply_text(rng: random.Random, sentences: int = 8) -> str:
+    return "".join(rng.choice(REPLY_SENTENCES) for _ in range(sentences))
@@ -0,0 +1,150 @@
+"""
+Local stand-ins for the external services used by the backend
+- FakeDeepSeek: OpenAI-style /v1/chat/completions, plain JSON or SSE streaming
+  (point the app at it with DEEPSEEK_API_URL)
+- FakeAliyunSms: answers the Dysmsapi SendSms RPC call with Code=OK
+  (point the app at it with ALIYUN_SMS_ENDPOINT=host:port and ALIYUN_SMS_PROTOCOL=http)
+
+Both run on a daemon thread; latency and failure rate are configurable so the load test
+can model a slow or flaky provider.
+"""
+import json
+import time
+import uuid
+import random
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+from bench import corpus
+
+
+class _FakeServer:
+    handler_class = None
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, latency_ms: float = 0.0, fail_rate: float = 0.0, seed: int = 7):
+        self.latency_ms = latency_ms
+        self.fail_rate = fail_rate
+        self.rng = random.Random(seed)
+        self.requests = 0
+        self._lock = threading.Lock()
+        handler = type("Handler", (self.handler_class,), {"fake": self})
+        self.httpd = ThreadingHTTPServer((host, port), handler)
+        self.httpd.daemon_threads = True
+        self._thread = threading.Thread(target=self.httpd.serve_forever, name=type(self).__name__, daemon=True)
+
+    @property
+    def address(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f"{host}:{port}"
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def _tick(self) -> bool:
+        """Count the request, apply latency, and return False when this call should fail."""
+        with self._lock:
+            self.requests += 1
+            failed = self.rng.random() < self.fail_rate
+        if self.latency_ms:
+            time.sleep(self.latency_ms / 1000)
+        return not failed
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+class _QuietHandler(BaseHTTPRequestHandler):
+    fake = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def _read_body(self) -> bytes:
+        length = int(self.headers.get("Content-Length") or 0)
+        return self.rfile.read(length) if length else b""
+
+    def _send_json(self, status: int, obj):
+        body = json.dumps(obj, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class _DeepSeekHandler(_QuietHandler):
+    def do_POST(self):
+        try:
+            req = json.loads(self._read_body() or b"{}")
+        except ValueError:
+            req = {}
+        if not self.fake._tick():
+            return self._send_json(503, {"error": {"message": "fake provider overloaded"}})
+        reply = corpus.reply_text(self.fake.rng, self.fake.reply_sentences)
+        if not req.get("stream"):
+            return self._send_json(200, {
+                "id": uuid.uuid4().hex,
+                "object": "chat.completion",
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": reply}, "finish_reason": "stop"}],
+            })
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.end_headers()
+        step = max(1, self.fake.chunk_chars)
+        for i in range(0, len(reply), step):
+            chunk = {"choices": [{"index": 0, "delta": {"content": reply[i:i + step]}}]}
+            self.wfile.write(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode("utf-8"))
+            self.wfile.flush()
+            if self.fake.token_delay_ms:
+                time.sleep(self.fake.token_delay_ms / 1000)
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.wfile.flush()
+
+
+class FakeDeepSeek(_FakeServer):
+    handler_class = _DeepSeekHandler
+
+    def __init__(self, *args, reply_sentences: int = 8, chunk_chars: int = 4, token_delay_ms: float = 5.0, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.reply_sentences = reply_sentences
+        self.chunk_chars = chunk_chars
+        self.token_delay_ms = token_delay_ms
+
+    @property
+    def api_url(self) -> str:
+        return f"http://{self.address}/v1/chat/completions"
+
+
+class _AliyunSmsHandler(_QuietHandler):
+    def _answer(self):
+        body = self._read_body()
+        params = parse_qs(urlparse(self.path).query)
+        params.update(parse_qs(body.decode("utf-8", errors="replace")))
+        phone = (params.get("PhoneNumbers") or [""])[0]
+        request_id = str(uuid.uuid4()).upper()
+        if not self.fake._tick():
+            return self._send_json(200, {"Code": "isv.BUSINESS_LIMIT_CONTROL", "Message": "触发天级流控", "RequestId": request_id})
+        with self.fake._lock:
+            self.fake.sent.append(phone)
+        self._send_json(200, {"Code": "OK", "Message": "OK", "BizId": uuid.uuid4().hex[:20], "RequestId": request_id})
+
+    do_GET = _answer
+    do_POST = _answer
+
+
+class FakeAliyunSms(_FakeServer):
+    handler_class = _AliyunSmsHandler
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.sent = []
@@ -0,0 +1,105 @@
+"""
+Pick the scrypt cost for routes/credentials.py on this machine
+- hashes with each candidate N (2^--min-log2n .. 2^--max-log2n, fixed r/p) on --workers threads
+  at once, the way PASSWORD_HASH_WORKERS would run them under a login burst
+- reports median / p95 latency per hash, hashes per second and memory per hash
+- recommends the largest N whose p95 stays within --budget-ms, as env lines to paste into .env
+
+Usage (from src/backend):
+    python -m bench.kdf_cost --budget-ms 100
+    python -m bench.kdf_cost --workers 4 --budget-ms 150 --out bench/kdf_cost.json
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import statistics
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if BACKEND_DIR not in sys.path:
+    sys.path.insert(0, BACKEND_DIR)
+
+from routes.credentials import hash_password_sync, PASSWORD_HASH_WORKERS
+
+
+def _timed(log2n: int, r: int, p: int) -> float:
+    t0 = time.perf_counter()
+    hash_password_sync("Bench-Passw0rd", log2n=log2n, r=r, p=p)
+    return time.perf_counter() - t0
+
+
+def measure(log2n: int, r: int, p: int, workers: int, samples: int) -> dict:
+    _timed(log2n, r, p)  # warm up allocator / OpenSSL
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        t0 = time.perf_counter()
+        timings = list(pool.map(lambda _: _timed(log2n, r, p), range(samples)))
+        wall = time.perf_counter() - t0
+    timings.sort()
+    return {
+        "log2n": log2n,
+        "r": r,
+        "p": p,
+        "median_ms": round(statistics.median(timings) * 1e3, 2),
+        "p95_ms": round(timings[min(len(timings) - 1, int(len(timings) * 0.95))] * 1e3, 2),
+        "hashes_per_s": round(samples / wall, 1),
+        "mem_mib": round(128 * (1 << log2n) * r * p / (1 << 20), 1),
+    }
+
+
+def main(argv=None) -> int:
+    ap = argparse.ArgumentParser(description="Choose scrypt cost settings for the login latency budget")
+    ap.add_argument("--budget-ms", type=float, default=100.0, help="allowed p95 per hash under load")
+    ap.add_argument("--workers", type=int, default=PASSWORD_HASH_WORKERS, help="concurrent hashes (PASSWORD_HASH_WORKERS)")
+    ap.add_argument("--samples", type=int, default=16, help="hashes per candidate")
+    ap.add_argument("--min-log2n", type=int, default=12)
+    ap.add_argument("--max-log2n", type=int, default=18)
+    ap.add_argument("-r", type=int, default=8)
+    ap.add_argument("-p", type=int, default=1)
+    ap.add_argument("--out", help="write results JSON here")
+    args = ap.parse_args(argv)
+
+    rows = []
+    for log2n in range(args.min_log2n, args.max_log2n + 1):
+        row = measure(log2n, args.r, args.p, max(1, args.workers), max(2, args.samples))
+        rows.append(row)
+        print(f"N=2^{log2n:<3} r={args.r} p={args.p}  median {row['median_ms']:8.2f} ms  "
+              f"p95 {row['p95_ms']:8.2f} ms  {row['hashes_per_s']:7.1f} hash/s  {row['mem_mib']:6.1f} MiB")
+        if row["p95_ms"] > args.budget_ms * 4:
+            break  # larger N only gets slower
+
+    fitting = [row for row in rows if row["p95_ms"] <= args.budget_ms]
+    choice = fitting[-1] if fitting else None
+    if choice:
+        print(f"\nlargest cost within {args.budget_ms:g} ms p95 on {args.workers} worker(s):")
+        print(f"  PASSWORD_SCRYPT_LOG2N={choice['log2n']}")
+        print(f"  PASSWORD_SCRYPT_R={choice['r']}")
+        print(f"  PASSWORD_SCRYPT_P={choice['p']}")
+        print(f"  PASSWORD_HASH_WORKERS={args.workers}")
+    else:
+        print(f"\nno candidate fits {args.budget_ms:g} ms p95; lower --min-log2n or raise the budget")
+
+    if args.out:
+        report = {
+            "meta": {
+                "at": datetime.now().isoformat(timespec="seconds"),
+                "python": platform.python_version(),
+                "machine": platform.machine(),
+                "cpus": os.cpu_count(),
+                "workers": args.workers,
+                "budget_ms": args.budget_ms,
+            },
+            "results": rows,
+            "choice": choice,
+        }
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"results written to {args.out}")
+    return 0 if choice else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,420 @@
+"""
+Load test for the Flask backend
+- boots `app` in-process on a threaded werkzeug server (or drives an already running
+  instance with --target), with FakeDeepSeek / FakeAliyunSms standing in for the providers
+- seeds users, health records and square posts (waiting for posts acknowledged as queued by the
+  write-behind journal to show up in /square/list), then replays a weighted traffic mix:
+    daily   : /readdata + /getjson/<kind> for every kind + one detail GET per row (the daily view N+1)
+    square  : /square/list then /square/comments for the first posts (feed scroll)
+    chat    : /deepseek/chat_stream, read to the end (ttfb reported separately)
+    upload  : /upload_image with a small JPEG + /uploadjson/<kind>
+    otp     : /sms/send through the fake Aliyun endpoint (weight 0 unless asked for)
+- reports p50/p95/p99/max latency and throughput per route template, writes a JSON report
+  and compares it with --baseline (exit code 1 when a route's p95 regresses past --threshold)
+
+MySQL is not faked: point DB_HOST/DB_USER/DB_PASSWORD/DB_NAME at a scratch database.
+
+Usage (from src/backend):
+    python -m bench.loadtest --users 8 --duration 30 --out bench/result.json
+    python -m bench.loadtest --baseline bench/baseline.json
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import threading
+import http.client
+from io import BytesIO
+from base64 import b64encode
+from urllib.parse import urlsplit, urlencode
+from datetime import datetime
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if BACKEND_DIR not in sys.path:
+    sys.path.insert(0, BACKEND_DIR)
+
+from bench import corpus
+from bench.fakes import FakeDeepSeek, FakeAliyunSms
+
+KINDS = ("metrics", "diet", "case", "symptoms")
+DEFAULT_MIX = "daily=4,square=3,chat=2,upload=1,otp=0"
+
+
+class Stats:
+    """Latency samples per route template (thread-safe)."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.samples = {}
+        self.errors = {}
+
+    def add(self, route: str, ms: float, ok: bool):
+        with self._lock:
+            self.samples.setdefault(route, []).append(ms)
+            if not ok:
+                self.errors[route] = self.errors.get(route, 0) + 1
+
+    def summary(self, elapsed: float) -> dict:
+        with self._lock:
+            items = {k: sorted(v) for k, v in self.samples.items()}
+            errors = dict(self.errors)
+        routes = {}
+        for route, xs in sorted(items.items()):
+            routes[route] = {
+                "count": len(xs),
+                "errors": errors.get(route, 0),
+                "rps": round(len(xs) / elapsed, 2) if elapsed else 0.0,
+                "mean_ms": round(sum(xs) / len(xs), 2),
+                "p50_ms": round(_percentile(xs, 50), 2),
+                "p95_ms": round(_percentile(xs, 95), 2),
+                "p99_ms": round(_percentile(xs, 99), 2),
+                "max_ms": round(xs[-1], 2),
+            }
+        total = sum(r["count"] for name, r in routes.items() if not name.endswith("(ttfb)"))
+        return {
+            "elapsed_s": round(elapsed, 2),
+            "requests": total,
+            "rps": round(total / elapsed, 2) if elapsed else 0.0,
+            "errors": sum(errors.values()),
+            "routes": routes,
+        }
+
+
+def _percentile(sorted_xs, pct: float) -> float:
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_xs:
+        return 0.0
+    k = max(0, min(len(sorted_xs) - 1, int(round(pct / 100 * len(sorted_xs) + 0.5)) - 1))
+    return sorted_xs[k]
+
+
+class Client:
+    """Tiny HTTP client; one connection per request so it behaves the same against werkzeug and gunicorn."""
+
+    def __init__(self, base_url: str, stats: Stats):
+        parts = urlsplit(base_url)
+        self.host = parts.hostname
+        self.port = parts.port or (443 if parts.scheme == "https" else 80)
+        self.https = parts.scheme == "https"
+        self.prefix = parts.path.rstrip("/")
+        self.stats = stats
+
+    def _conn(self):
+        cls = http.client.HTTPSConnection if self.https else http.client.HTTPConnection
+        return cls(self.host, self.port, timeout=60)
+
+    def request(self, method: str, path: str, route: str, body=None, query=None, stream: bool = False):
+        """Send one request, record its latency under `route`, return (status, parsed json or None)."""
+        url = self.prefix + path + (("?" + urlencode(query)) if query else "")
+        headers = {"Accept": "application/json"}
+        data = None
+        if body is not None:
+            data = json.dumps(body, ensure_ascii=False).encode("utf-8")
+            headers["Content-Type"] = "application/json"
+        conn = self._conn()
+        t0 = time.perf_counter()
+        status, parsed = 0, None
+        try:
+            conn.request(method, url, body=data, headers=headers)
+            resp = conn.getresponse()
+            status = resp.status
+            if stream:
+                first = resp.read1(65536)
+                self.stats.add(route + " (ttfb)", (time.perf_counter() - t0) * 1000, 200 <= status < 400)
+                raw = first + resp.read()
+            else:
+                raw = resp.read()
+            if not stream and raw[:1] in (b"{", b"["):
+                try:
+                    parsed = json.loads(raw)
+                except ValueError:
+                    parsed = None
+        except (OSError, http.client.HTTPException):
+            status = 0
+        finally:
+            conn.close()
+        self.stats.add(route, (time.perf_counter() - t0) * 1000, 200 <= status < 400)
+        return status, parsed
+
+
+def _small_jpeg(rng: random.Random) -> str:
+    from PIL import Image
+
+    img = Image.new("RGB", (320, 240), (rng.randint(0, 255), rng.randint(0, 255), rng.randint(0, 255)))
+    buf = BytesIO()
+    img.save(buf, "JPEG", quality=80)
+    return "data:image/jpeg;base64," + b64encode(buf.getvalue()).decode("ascii")
+
+
+class Scenarios:
+    def __init__(self, client: Client, users: list, posts: list, seed: int):
+        self.client = client
+        self.users = users
+        self.posts = posts
+        self.seed = seed
+
+    def daily(self, rng: random.Random):
+        user = rng.choice(self.users)
+        c = self.client
+        c.request("POST", "/readdata", "POST /readdata", body={"table_name": "users", "user_id": user["user_id"]})
+        for kind in KINDS:
+            _, res = c.request("GET", f"/getjson/{kind}", "GET /getjson/<kind>", query={"user_id": user["user_id"], "limit": 50})
+            for row in ((res or {}).get("data") or [])[:20]:
+                c.request("GET", f"/getjson/{kind}/{row['id']}", "GET /getjson/<kind>/<file_id>")
+
+    def square(self, rng: random.Random):
+        user = rng.choice(self.users)
+        c = self.client
+        _, res = c.request("POST", "/square/list", "POST /square/list", body={"limit": 20, "current_user_id": user["user_id"]})
+        for post in ((res or {}).get("data") or [])[:5]:
+            c.request("POST", "/square/comments", "POST /square/comments",
+                      body={"post_id": post["id"], "current_user_id": user["user_id"]})
+
+    def chat(self, rng: random.Random):
+        user = rng.choice(self.users)
+        self.client.request("POST", "/deepseek/chat_stream", "POST /deepseek/chat_stream", stream=True, body={
+            "message": rng.choice(corpus.CHAT_PROMPTS),
+            "session_id": f"bench-{user['user_id']}-{rng.randint(0, 3)}",
+            "user_id": user["user_id"],
+        })
+
+    def upload(self, rng: random.Random):
+        user = rng.choice(self.users)
+        c = self.client
+        c.request("POST", "/upload_image", "POST /upload_image", body={
+            "user_id": user["user_id"], "username": user["username"],
+            "image_data": _small_jpeg(rng), "image_type": "diet",
+        })
+        kind = rng.choice(KINDS)
+        c.request("POST", f"/uploadjson/{kind}", "POST /uploadjson/<kind>", body={
+            "user_id": user["user_id"], "username": user["username"], "payload": corpus.payload(kind, rng),
+        })
+
+    def otp(self, rng: random.Random):
+        # fresh numbers each time so the per-phone cooldown does not turn the run into 429s
+        phone = f"137{rng.randint(0, 99999999):08d}"
+        self.client.request("POST", "/sms/send", "POST /sms/send", body={"phone": phone})
+
+
+def seed_data(client: Client, users: int, records: int, posts: int, seed: int):
+    """Register (or log into) bench users and give them records and square posts."""
+    rng = random.Random(seed)
+    accounts = []
+    for i in range(users):
+        username = f"bench{seed % 1000:03d}_{i:03d}"
+        password = "bench-password"
+        phone = f"139{seed % 100:02d}{i:06d}"
+        client.request("POST", "/account/register", "seed", body={
+            "username": username, "password": password, "age": 12, "phone": phone,
+        })
+        status, res = client.request("POST", "/login", "seed", body={"username": username, "password": password})
+        if status != 200 or not (res or {}).get("userId"):
+            raise SystemExit(f"could not register/login bench user {username} (status {status})")
+        accounts.append({"user_id": res["userId"], "username": username})
+
+    for i, user in enumerate(accounts):
+        for kind in KINDS:
+            for p in corpus.records(kind, records, seed=seed * 1000 + i):
+                client.request("POST", f"/uploadjson/{kind}", "seed", body={
+                    "user_id": user["user_id"], "username": user["username"], "payload": p,
+                })
+
+    post_ids, queued = [], []
+    for i in range(posts):
+        user = rng.choice(accounts)
+        _, res = client.request("POST", "/square/publish", "seed", body={
+            "user_id": user["user_id"], "username": user["username"], "text": corpus.reply_text(rng, 2),
+        })
+        pid = ((res or {}).get("data") or {}).get("id")
+        if pid:
+            post_ids.append(pid)
+            if res["data"].get("queued"):
+                queued.append(pid)
+            for _ in range(rng.randint(0, 6)):
+                commenter = rng.choice(accounts)
+                client.request("POST", "/square/comment", "seed", body={
+                    "post_id": pid, "user_id": commenter["user_id"], "username": commenter["username"],
+                    "text": rng.choice(corpus.REPLY_SENTENCES),
+                })
+    if queued:
+        wait_for_posts(client, accounts[0]["user_id"], queued[-200:])  # /square/list returns at most 200
+    return accounts, post_ids
+
+
+def wait_for_posts(client: Client, viewer_id: str, post_ids: list, timeout: float = 10.0):
+    """Poll /square/list until every id is in it; SystemExit if the write-behind journal never lands them."""
+    missing = set(post_ids)
+    deadline = time.monotonic() + timeout
+    while True:
+        _, res = client.request("POST", "/square/list", "seed", body={"limit": 200, "current_user_id": viewer_id})
+        missing -= {p.get("id") for p in (res or {}).get("data") or []}
+        if not missing:
+            return
+        if time.monotonic() > deadline:
+            raise SystemExit(f"{len(missing)} of {len(post_ids)} queued posts not in /square/list after "
+                             f"{timeout:.0f}s: the write-behind flush is failing (see the app.write_behind log)")
+        time.sleep(0.2)
+
+
+def parse_mix(spec: str) -> list:
+    mix = []
+    for part in (spec or "").split(","):
+        if not part.strip():
+            continue
+        name, _, weight = part.partition("=")
+        name = name.strip()
+        if not hasattr(Scenarios, name):
+            raise SystemExit(f"unknown scenario: {name}")
+        w = float(weight or 1)
+        if w > 0:
+            mix.append((name, w))
+    if not mix:
+        raise SystemExit("traffic mix is empty")
+    return mix
+
+
+def run(client: Client, scenarios: Scenarios, mix: list, users: int, duration: float, seed: int) -> float:
+    names = [n for n, _ in mix]
+    weights = [w for _, w in mix]
+    deadline = time.perf_counter() + duration
+
+    def vu(idx: int):
+        rng = random.Random(f"vu:{seed}:{idx}")
+        while time.perf_counter() < deadline:
+            name = rng.choices(names, weights)[0]
+            try:
+                getattr(scenarios, name)(rng)
+            except Exception as e:
+                client.stats.add(f"scenario {name}", 0.0, False)
+                print(f"[vu{idx}] {name} failed: {e}", file=sys.stderr)
+
+    threads = [threading.Thread(target=vu, args=(i,), name=f"vu{i}", daemon=True) for i in range(users)]
+    t0 = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return time.perf_counter() - t0
+
+
+def compare(report: dict, baseline: dict, threshold_pct: float, min_delta_ms: float = 2.0) -> list:
+    """Return one line per route whose p95 grew by more than threshold_pct (and at least min_delta_ms)."""
+    regressions = []
+    base_routes = baseline.get("routes") or {}
+    for route, cur in (report.get("routes") or {}).items():
+        base = base_routes.get(route)
+        if not base or not base.get("p95_ms"):
+            continue
+        delta = cur["p95_ms"] - base["p95_ms"]
+        pct = delta / base["p95_ms"] * 100
+        if pct > threshold_pct and delta > min_delta_ms:
+            regressions.append(f"{route}: p95 {base['p95_ms']}ms -> {cur['p95_ms']}ms (+{pct:.1f}%)")
+    return regressions
+
+
+def print_report(report: dict):
+    print(f"\n{report['requests']} requests in {report['elapsed_s']}s, {report['rps']} req/s, {report['errors']} errors")
+    print(f"{'route':<40} {'count':>7} {'err':>5} {'rps':>8} {'p50':>8} {'p95':>8} {'p99':>8} {'max':>8}")
+    for route, r in report["routes"].items():
+        print(f"{route:<40} {r['count']:>7} {r['errors']:>5} {r['rps']:>8} {r['p50_ms']:>8} {r['p95_ms']:>8} {r['p99_ms']:>8} {r['max_ms']:>8}")
+
+
+def _start_local_app(deepseek: FakeDeepSeek, sms: FakeAliyunSms):
+    """Import app.py with the provider URLs pointing at the fakes and serve it on an ephemeral port."""
+    os.environ["DEEPSEEK_API_URL"] = deepseek.api_url
+    os.environ.setdefault("DEEPSEEK_API_KEY", "bench")
+    os.environ["ALIYUN_SMS_ENDPOINT"] = sms.address
+    os.environ["ALIYUN_SMS_PROTOCOL"] = "http"
+    for key in ("ALIYUN_ACCESS_KEY_ID", "ALIYUN_ACCESS_KEY_SECRET", "ALIYUN_SIGN_NAME", "ALIYUN_TEMPLATE_CODE"):
+        os.environ.setdefault(key, "bench")
+    os.chdir(BACKEND_DIR)
+
+    from werkzeug.serving import make_server
+    from app import app
+
+    server = make_server("127.0.0.1", 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, name="bench-app", daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_port}"
+
+
+def main(argv=None) -> int:
+    ap = argparse.ArgumentParser(description="Replay a realistic traffic mix against the backend")
+    ap.add_argument("--target", help="base URL of a running backend; default boots app.py in-process")
+    ap.add_argument("--users", type=int, default=8, help="concurrent virtual users")
+    ap.add_argument("--duration", type=float, default=30.0, help="seconds of traffic after seeding")
+    ap.add_argument("--mix", default=DEFAULT_MIX, help=f"scenario weights (default: {DEFAULT_MIX})")
+    ap.add_argument("--seed", type=int, default=7)
+    ap.add_argument("--seed-users", type=int, default=10)
+    ap.add_argument("--seed-records", type=int, default=15, help="records per kind per user")
+    ap.add_argument("--seed-posts", type=int, default=40)
+    ap.add_argument("--deepseek-latency-ms", type=float, default=150.0, help="fake provider time to first byte")
+    ap.add_argument("--deepseek-token-ms", type=float, default=5.0, help="fake provider delay between SSE chunks")
+    ap.add_argument("--sms-latency-ms", type=float, default=80.0)
+    ap.add_argument("--out", help="write the JSON report here")
+    ap.add_argument("--baseline", help="JSON report to compare against")
+    ap.add_argument("--threshold", type=float, default=15.0, help="allowed p95 regression in percent")
+    args = ap.parse_args(argv)
+
+    mix = parse_mix(args.mix)
+    stats = Stats()
+    server = None
+    deepseek = FakeDeepSeek(latency_ms=args.deepseek_latency_ms, token_delay_ms=args.deepseek_token_ms, seed=args.seed).start()
+    sms = FakeAliyunSms(latency_ms=args.sms_latency_ms, seed=args.seed).start()
+    try:
+        if args.target:
+            base_url = args.target
+            print(f"driving {base_url}; the target must already point DEEPSEEK_API_URL at {deepseek.api_url} "
+                  f"and ALIYUN_SMS_ENDPOINT at {sms.address} (protocol http) to use the fakes")
+        else:
+            server, base_url = _start_local_app(deepseek, sms)
+            print(f"app listening on {base_url}")
+
+        seed_client = Client(base_url, Stats())
+        t0 = time.perf_counter()
+        accounts, post_ids = seed_data(seed_client, args.seed_users, args.seed_records, args.seed_posts, args.seed)
+        print(f"seeded {len(accounts)} users, {len(post_ids)} posts in {time.perf_counter() - t0:.1f}s")
+
+        client = Client(base_url, stats)
+        scenarios = Scenarios(client, accounts, post_ids, args.seed)
+        elapsed = run(client, scenarios, mix, args.users, args.duration, args.seed)
+    finally:
+        if server is not None:
+            server.shutdown()
+        deepseek.stop()
+        sms.stop()
+
+    report = stats.summary(elapsed)
+    report["meta"] = {
+        "at": datetime.now().isoformat(timespec="seconds"),
+        "target": args.target or "in-process",
+        "users": args.users,
+        "duration": args.duration,
+        "mix": dict(mix),
+        "seed": args.seed,
+        "deepseek_latency_ms": args.deepseek_latency_ms,
+        "sms_latency_ms": args.sms_latency_ms,
+    }
+    print_report(report)
+
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"report written to {args.out}")
+
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = compare(report, baseline, args.threshold)
+        if regressions:
+            print(f"\np95 regressions over {args.threshold}%:")
+            for line in regressions:
+                print("  " + line)
+            return 1
+        print(f"\nno p95 regression over {args.threshold}% against {args.baseline}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
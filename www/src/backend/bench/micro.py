@@ -0,0 +1,270 @@
+"""
+Micro-benchmarks for the pure-Python helpers that run on every request
+- deepseek: _detect_medical_topic, _analyze_response_for_citations, _process_user_data
+- uploadjson: _analyze_data_type (dataType hit, structural hit, keyword-scoring fallback)
+- getjson: record-date extraction / date filtering used by /getjson/<kind>?date=
+- records: compressing a record (+ summary) on upload, decompressing it on read
+- sms / account: normalize_cn_phone
+
+Every case runs over synthetic corpora of increasing size (bench/corpus.py, fixed seed) and
+reports the best-of-N wall time per batch and per item. With --baseline the run fails
+(exit code 1) when any case is slower than the baseline by more than --threshold percent.
+
+Usage (from src/backend):
+    python -m bench.micro --out bench/micro_baseline.json
+    python -m bench.micro --baseline bench/micro_baseline.json --threshold 20
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import platform
+import statistics
+from datetime import datetime
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if BACKEND_DIR not in sys.path:
+    sys.path.insert(0, BACKEND_DIR)
+
+from bench import corpus
+
+DEFAULT_SIZES = (10, 100, 1000)
+CASES = []
+
+
+def case(name: str):
+    """Register `setup(size) -> callable` as a benchmark case."""
+    def deco(setup):
+        CASES.append((name, setup))
+        return setup
+    return deco
+
+
+def _texts(rng: random.Random, n: int, sentences: int) -> list:
+    out = []
+    for i in range(n):
+        if i % 4 == 0:
+            out.append(rng.choice(corpus.CHAT_PROMPTS))
+        else:
+            out.append(corpus.reply_text(rng, rng.randint(1, sentences)))
+    return out
+
+
+@case("deepseek._detect_medical_topic")
+def _setup_detect(size: int):
+    from routes.deepseek import _detect_medical_topic
+
+    texts = _texts(random.Random(f"detect:{size}"), size, 4)
+    return lambda: [_detect_medical_topic(t) for t in texts]
+
+
+@case("deepseek._analyze_response_for_citations")
+def _setup_citations(size: int):
+    from routes.deepseek import _analyze_response_for_citations
+
+    rng = random.Random(f"citations:{size}")
+    pairs = [(corpus.reply_text(rng, rng.randint(2, 20)), rng.choice(corpus.CHAT_PROMPTS)) for _ in range(size)]
+    return lambda: [_analyze_response_for_citations(r, q) for r, q in pairs]
+
+
+@case("deepseek._process_user_data")
+def _setup_process(size: int):
+    from routes.deepseek import _process_user_data
+
+    raw = {kind: corpus.db_rows(kind, size) for kind in ("metrics", "diet", "case")}
+    return lambda: _process_user_data(raw)
+
+
+@case("uploadjson._analyze_data_type")
+def _setup_analyze(size: int):
+    from routes.uploadjson import _analyze_data_type
+
+    rng = random.Random(f"analyze:{size}")
+    docs = []
+    for i, kind in enumerate(rng.choice(list(corpus.GENERATORS)) for _ in range(size)):
+        extra = {"image_bytes": 4096} if kind in ("diet", "case") else {}
+        doc = corpus.payload(kind, rng, **extra)
+        mode = i % 3
+        if mode >= 1:
+            # uploads from older clients: no dataType
+            doc["exportInfo"].pop("dataType", None)
+        if mode == 2:
+            # unknown wrapper key forces the keyword-scoring fallback over the whole document
+            body_key = next(k for k in doc if k != "exportInfo")
+            doc["data"] = doc.pop(body_key)
+        docs.append(doc)
+    return lambda: [_analyze_data_type(d) for d in docs]
+
+
+@case("getjson._matches_date")
+def _setup_dates(size: int):
+    from routes.getjson import _matches_date
+
+    rng = random.Random(f"dates:{size}")
+    docs = []
+    for _ in range(size):
+        kind = rng.choice(("metrics", "diet", "case", "symptoms"))
+        docs.append((kind, corpus.payload(kind, rng)))
+    target = "2025-09-15"
+    return lambda: [_matches_date(d, kind, target) for kind, d in docs]
+
+
+def _record_texts(size: int) -> list:
+    rng = random.Random(f"records:{size}")
+    out = []
+    for _ in range(size):
+        kind = rng.choice(list(corpus.GENERATORS))
+        out.append((kind, json.dumps(corpus.payload(kind, rng), ensure_ascii=False, separators=(",", ":"))))
+    return out
+
+
+@case("records.storage_values")
+def _setup_record_encode(size: int):
+    from routes.records import storage_values
+
+    texts = _record_texts(size)
+    return lambda: [storage_values(kind, text) for kind, text in texts]
+
+
+@case("records.decode")
+def _setup_record_decode(size: int):
+    from routes.records import encode, decode
+
+    stored = [encode(text) for _, text in _record_texts(size)]
+    return lambda: [decode(*s) for s in stored]
+
+
+def _phones(rng: random.Random, n: int) -> list:
+    out = []
+    for _ in range(n):
+        digits = f"1{rng.randint(3, 9)}{rng.randint(0, 999999999):09d}"
+        form = rng.randint(0, 5)
+        if form == 0:
+            out.append("+86" + digits)
+        elif form == 1:
+            out.append("86" + digits)
+        elif form == 2:
+            out.append(f"{digits[:3]} {digits[3:7]} {digits[7:]}")
+        elif form == 3:
+            out.append(f"+86-{digits[:3]}-{digits[3:7]}-{digits[7:]}")
+        elif form == 4:
+            out.append(digits)
+        else:
+            out.append("12" + digits[2:])  # invalid prefix
+    return out
+
+
+@case("sms.normalize_cn_phone")
+def _setup_sms_phone(size: int):
+    from routes.sms import normalize_cn_phone
+
+    phones = _phones(random.Random(f"phone:{size}"), size)
+    return lambda: [normalize_cn_phone(p) for p in phones]
+
+
+@case("account.normalize_cn_phone")
+def _setup_account_phone(size: int):
+    from routes.account import normalize_cn_phone
+
+    phones = _phones(random.Random(f"phone:{size}"), size)
+    return lambda: [normalize_cn_phone(p) for p in phones]
+
+
+def measure(fn, repeat: int, min_time: float) -> list:
+    """Run fn in loops long enough to time reliably; return per-call seconds for each repeat."""
+    fn()  # warm caches / lazy imports
+    loops = 1
+    while True:
+        t0 = time.perf_counter()
+        for _ in range(loops):
+            fn()
+        elapsed = time.perf_counter() - t0
+        if elapsed >= min_time or loops >= 1 << 20:
+            break
+        loops *= 2
+    timings = [elapsed / loops]
+    for _ in range(repeat - 1):
+        t0 = time.perf_counter()
+        for _ in range(loops):
+            fn()
+        timings.append((time.perf_counter() - t0) / loops)
+    return timings
+
+
+def run(sizes, repeat: int, min_time: float, only: str = None) -> dict:
+    results = {}
+    for name, setup in CASES:
+        if only and only not in name:
+            continue
+        for size in sizes:
+            timings = measure(setup(size), repeat, min_time)
+            best = min(timings)
+            key = f"{name}[{size}]"
+            results[key] = {
+                "size": size,
+                "best_s": best,
+                "median_s": statistics.median(timings),
+                "per_item_us": round(best / size * 1e6, 3),
+            }
+            print(f"{key:<52} best {best * 1e3:10.3f} ms   {results[key]['per_item_us']:10.3f} us/item")
+    return results
+
+
+def compare(results: dict, baseline: dict, threshold_pct: float) -> list:
+    regressions = []
+    for key, cur in results.items():
+        base = (baseline.get("results") or {}).get(key)
+        if not base or not base.get("best_s"):
+            continue
+        pct = (cur["best_s"] - base["best_s"]) / base["best_s"] * 100
+        if pct > threshold_pct:
+            regressions.append(f"{key}: {base['best_s'] * 1e3:.3f}ms -> {cur['best_s'] * 1e3:.3f}ms (+{pct:.1f}%)")
+    return regressions
+
+
+def main(argv=None) -> int:
+    ap = argparse.ArgumentParser(description="Micro-benchmarks for CPU-bound route helpers")
+    ap.add_argument("--sizes", default=",".join(str(s) for s in DEFAULT_SIZES), help="corpus sizes, comma separated")
+    ap.add_argument("--repeat", type=int, default=5)
+    ap.add_argument("--min-time", type=float, default=0.2, help="seconds per timing sample")
+    ap.add_argument("-k", dest="only", help="only run cases whose name contains this string")
+    ap.add_argument("--out", help="write results JSON here")
+    ap.add_argument("--baseline", help="results JSON to compare against")
+    ap.add_argument("--threshold", type=float, default=20.0, help="allowed slowdown in percent")
+    args = ap.parse_args(argv)
+
+    os.chdir(BACKEND_DIR)
+    sizes = [int(s) for s in args.sizes.split(",") if s.strip()]
+    results = run(sizes, max(1, args.repeat), args.min_time, args.only)
+    report = {
+        "meta": {
+            "at": datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "repeat": args.repeat,
+        },
+        "results": results,
+    }
+
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"results written to {args.out}")
+
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print(f"\nregressions over {args.threshold}%:")
+            for line in regressions:
+                print("  " + line)
+            return 1
+        print(f"\nno regression over {args.threshold}% against {args.baseline}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
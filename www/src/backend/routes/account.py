@@ -3,6 +3,10 @@ from dotenv import load_dotenv
 from flask import Blueprint, request, jsonify
 import mysql.connector
 from mysql.connector import errors as mysql_errors
+from routes.dbstats import trace_connection
+from routes.credentials import hash_password, CredentialBusy
+from routes.userstore import ensure_users_schema
+from routes.profile_cache import invalidate as invalidate_profile
 import uuid
 import re
 import logging
@@ -28,7 +32,7 @@ def _get_conn():
         cur.execute("SET SESSION MAX_EXECUTION_TIME=15000")  # 15s
     finally:
         cur.close()
-    return conn
+    return trace_connection(conn)
 
 # Supported input:+86***********、86***********、1**********（11）
 PHONE_RE = re.compile(r"^\+?\d{6,15}$")
@@ -59,7 +63,7 @@ def register():
         return '', 200
     try:
         data = request.get_json(silent=True) or {}
-        logger.info("/register request data=%s", data)
+        logger.info("/register body_keys=%s", list(data.keys()) if isinstance(data, dict) else None)
 
         username = (data.get("username") or '').strip()
         password = (data.get("password") or '')
@@ -82,9 +86,13 @@ def register():
             logger.warning("/register missing fields username=%s age=%s phone=%s", username, age, phone)
             return jsonify({"success": False, "message": "缺少用户名、密码、年龄或手机号，或手机号格式不正确（仅支持中国大陆）"}), 400
 
+        # Hash before taking a DB connection so the KDF does not hold one open
+        password_hash = hash_password(password)
+
         conn = _get_conn()
         cursor = conn.cursor(dictionary=True)
         try:
+            ensure_users_schema(conn)
             # If a placeholder account (username=phone and phone_number is empty) has been created in sms/verify before, claim it directly and update it to the official information
             cursor.execute(
                 "SELECT user_id FROM users WHERE username=%s AND (phone_number IS NULL OR phone_number='')",
@@ -94,7 +102,7 @@ def register():
             if placeholder:
                 cursor.execute(
                     "UPDATE users SET username=%s, password=%s, age=%s, phone_number=%s WHERE user_id=%s",
-                    (username, password, age, phone, placeholder['user_id'])
+                    (username, password_hash, age, phone, placeholder['user_id'])
                 )
                 conn.commit()
                 logger.info("/register updated placeholder user_id=%s phone=%s username=%s", placeholder['user_id'], phone, username)
@@ -117,7 +125,7 @@ def register():
             user_id = str(uuid.uuid4())
             cursor.execute(
                 "INSERT INTO users (user_id, username, password, age, phone_number) VALUES (%s, %s, %s, %s, %s)",
-                (user_id, username, password, age, phone)
+                (user_id, username, password_hash, age, phone)
             )
             conn.commit()
             logger.info("/register new user created user_id=%s username=%s phone=%s", user_id, username, phone)
@@ -133,6 +141,9 @@ def register():
 
         return jsonify({"success": True, "message": "注册成功"})
 
+    except CredentialBusy:
+        logger.warning("/register password hashing pool saturated")
+        return jsonify({"success": False, "message": "服务器繁忙，请稍后重试"}), 503
     except mysql_errors.Error as e:
         # 3024: MAX_EXECUTION_TIME exceeded; 1205: Lock wait timeout; 1213: Deadlock found
         if getattr(e, 'errno', None) in (3024, 1205, 1213):
@@ -217,6 +228,24 @@ def delete_account():
                     logger.warning("/delete_account failed to delete from %s: %s", table, str(e))
                     # 继续删除其他表，不因某个表删除失败而中断
             
+            # 删除记录同步日志（owner 为 user_id，旧的仅用户名上传以 username 为 owner）
+            try:
+                owners = [o for o in (user_id, username) if o]
+                in_clause = ",".join(["%s"] * len(owners))
+                cursor.execute(f"DELETE FROM record_changes WHERE owner IN ({in_clause})", tuple(owners))
+                deleted_counts["record_changes"] = cursor.rowcount
+                cursor.execute(f"DELETE FROM record_sync_state WHERE owner IN ({in_clause})", tuple(owners))
+            except Exception as e:
+                logger.warning("/delete_account failed to delete sync log: %s", str(e))
+
+            # 删除广场实时事件中该用户的内容（保留期内可被断线重连补发）
+            if user_id:
+                try:
+                    cursor.execute("DELETE FROM square_events WHERE author_id=%s", (user_id,))
+                    deleted_counts["square_events"] = cursor.rowcount
+                except Exception as e:
+                    logger.warning("/delete_account failed to delete square events: %s", str(e))
+
             # 删除短信验证码记录（如果有手机号）
             if phone_number:
                 try:
@@ -325,6 +354,7 @@ def delete_account():
                 return jsonify({"success": False, "message": "未找到对应的账号"}), 404
             
             conn.commit()
+            invalidate_profile(user_id or None, username or None)
             logger.info("/delete_account success username=%s user_id=%s deleted_counts=%s", 
                        username, user_id, deleted_counts)
         finally:
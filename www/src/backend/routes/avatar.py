@@ -5,13 +5,21 @@ File: avatar.py
 Description: Avatar upload and management routes for user profile pictures.
 """
 import os
+import re
+import time
 import uuid
 import base64
+import hashlib
 import logging
 from dotenv import load_dotenv
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, request, jsonify, g, make_response, send_from_directory, abort
 import mysql.connector
 from mysql.connector import errors as mysql_errors
+from routes.dbstats import trace_connection, require_admin
+from routes.session_token import resolve_identity, AuthError
+from routes.userstore import PROFILE_COLUMNS, ensure_users_schema
+from routes.profile_cache import get_profile, invalidate as invalidate_profile, profile_etag
+from routes.conditional import not_modified
 from PIL import Image
 import io
 
@@ -41,6 +49,14 @@ AVATAR_SIZE = (200, 200)  # 最终头像尺寸 200x200
 # 确保头像目录存在
 os.makedirs(AVATAR_UPLOAD_FOLDER, exist_ok=True)
 
+# 头像文件按内容版本命名 {user_id}.{sha256 前 12 位}.png，URL 随内容变化，可永久缓存
+AVATAR_URL_PREFIX = "/avatars/"
+AVATAR_VERSION_LEN = 12
+AVATAR_CACHE_MAX_AGE = 365 * 24 * 3600
+_VERSIONED_AVATAR_RE = re.compile(r"^(?P<owner>[A-Za-z0-9_\-]+)\.(?P<version>[0-9a-f]{%d})\.png$" % AVATAR_VERSION_LEN)
+# cleanup_avatars 不删除最近修改的文件（可能刚上传、数据库尚未提交）
+AVATAR_GC_GRACE_SECONDS = int(os.getenv("AVATAR_GC_GRACE_SECONDS", "3600"))
+
 def _get_conn():
     """获取数据库连接"""
     conn = mysql.connector.connect(**db_config, connection_timeout=5, autocommit=False)
@@ -49,15 +65,15 @@ def _get_conn():
         cur.execute("SET SESSION MAX_EXECUTION_TIME=15000")  # 15s
     finally:
         cur.close()
-    return conn
+    return trace_connection(conn)
 
 def allowed_file(filename):
     """检查文件扩展名是否允许"""
     return '.' in filename and \
            filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
-def process_avatar_image(image_data, user_id):
-    """处理头像图片，前端已经完成压缩和裁剪，这里直接保存"""
+def encode_avatar(image_data):
+    """解码并规范化头像（前端已完成压缩和裁剪），返回 (PNG 字节, 内容版本号)"""
     try:
         # 如果是base64数据，解码
         if isinstance(image_data, str) and image_data.startswith('data:image'):
@@ -74,25 +90,68 @@ def process_avatar_image(image_data, user_id):
             # 如果尺寸不对，强制调整
             image = image.resize(AVATAR_SIZE, Image.Resampling.LANCZOS)
         
-        # 保存头像文件，使用用户ID作为文件名
-        filename = f"{user_id}.png"
-        filepath = os.path.join(AVATAR_UPLOAD_FOLDER, filename)
-        
-        # 直接保存，前端已经完成了压缩和圆形处理
-        # 由于文件名固定为 {user_id}.png，新文件会直接覆盖旧文件
-        image.save(filepath, 'PNG', optimize=True, compress_level=6)
-        
-        # 记录文件大小
-        file_size = os.path.getsize(filepath)
-        logger.info(f"头像文件已保存: {filename}, 大小: {file_size} bytes")
-        
-        # 返回相对路径（修正为正确的路径）
-        return f"/src/statics/avatars/{filename}"
+        buf = io.BytesIO()
+        image.save(buf, 'PNG', optimize=True, compress_level=6)
+        png = buf.getvalue()
+        return png, hashlib.sha256(png).hexdigest()[:AVATAR_VERSION_LEN]
         
     except Exception as e:
         logger.error(f"处理头像图片失败: {str(e)}")
         raise Exception("头像处理失败")
 
+
+def avatar_filename(user_id, version):
+    return f"{user_id}.{version}.png"
+
+
+def write_avatar(user_id, png, version):
+    """写入版本化头像文件（先写临时文件再原子替换），返回对外 URL"""
+    filename = avatar_filename(user_id, version)
+    filepath = os.path.join(AVATAR_UPLOAD_FOLDER, filename)
+    if os.path.exists(filepath):
+        # 同内容的旧版本被复用：刷新 mtime，使并发上传的 gc_avatar_versions 把它当作新文件保留
+        try:
+            os.utime(filepath)
+        except OSError:
+            pass
+    else:
+        tmp_path = f"{filepath}.{uuid.uuid4().hex}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(png)
+        os.replace(tmp_path, filepath)
+    logger.info("头像文件已保存: %s, 大小: %d bytes", filename, len(png))
+    return AVATAR_URL_PREFIX + filename
+
+
+def gc_avatar_versions(user_id, keep):
+    """
+    删除该用户除 keep 以外的头像版本（含旧的固定文件名 {user_id}.png），返回删除数量。
+    AVATAR_GC_GRACE_SECONDS 内写入的版本不删：同一用户并发上传时，另一个请求刚提交的文件不能被误删
+    """
+    removed = 0
+    legacy = f"{user_id}.png"
+    cutoff = time.time() - AVATAR_GC_GRACE_SECONDS
+    try:
+        names = os.listdir(AVATAR_UPLOAD_FOLDER)
+    except OSError:
+        return 0
+    for name in names:
+        if name in keep:
+            continue
+        m = _VERSIONED_AVATAR_RE.match(name)
+        if name != legacy and not (m and m.group('owner') == str(user_id)):
+            continue
+        try:
+            path = os.path.join(AVATAR_UPLOAD_FOLDER, name)
+            if os.path.getmtime(path) > cutoff:
+                continue
+            os.remove(path)
+            removed += 1
+        except OSError as e:
+            logger.warning("删除旧头像失败 %s: %s", name, e)
+    return removed
+
+
 @avatar_blueprint.route('/upload_avatar', methods=['POST'])
 def upload_avatar():
     """上传用户头像"""
@@ -103,9 +162,12 @@ def upload_avatar():
         data = request.get_json(silent=True) or {}
         logger.info("/upload_avatar request data keys=%s", list(data.keys()))
         
-        # 获取用户标识
-        user_id = data.get('user_id')
-        username = data.get('username')
+        # 获取用户标识（优先使用会话令牌中的身份，兼容旧客户端在请求体中传 user_id / username）
+        try:
+            user_id, username = resolve_identity(data)
+        except AuthError as e:
+            logger.warning("/upload_avatar auth rejected status=%s", e.status)
+            return jsonify({'success': False, 'message': e.message}), e.status
         
         if not user_id and not username:
             logger.warning("/upload_avatar missing user identity")
@@ -123,59 +185,74 @@ def upload_avatar():
                 'message': '缺少头像数据'
             }), 400
         
-        # 处理头像图片
-        avatar_url = process_avatar_image(avatar_data, user_id or username)
+        # 处理头像图片（内容哈希即版本号）
+        png, version = encode_avatar(avatar_data)
         
         # 更新数据库中的avatar_url字段
         conn = _get_conn()
         cursor = conn.cursor()
+        avatar_url = None
+        old_avatar_url = None
         try:
-            # 首先检查用户是否存在
-            if user_id:
-                cursor.execute("SELECT user_id FROM users WHERE user_id=%s", (user_id,))
-            else:
-                cursor.execute("SELECT user_id FROM users WHERE username=%s", (username,))
-            
-            user_record = cursor.fetchone()
-            if not user_record:
-                logger.warning("/upload_avatar user not found user_id=%s username=%s", user_id, username)
-                return jsonify({
-                    'success': False,
-                    'message': '用户不存在'
-                }), 404
-            
-            # 检查avatar_url字段是否存在，如果不存在则添加
-            cursor.execute("SHOW COLUMNS FROM users LIKE 'avatar_url'")
-            if not cursor.fetchone():
-                logger.info("/upload_avatar adding avatar_url column to users table")
-                cursor.execute("ALTER TABLE users ADD COLUMN avatar_url VARCHAR(500) NULL")
+            # 令牌已证明用户身份，无需查库；旧客户端（请求体传身份）仍需检查用户是否存在
+            if g.get('identity') is None:
+                if user_id:
+                    cursor.execute("SELECT user_id FROM users WHERE user_id=%s", (user_id,))
+                else:
+                    cursor.execute("SELECT user_id FROM users WHERE username=%s", (username,))
+
+                user_record = cursor.fetchone()
+                if not user_record:
+                    logger.warning("/upload_avatar user not found user_id=%s username=%s", user_id, username)
+                    return jsonify({
+                        'success': False,
+                        'message': '用户不存在'
+                    }), 404
+                # 文件名始终使用 user_id
+                user_id = user_record[0]
             
-            # 获取用户当前的头像URL（如果存在）
-            old_avatar_url = None
-            if user_id:
-                cursor.execute("SELECT avatar_url FROM users WHERE user_id=%s", (user_id,))
-            else:
-                cursor.execute("SELECT avatar_url FROM users WHERE username=%s", (username,))
+            # avatar_url 列等 users 表结构：每个进程只检查一次
+            ensure_users_schema(conn)
             
+            # 获取用户当前的头像URL（如果存在），新版本生效后保留它一轮，避免刚渲染的页面引用失效
+            cursor.execute("SELECT avatar_url FROM users WHERE user_id=%s", (user_id,))
             user_data = cursor.fetchone()
             if user_data and user_data[0]:
                 old_avatar_url = user_data[0]
                 logger.info("/upload_avatar found old avatar: %s", old_avatar_url)
             
-            # 更新用户的头像URL
-            if user_id:
-                cursor.execute("UPDATE users SET avatar_url=%s WHERE user_id=%s", (avatar_url, user_id))
-            else:
-                cursor.execute("UPDATE users SET avatar_url=%s WHERE username=%s", (avatar_url, username))
-            
+            avatar_url = write_avatar(user_id, png, version)
+            cursor.execute("UPDATE users SET avatar_url=%s WHERE user_id=%s", (avatar_url, user_id))
             conn.commit()
+            invalidate_profile(user_id, username)
             logger.info("/upload_avatar success user_id=%s username=%s avatar_url=%s", user_id, username, avatar_url)
             
-            # 由于现在使用固定的文件名 {user_id}.png，新文件会直接覆盖旧文件
-            # 不需要手动删除旧文件
+            keep = {avatar_filename(user_id, version)}
+            if old_avatar_url:
+                keep.add(old_avatar_url.split('/')[-1])
+            # 提交后再读一次：同一用户的另一次上传可能在本请求之后提交，它的版本才是现在生效的
+            try:
+                cursor.execute("SELECT avatar_url FROM users WHERE user_id=%s", (user_id,))
+                current = cursor.fetchone()
+                conn.commit()
+            except mysql_errors.Error as e:
+                # 已提交，不能走下面的回滚分支；本次不清理，留给 /cleanup_avatars
+                logger.warning("/upload_avatar skip gc, re-read failed user_id=%s: %s", user_id, e)
+            else:
+                if current and current[0]:
+                    keep.add(current[0].split('/')[-1])
+                removed = gc_avatar_versions(user_id, keep)
+                if removed:
+                    logger.info("/upload_avatar removed %d old avatar version(s) user_id=%s", removed, user_id)
             
         except mysql_errors.Error as e:
             conn.rollback()
+            # 数据库未更新：新写入的版本文件无人引用，删除之
+            if avatar_url and avatar_url != old_avatar_url:
+                try:
+                    os.remove(os.path.join(AVATAR_UPLOAD_FOLDER, avatar_url.split('/')[-1]))
+                except OSError:
+                    pass
             if getattr(e, 'errno', None) in (3024, 1205, 1213):
                 logger.warning("/upload_avatar db timeout/deadlock errno=%s msg=%s", getattr(e, 'errno', None), str(e))
                 return jsonify({"success": False, "message": "数据库超时或死锁，请稍后重试"}), 504
@@ -206,52 +283,63 @@ def upload_avatar():
             'message': f'头像上传失败: {str(e)}'
         }), 500
 
+def _load_profile(user_id, username):
+    """Profile row for the shared profile cache (same columns as /readdata)."""
+    conn = _get_conn()
+    cursor = conn.cursor(dictionary=True)
+    try:
+        if user_id:
+            cursor.execute(f"SELECT {PROFILE_COLUMNS} FROM users WHERE user_id=%s", (user_id,))
+        else:
+            cursor.execute(f"SELECT {PROFILE_COLUMNS} FROM users WHERE username=%s", (username,))
+        return cursor.fetchone()
+    finally:
+        try:
+            cursor.close()
+        except Exception:
+            pass
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+
 @avatar_blueprint.route('/get_avatar/<user_id>', methods=['GET'])
 def get_avatar(user_id):
-    """获取用户头像"""
+    """获取用户头像（走进程内资料缓存，支持 ETag / 304）"""
     try:
-        conn = _get_conn()
-        cursor = conn.cursor(dictionary=True)
-        try:
-            # 从数据库获取用户的头像URL
-            cursor.execute("SELECT avatar_url FROM users WHERE user_id=%s", (user_id,))
-            user_record = cursor.fetchone()
-            
-            if not user_record:
-                logger.warning("/get_avatar user not found user_id=%s", user_id)
-                return jsonify({
-                    'success': False,
-                    'message': '用户不存在'
-                }), 404
-            
-            avatar_url = user_record.get('avatar_url')
-            if not avatar_url:
-                # 如果没有头像，返回默认头像
-                avatar_url = "/statics/avatars/default.png"
-            
+        user_record = get_profile(user_id, None, _load_profile)
+        if not user_record:
+            logger.warning("/get_avatar user not found user_id=%s", user_id)
             return jsonify({
+                'success': False,
+                'message': '用户不存在'
+            }), 404
+
+        avatar_url = user_record.get('avatar_url')
+        if not avatar_url:
+            # 如果没有头像，返回默认头像
+            avatar_url = "/statics/avatars/default.png"
+
+        payload = {'avatar_url': avatar_url}
+        etag = profile_etag(payload)
+        if not_modified(etag):
+            resp = make_response('', 304)
+        else:
+            resp = jsonify({
                 'success': True,
-                'data': {
-                    'avatar_url': avatar_url
-                }
-            }), 200
-            
-        except mysql_errors.Error as e:
-            if getattr(e, 'errno', None) in (3024, 1205, 1213):
-                logger.warning("/get_avatar db timeout/deadlock errno=%s msg=%s", getattr(e, 'errno', None), str(e))
-                return jsonify({"success": False, "message": "数据库超时或死锁，请稍后重试"}), 504
-            logger.exception("/get_avatar db error: %s", e)
-            return jsonify({"success": False, "message": "数据库错误", "error": str(e)}), 500
-        finally:
-            try:
-                cursor.close()
-            except Exception:
-                pass
-            try:
-                conn.close()
-            except Exception:
-                pass
-        
+                'data': payload
+            })
+        resp.headers["ETag"] = etag
+        resp.headers["Cache-Control"] = "private, no-cache"
+        return resp
+
+    except mysql_errors.Error as e:
+        if getattr(e, 'errno', None) in (3024, 1205, 1213):
+            logger.warning("/get_avatar db timeout/deadlock errno=%s msg=%s", getattr(e, 'errno', None), str(e))
+            return jsonify({"success": False, "message": "数据库超时或死锁，请稍后重试"}), 504
+        logger.exception("/get_avatar db error: %s", e)
+        return jsonify({"success": False, "message": "数据库错误", "error": str(e)}), 500
     except Exception as e:
         logger.exception("/get_avatar server error: %s", e)
         return jsonify({
@@ -259,60 +347,81 @@ def get_avatar(user_id):
             'message': f'获取头像失败: {str(e)}'
         }), 500
 
+@avatar_blueprint.route('/avatars/<path:filename>', methods=['GET'])
+def serve_avatar(filename):
+    """按版本号提供头像文件：内容不可变，强 ETag（版本号）+ Cache-Control: immutable"""
+    m = _VERSIONED_AVATAR_RE.match(filename)
+    if not m:
+        abort(404)
+    resp = send_from_directory(AVATAR_UPLOAD_FOLDER, filename, mimetype='image/png',
+                               etag=m.group('version'), max_age=AVATAR_CACHE_MAX_AGE)
+    resp.headers['Cache-Control'] = f"public, max-age={AVATAR_CACHE_MAX_AGE}, immutable"
+    return resp
+
+
 @avatar_blueprint.route('/cleanup_avatars', methods=['POST'])
 def cleanup_avatars():
-    """清理孤立的头像文件（管理员功能）"""
+    """清理孤立的头像文件（管理员功能，需 X-Admin-Token）：删除未被 users.avatar_url 引用的版本化/旧版头像"""
+    require_admin()
     try:
         # 获取数据库中所有有效的头像URL
         conn = _get_conn()
         cursor = conn.cursor()
         try:
-            cursor.execute("SELECT avatar_url FROM users WHERE avatar_url IS NOT NULL AND avatar_url != ''")
+            cursor.execute("SELECT user_id, avatar_url FROM users")
             valid_avatars = set()
+            user_ids = set()
             for row in cursor.fetchall():
-                if row[0]:
-                    filename = row[0].split('/')[-1]
-                    valid_avatars.add(filename)
-            
-            # 获取文件系统中的所有头像文件
-            if os.path.exists(AVATAR_UPLOAD_FOLDER):
-                all_files = os.listdir(AVATAR_UPLOAD_FOLDER)
-                orphaned_files = []
-                
-                for filename in all_files:
-                    if filename.startswith('avatar_') and filename not in valid_avatars:
-                        orphaned_files.append(filename)
-                
-                # 删除孤立文件
-                deleted_count = 0
-                for filename in orphaned_files:
-                    try:
-                        filepath = os.path.join(AVATAR_UPLOAD_FOLDER, filename)
-                        os.remove(filepath)
-                        deleted_count += 1
-                        logger.info("Cleaned up orphaned avatar: %s", filename)
-                    except Exception as e:
-                        logger.warning("Failed to delete orphaned avatar %s: %s", filename, str(e))
-                
-                return jsonify({
-                    'success': True,
-                    'message': f'清理完成，删除了 {deleted_count} 个孤立文件',
-                    'data': {
-                        'deleted_count': deleted_count,
-                        'orphaned_files': orphaned_files
-                    }
-                }), 200
-            else:
-                return jsonify({
-                    'success': True,
-                    'message': '头像目录不存在',
-                    'data': {'deleted_count': 0}
-                }), 200
-                
+                user_ids.add(str(row[0]))
+                if row[1]:
+                    valid_avatars.add(row[1].split('/')[-1])
         finally:
             cursor.close()
             conn.close()
-            
+
+        if not os.path.exists(AVATAR_UPLOAD_FOLDER):
+            return jsonify({
+                'success': True,
+                'message': '头像目录不存在',
+                'data': {'deleted_count': 0}
+            }), 200
+
+        # 版本化文件 {user_id}.{version}.png 与旧的固定文件名 {user_id}.png；default.png 等其它文件不动
+        cutoff = time.time() - AVATAR_GC_GRACE_SECONDS
+        orphaned_files = []
+        for filename in os.listdir(AVATAR_UPLOAD_FOLDER):
+            if filename in valid_avatars:
+                continue
+            m = _VERSIONED_AVATAR_RE.match(filename)
+            legacy_owner = filename[:-4] if filename.endswith('.png') else None
+            if not m and legacy_owner not in user_ids:
+                continue
+            try:
+                if os.path.getmtime(os.path.join(AVATAR_UPLOAD_FOLDER, filename)) > cutoff:
+                    continue
+            except OSError:
+                continue
+            orphaned_files.append(filename)
+
+        # 删除孤立文件
+        deleted_count = 0
+        for filename in orphaned_files:
+            try:
+                os.remove(os.path.join(AVATAR_UPLOAD_FOLDER, filename))
+                deleted_count += 1
+                logger.info("Cleaned up orphaned avatar: %s", filename)
+            except Exception as e:
+                logger.warning("Failed to delete orphaned avatar %s: %s", filename, str(e))
+
+        return jsonify({
+            'success': True,
+            'message': f'清理完成，删除了 {deleted_count} 个孤立文件',
+            'data': {
+                'deleted_count': deleted_count,
+                'orphaned_files': orphaned_files
+            }
+        }), 200
+
     except Exception as e:
         logger.exception("/cleanup_avatars error: %s", e)
         return jsonify({
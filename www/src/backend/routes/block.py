@@ -13,6 +13,7 @@ from dotenv import load_dotenv
 from flask import Blueprint, request, jsonify
 import mysql.connector
 from mysql.connector import errors as mysql_errors
+from routes.dbstats import trace_connection
 
 load_dotenv()
 
@@ -35,7 +36,7 @@ def _get_conn():
         cur.execute("SET SESSION MAX_EXECUTION_TIME=15000")
     finally:
         cur.close()
-    return conn
+    return trace_connection(conn)
 
 
 def _ensure_table(conn):
@@ -223,7 +224,7 @@ def list_blocked_users():
         for r in rows:
             blocked_users.append({
                 "user_id": r.get("blocked_id"),
-                "blocked_at": r.get("created_at").isoformat() if r.get("created_at") else None
+                "blocked_at": r.get("created_at")
             })
         
         return jsonify({
@@ -0,0 +1,89 @@
+"""
+Conditional GET for read endpoints
+- @conditional(validator) calls validator(*view_args) before the view; it returns a cheap version
+  (tag, last_modified) of what the view would serve, or None to serve normally
+- a request whose If-None-Match (or, without one, If-Modified-Since) still matches is answered
+  304 without running the view, so the expensive query and the JSON encoding are both skipped;
+  otherwise the view runs and a 200 gets ETag / Last-Modified / Cache-Control: private, no-cache
+- the version is read before the view runs, so a concurrent write can only make a tag older
+  than its body (one extra refetch later), never a 304 for data that changed
+- not_modified() is the If-None-Match check shared with the profile routes
+"""
+import hashlib
+import logging
+from functools import wraps
+
+from flask import request, current_app
+
+logger = logging.getLogger("app.conditional")
+
+CACHE_CONTROL = "private, no-cache"
+
+
+def _opaque(tag: str) -> str:
+    return tag[2:] if tag.startswith("W/") else tag
+
+
+def not_modified(etag: str) -> bool:
+    """True if the request's If-None-Match already names etag (weak comparison)."""
+    header = request.headers.get("If-None-Match") or ""
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    return _opaque(etag) in [_opaque(tag.strip()) for tag in header.split(",")]
+
+
+def _not_modified_since(last_modified) -> bool:
+    since = request.if_modified_since
+    if since is None or last_modified is None:
+        return False
+    if last_modified.tzinfo is None:
+        since = since.replace(tzinfo=None)  # DB timestamps are naive; compare like for like
+    return last_modified.replace(microsecond=0) <= since
+
+
+def _etag(tag) -> str:
+    # The endpoint and query are part of the tag: the same version renders differently per URL
+    raw = f"{request.endpoint}|{request.query_string.decode('latin-1')}|{tag}".encode("utf-8")
+    return 'W/"c-' + hashlib.sha1(raw).hexdigest()[:20] + '"'
+
+
+def _set_validators(resp, etag, last_modified):
+    resp.headers["ETag"] = etag
+    if last_modified is not None:
+        resp.last_modified = last_modified
+    resp.headers["Cache-Control"] = CACHE_CONTROL
+    return resp
+
+
+def conditional(validator):
+    def decorate(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            if request.method not in ("GET", "HEAD"):
+                return view(*args, **kwargs)
+            try:
+                version = validator(*args, **kwargs)
+            except Exception as e:
+                # A failing validator must not fail the read; serve without validators
+                logger.warning("conditional validator failed endpoint=%s: %s", request.endpoint, e)
+                version = None
+            if version is None:
+                return view(*args, **kwargs)
+
+            tag, last_modified = version
+            etag = _etag(tag)
+            if request.headers.get("If-None-Match"):
+                fresh = not_modified(etag)
+            else:
+                fresh = _not_modified_since(last_modified)
+            if fresh:
+                return _set_validators(current_app.response_class(status=304), etag, last_modified)
+
+            resp = current_app.make_response(view(*args, **kwargs))
+            if resp.status_code == 200:
+                _set_validators(resp, etag, last_modified)
+            return resp
+        return wrapper
+    return decorate
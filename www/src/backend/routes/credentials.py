@@ -0,0 +1,236 @@
+"""
+Password hashing (scrypt, memory-hard) for users.password
+- stored format: scrypt$<log2 N>$<r>$<p>$<salt b64>$<hash b64>; cost comes from PASSWORD_SCRYPT_LOG2N /
+  PASSWORD_SCRYPT_R / PASSWORD_SCRYPT_P (pick values with `python -m bench.kdf_cost`)
+- hashing runs on a small per-worker thread pool (PASSWORD_HASH_WORKERS; OpenSSL's scrypt releases
+  the GIL) behind a bounded admission gate, so a login burst cannot oversubscribe the CPU or
+  starve other request threads; callers past the gate wait at most PASSWORD_HASH_TIMEOUT seconds
+  and then get CredentialBusy
+- legacy plaintext rows still verify; verify_password() reports needs_upgrade for them (and for
+  hashes made with older cost settings) and schedule_upgrade() rehashes in the background
+- successful verifies are remembered for PASSWORD_VERIFY_CACHE_TTL seconds, keyed by an HMAC under
+  a per-process random key, so repeated logins skip the KDF
+"""
+import os
+import hmac
+import time
+import base64
+import hashlib
+import logging
+import secrets
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger("app.credentials")
+
+PASSWORD_SCRYPT_LOG2N = int(os.getenv("PASSWORD_SCRYPT_LOG2N", "14"))
+PASSWORD_SCRYPT_R = int(os.getenv("PASSWORD_SCRYPT_R", "8"))
+PASSWORD_SCRYPT_P = int(os.getenv("PASSWORD_SCRYPT_P", "1"))
+PASSWORD_HASH_WORKERS = max(1, int(os.getenv("PASSWORD_HASH_WORKERS", "2")))
+PASSWORD_HASH_QUEUE = max(1, int(os.getenv("PASSWORD_HASH_QUEUE", str(PASSWORD_HASH_WORKERS * 8))))
+PASSWORD_HASH_TIMEOUT = float(os.getenv("PASSWORD_HASH_TIMEOUT", "5"))
+PASSWORD_VERIFY_CACHE_TTL = float(os.getenv("PASSWORD_VERIFY_CACHE_TTL", "300"))
+PASSWORD_VERIFY_CACHE_SIZE = int(os.getenv("PASSWORD_VERIFY_CACHE_SIZE", "10000"))
+
+# Enough for the hash column plus headroom for stronger settings later
+PASSWORD_COLUMN_LENGTH = 255
+
+SCHEME = "scrypt"
+SALT_BYTES = 16
+KEY_BYTES = 32
+
+
+class CredentialBusy(RuntimeError):
+    """The hashing pool is saturated; the caller should answer 503 and let the client retry."""
+
+
+def _scrypt(password: str, salt: bytes, log2n: int, r: int, p: int) -> bytes:
+    n = 1 << log2n
+    return hashlib.scrypt(
+        password.encode("utf-8"), salt=salt, n=n, r=r, p=p,
+        maxmem=128 * n * r * p + (1 << 20) * max(1, p) * 2, dklen=KEY_BYTES,
+    )
+
+
+def _b64(data: bytes) -> str:
+    return base64.b64encode(data).decode("ascii").rstrip("=")
+
+
+def _unb64(text: str) -> bytes:
+    return base64.b64decode(text + "=" * (-len(text) % 4))
+
+
+def hash_password_sync(password: str, log2n: int = None, r: int = None, p: int = None) -> str:
+    """Hash on the calling thread (benchmarks / scripts). Request handlers use hash_password()."""
+    log2n = PASSWORD_SCRYPT_LOG2N if log2n is None else log2n
+    r = PASSWORD_SCRYPT_R if r is None else r
+    p = PASSWORD_SCRYPT_P if p is None else p
+    salt = secrets.token_bytes(SALT_BYTES)
+    key = _scrypt(password, salt, log2n, r, p)
+    return f"{SCHEME}${log2n}${r}${p}${_b64(salt)}${_b64(key)}"
+
+
+def _parse(stored: str):
+    parts = stored.split("$")
+    if len(parts) != 6 or parts[0] != SCHEME:
+        return None
+    try:
+        return int(parts[1]), int(parts[2]), int(parts[3]), _unb64(parts[4]), _unb64(parts[5])
+    except (ValueError, TypeError):
+        return None
+
+
+def is_hashed(stored) -> bool:
+    return isinstance(stored, str) and stored.startswith(SCHEME + "$")
+
+
+def _verify_sync(password: str, stored: str):
+    parsed = _parse(stored)
+    if parsed is None:
+        return False, False
+    log2n, r, p, salt, expected = parsed
+    key = _scrypt(password, salt, log2n, r, p)
+    ok = hmac.compare_digest(key, expected)
+    stale = (log2n, r, p) != (PASSWORD_SCRYPT_LOG2N, PASSWORD_SCRYPT_R, PASSWORD_SCRYPT_P)
+    return ok, ok and stale
+
+
+# ---------- bounded pool ----------
+
+_pool_lock = threading.Lock()
+_pool = None  # (pid, executor, gate)
+
+
+def _get_pool():
+    global _pool
+    cached = _pool
+    if cached is not None and cached[0] == os.getpid():
+        return cached
+    with _pool_lock:
+        if _pool is None or _pool[0] != os.getpid():
+            executor = ThreadPoolExecutor(max_workers=PASSWORD_HASH_WORKERS, thread_name_prefix="kdf")
+            _pool = (os.getpid(), executor, threading.BoundedSemaphore(PASSWORD_HASH_QUEUE))
+        return _pool
+
+
+def _run(fn, *args):
+    _, executor, gate = _get_pool()
+    if not gate.acquire(timeout=PASSWORD_HASH_TIMEOUT):
+        raise CredentialBusy("password hashing pool saturated")
+    try:
+        future = executor.submit(fn, *args)
+    except Exception:
+        gate.release()
+        raise
+    future.add_done_callback(lambda _f: gate.release())
+    return future.result()
+
+
+# ---------- verify cache ----------
+
+_cache_key = secrets.token_bytes(32)
+_cache_lock = threading.Lock()
+_cache = OrderedDict()  # hmac(stored, password) -> expires_at (monotonic)
+
+
+def _cache_token(password: str, stored: str) -> bytes:
+    return hmac.new(_cache_key, stored.encode("utf-8") + b"\0" + password.encode("utf-8"), hashlib.sha256).digest()
+
+
+def _cache_hit(token: bytes) -> bool:
+    with _cache_lock:
+        expires = _cache.get(token)
+        if expires is None:
+            return False
+        if expires < time.monotonic():
+            del _cache[token]
+            return False
+        _cache.move_to_end(token)
+        return True
+
+
+def _cache_put(token: bytes):
+    with _cache_lock:
+        _cache[token] = time.monotonic() + PASSWORD_VERIFY_CACHE_TTL
+        _cache.move_to_end(token)
+        while len(_cache) > PASSWORD_VERIFY_CACHE_SIZE:
+            _cache.popitem(last=False)
+
+
+# ---------- public API ----------
+
+def hash_password(password: str) -> str:
+    """Hash a new password on the KDF pool. Raises CredentialBusy if the pool is saturated."""
+    return _run(hash_password_sync, password)
+
+
+def verify_password(password: str, stored) -> tuple:
+    """
+    Check password against the stored value. Returns (ok, needs_upgrade): needs_upgrade is True when
+    the row still holds plaintext or a hash made with other cost settings.
+    """
+    if not password or not stored:
+        return False, False
+    if not is_hashed(stored):
+        # Legacy plaintext row
+        ok = hmac.compare_digest(password.encode("utf-8"), str(stored).encode("utf-8"))
+        return ok, ok
+    token = None
+    if PASSWORD_VERIFY_CACHE_TTL > 0:
+        token = _cache_token(password, stored)
+        if _cache_hit(token):
+            return True, False
+    ok, stale = _run(_verify_sync, password, stored)
+    if ok and token is not None:
+        _cache_put(token)
+    return ok, stale
+
+
+def schedule_upgrade(password: str, store):
+    """Rehash in the background and hand the new hash to store(new_hash); failures are only logged."""
+    def task():
+        try:
+            store(hash_password_sync(password))
+        except Exception as e:
+            logger.warning("password upgrade failed: %s", e)
+
+    _, executor, gate = _get_pool()
+    # Upgrades are best effort: skip rather than queue behind logins when the pool is busy
+    if not gate.acquire(blocking=False):
+        return False
+    try:
+        executor.submit(task).add_done_callback(lambda _f: gate.release())
+    except Exception:
+        gate.release()
+        return False
+    return True
+
+
+_column_ready = False
+
+
+def ensure_password_column(conn):
+    """Widen users.password (legacy VARCHAR(64)) so hashes fit. Once per process."""
+    global _column_ready
+    if _column_ready:
+        return
+    cur = conn.cursor()
+    try:
+        cur.execute(
+            """
+            SELECT CHARACTER_MAXIMUM_LENGTH FROM INFORMATION_SCHEMA.COLUMNS
+            WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'users' AND COLUMN_NAME = 'password'
+            """
+        )
+        row = cur.fetchone()
+        length = (row[0] if row else 0) or 0
+        if length and length < PASSWORD_COLUMN_LENGTH:
+            cur.execute(f"ALTER TABLE users MODIFY password VARCHAR({PASSWORD_COLUMN_LENGTH}) NOT NULL")
+            logger.info("widened users.password from %s to %s", length, PASSWORD_COLUMN_LENGTH)
+        _column_ready = True
+    finally:
+        try:
+            cur.close()
+        except Exception:
+            pass
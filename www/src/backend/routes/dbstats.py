@@ -0,0 +1,310 @@
+"""
+SQL statement statistics for the route blueprints
+- trace_connection() wraps a mysql.connector connection so every cursor it hands out
+  times its statements (execute + fetch) and aggregates them per normalised fingerprint
+- statements slower than SLOW_QUERY_MS are logged with the normalised SQL and the shape
+  of their params (types only, never values)
+- slow SELECTs get a sampled EXPLAIN, captured when the connection is closed so it never
+  collides with unread result sets
+- GET /admin/dbstats serves the aggregate, POST /admin/dbstats/reset clears it
+  (both require the X-Admin-Token header to match ADMIN_TOKEN)
+
+Stats are kept in memory per worker process.
+"""
+import os
+import re
+import time
+import hmac
+import random
+import hashlib
+import logging
+import threading
+
+from dotenv import load_dotenv
+from flask import Blueprint, request, jsonify, abort
+
+load_dotenv()
+
+logger = logging.getLogger("app.dbstats")
+
+dbstats_blueprint = Blueprint("dbstats", __name__)
+
+DBSTATS_ENABLED = os.getenv("DBSTATS_ENABLED", "1").strip().lower() not in {"0", "false", "no", "off"}
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", "200"))
+EXPLAIN_SAMPLE_RATE = float(os.getenv("EXPLAIN_SAMPLE_RATE", "0.25"))
+EXPLAIN_MIN_INTERVAL_SECONDS = int(os.getenv("EXPLAIN_MIN_INTERVAL_SECONDS", "300"))
+MAX_FINGERPRINTS = int(os.getenv("DBSTATS_MAX_FINGERPRINTS", "500"))
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
+
+_STRING_RE = re.compile(r"'(?:[^'\\]|\\.|'')*'|\"(?:[^\"\\]|\\.|\"\")*\"")
+_NUMBER_RE = re.compile(r"(?<![\w.])-?\d+(?:\.\d+)?\b")
+_PLACEHOLDER_RE = re.compile(r"%\(\w+\)s|%s|\?")
+_IN_LIST_RE = re.compile(r"\bIN\s*\(\s*\?(?:\s*,\s*\?)*\s*\)", re.IGNORECASE)
+_VALUES_RE = re.compile(r"\bVALUES\s*\(\s*\?(?:\s*,\s*\?)*\s*\)(?:\s*,\s*\(\s*\?(?:\s*,\s*\?)*\s*\))*", re.IGNORECASE)
+_SPACE_RE = re.compile(r"\s+")
+
+_lock = threading.Lock()
+_stats = {}
+_started_at = time.time()
+
+
+def normalize_sql(sql) -> str:
+    """Collapse literals, placeholders, IN-lists and whitespace so equal-shaped statements share one fingerprint."""
+    if isinstance(sql, (bytes, bytearray)):
+        sql = sql.decode("utf-8", errors="replace")
+    s = _STRING_RE.sub("?", str(sql))
+    s = _PLACEHOLDER_RE.sub("?", s)
+    s = _NUMBER_RE.sub("?", s)
+    s = _IN_LIST_RE.sub("IN (...)", s)
+    s = _VALUES_RE.sub("VALUES (...)", s)
+    return _SPACE_RE.sub(" ", s).strip()
+
+
+def params_shape(params) -> str:
+    """Describe params by type only, e.g. "(str,str,int)" or "(str x12)" for long IN-lists."""
+    if params is None:
+        return "()"
+    if isinstance(params, dict):
+        return "{" + ",".join(f"{k}:{type(v).__name__}" for k, v in sorted(params.items())) + "}"
+    try:
+        names = [type(p).__name__ for p in params]
+    except TypeError:
+        return type(params).__name__
+    if len(names) > 6 and len(set(names)) == 1:
+        return f"({names[0]} x{len(names)})"
+    return "(" + ",".join(names) + ")"
+
+
+def _fingerprint_id(normalized: str) -> str:
+    return hashlib.sha1(normalized.encode("utf-8")).hexdigest()[:12]
+
+
+def _record(sql, params, elapsed_ms: float, rows):
+    normalized = normalize_sql(sql)
+    fid = _fingerprint_id(normalized)
+    shape = params_shape(params)
+    slow = elapsed_ms >= SLOW_QUERY_MS
+    now = time.time()
+    want_explain = False
+    with _lock:
+        entry = _stats.get(fid)
+        if entry is None:
+            if len(_stats) >= MAX_FINGERPRINTS:
+                # Evict the least recently seen fingerprint to keep memory bounded
+                oldest = min(_stats, key=lambda k: _stats[k]["last_seen"])
+                _stats.pop(oldest, None)
+            entry = {
+                "fingerprint": fid,
+                "sql": normalized,
+                "count": 0,
+                "total_ms": 0.0,
+                "max_ms": 0.0,
+                "slow_count": 0,
+                "rows": 0,
+                "params_shape": shape,
+                "first_seen": now,
+                "last_seen": now,
+                "explain": None,
+                "explain_at": None,
+            }
+            _stats[fid] = entry
+        entry["count"] += 1
+        entry["total_ms"] += elapsed_ms
+        entry["max_ms"] = max(entry["max_ms"], elapsed_ms)
+        entry["last_seen"] = now
+        entry["params_shape"] = shape
+        if isinstance(rows, int) and rows > 0:
+            entry["rows"] += rows
+        if slow:
+            entry["slow_count"] += 1
+            explain_at = entry["explain_at"]
+            if (
+                normalized[:6].upper() == "SELECT"
+                and (explain_at is None or now - explain_at >= EXPLAIN_MIN_INTERVAL_SECONDS)
+                and random.random() < EXPLAIN_SAMPLE_RATE
+            ):
+                # Reserve the slot now so concurrent requests do not all EXPLAIN the same statement
+                entry["explain_at"] = now
+                want_explain = True
+    if slow:
+        logger.warning("slow query %.1fms fp=%s rows=%s params=%s sql=%s", elapsed_ms, fid, rows, shape, normalized[:500])
+    return fid if want_explain else None
+
+
+def _store_explain(fid: str, plan):
+    with _lock:
+        entry = _stats.get(fid)
+        if entry is not None:
+            entry["explain"] = plan
+            entry["explain_at"] = time.time()
+
+
+class _TracedCursor:
+    """Cursor proxy that times execute + fetch for each statement and reports it when the next one starts."""
+
+    def __init__(self, cursor, owner):
+        self._cursor = cursor
+        self._owner = owner
+        self._pending = None
+
+    def _finish(self):
+        pending, self._pending = self._pending, None
+        if pending is None:
+            return
+        sql, params, elapsed_ms = pending
+        try:
+            rows = self._cursor.rowcount
+        except Exception:
+            rows = None
+        try:
+            fid = _record(sql, params, elapsed_ms, rows)
+            if fid:
+                self._owner._queue_explain(fid, sql, params)
+        except Exception:
+            logger.debug("dbstats record failed", exc_info=True)
+
+    def _timed(self, fn, *args, **kwargs):
+        t0 = time.perf_counter()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            if self._pending is not None:
+                self._pending[2] += (time.perf_counter() - t0) * 1000
+
+    def execute(self, operation, params=None, *args, **kwargs):
+        self._finish()
+        self._pending = [operation, params, 0.0]
+        if params is None:
+            return self._timed(self._cursor.execute, operation, *args, **kwargs)
+        return self._timed(self._cursor.execute, operation, params, *args, **kwargs)
+
+    def executemany(self, operation, seq_params, *args, **kwargs):
+        self._finish()
+        seq_params = list(seq_params)
+        self._pending = [operation, seq_params[0] if seq_params else None, 0.0]
+        return self._timed(self._cursor.executemany, operation, seq_params, *args, **kwargs)
+
+    def fetchone(self):
+        return self._timed(self._cursor.fetchone)
+
+    def fetchmany(self, *args, **kwargs):
+        return self._timed(self._cursor.fetchmany, *args, **kwargs)
+
+    def fetchall(self):
+        return self._timed(self._cursor.fetchall)
+
+    def close(self):
+        try:
+            return self._cursor.close()
+        finally:
+            self._finish()
+
+    def __iter__(self):
+        return iter(self.fetchone, None)
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+
+class _TracedConnection:
+    """Connection proxy: hands out traced cursors and runs queued EXPLAINs right before closing."""
+
+    def __init__(self, conn):
+        self._conn = conn
+        self._explains = []
+
+    def cursor(self, *args, **kwargs):
+        return _TracedCursor(self._conn.cursor(*args, **kwargs), self)
+
+    def _queue_explain(self, fid, sql, params):
+        self._explains.append((fid, sql, params))
+
+    def _run_explains(self):
+        explains, self._explains = self._explains, []
+        for fid, sql, params in explains:
+            cur = None
+            try:
+                cur = self._conn.cursor(dictionary=True)
+                if params is None:
+                    cur.execute("EXPLAIN " + sql)
+                else:
+                    cur.execute("EXPLAIN " + sql, params)
+                plan = cur.fetchall()
+                _store_explain(fid, [dict(row) for row in plan])
+                logger.info("explain fp=%s plan=%s", fid, [
+                    (r.get("table"), r.get("type"), r.get("key"), r.get("rows"), r.get("Extra")) for r in plan
+                ])
+            except Exception as e:
+                logger.debug("explain failed fp=%s error=%s", fid, e)
+            finally:
+                if cur is not None:
+                    try:
+                        cur.close()
+                    except Exception:
+                        pass
+
+    def close(self):
+        if self._explains:
+            self._run_explains()
+        return self._conn.close()
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+
+def trace_connection(conn):
+    """Wrap a mysql.connector connection so its statements are timed and aggregated."""
+    if not DBSTATS_ENABLED:
+        return conn
+    return _TracedConnection(conn)
+
+
+def snapshot(sort: str = "total_ms", limit: int = 50):
+    """Return aggregated per-fingerprint stats, heaviest first."""
+    with _lock:
+        entries = [dict(e) for e in _stats.values()]
+    for e in entries:
+        e["avg_ms"] = round(e["total_ms"] / e["count"], 3) if e["count"] else 0.0
+        e["total_ms"] = round(e["total_ms"], 3)
+        e["max_ms"] = round(e["max_ms"], 3)
+    if sort not in {"total_ms", "avg_ms", "max_ms", "count", "slow_count", "rows"}:
+        sort = "total_ms"
+    entries.sort(key=lambda e: e.get(sort) or 0, reverse=True)
+    return entries[:limit]
+
+
+def reset():
+    with _lock:
+        _stats.clear()
+
+
+def require_admin():
+    if not ADMIN_TOKEN:
+        abort(403, description="未配置 ADMIN_TOKEN，管理接口已禁用")
+    token = request.headers.get("X-Admin-Token", "")
+    if not hmac.compare_digest(token.encode("utf-8"), ADMIN_TOKEN.encode("utf-8")):
+        abort(403, description="无权访问")
+
+
+@dbstats_blueprint.get("/admin/dbstats")
+def get_dbstats():
+    require_admin()
+    sort = (request.args.get("sort") or "total_ms").strip()
+    try:
+        limit = max(1, min(500, int(request.args.get("limit", "50"))))
+    except ValueError:
+        limit = 50
+    return jsonify({
+        "success": True,
+        "pid": os.getpid(),
+        "since": _started_at,
+        "slow_query_ms": SLOW_QUERY_MS,
+        "data": snapshot(sort, limit),
+    })
+
+
+@dbstats_blueprint.post("/admin/dbstats/reset")
+def reset_dbstats():
+    require_admin()
+    reset()
+    return jsonify({"success": True, "message": "统计已清空"})
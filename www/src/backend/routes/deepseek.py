@@ -20,6 +20,9 @@ import uuid
 from datetime import datetime, timedelta
 import mysql.connector
 from mysql.connector import errors as mysql_errors
+from routes.dbstats import trace_connection
+from routes.keyword_matcher import KeywordMatcher
+from routes.records import CONTENT_COLUMNS, decode_row, ensure_columns as ensure_record_columns
 
 def _to_bool(v):
     """Robust bool conversion for JSON fields (accepts true/false/1/0/"true"/"false")."""
@@ -52,7 +55,7 @@ logger = logging.getLogger("app.deepseek")
 
 deepseek_blueprint = Blueprint('deepseek', __name__)
 API_KEY = os.getenv('DEEPSEEK_API_KEY')
-API_URL = 'https://api.deepseek.com/v1/chat/completions'
+API_URL = os.getenv('DEEPSEEK_API_URL', 'https://api.deepseek.com/v1/chat/completions')
 
 # 数据库配置
 DB_CONFIG = {
@@ -176,6 +179,108 @@ MEDICAL_CITATIONS = {
     ]
 }
 
+# 主题检测关键词（用户输入）
+TOPIC_KEYWORDS = {
+    "饮食建议": [
+        "饮食建议", "营养建议", "膳食指南", "食物选择", "营养搭配", "健康饮食",
+        "维生素补充", "蛋白质摄入", "碳水化合物", "脂肪摄入", "蔬菜水果",
+        "饮食调理", "营养均衡", "膳食平衡", "食物营养", "饮食健康",
+        "减肥", "增重", "控制体重", "卡路里", "热量", "糖分", "盐分"
+    ],
+    "运动建议": [
+        "运动建议", "锻炼计划", "健身指导", "运动处方", "有氧运动", "力量训练",
+        "运动强度", "运动频率", "运动时间", "运动方式", "运动安全",
+        "跑步", "游泳", "瑜伽", "散步", "快走", "健身房", "器械"
+    ],
+    "睡眠建议": [
+        "睡眠建议", "睡眠指导", "睡眠调理", "失眠治疗", "睡眠质量", "睡眠习惯",
+        "作息调整", "睡眠环境", "睡眠卫生", "睡眠障碍", "多梦", "噩梦"
+    ],
+    "心理健康": [
+        "心理健康", "心理建议", "情绪管理", "压力管理", "心理调节", "心理支持",
+        "焦虑缓解", "抑郁治疗", "心理疏导", "心理干预", "冥想", "正念"
+    ],
+    "慢性病管理": [
+        "糖尿病管理", "高血压控制", "心脏病预防", "慢性病治疗", "血糖控制",
+        "血压控制", "血脂管理", "并发症预防", "疾病管理", "心血管", "动脉硬化"
+    ]
+}
+
+# 简单问候或非医疗话题：命中任意一个则不检测医疗主题
+SIMPLE_GREETINGS = [
+    "hi", "hello", "你好", "嗨", "早上好", "下午好", "晚上好", "谢谢", "再见", "拜拜",
+    "ok", "好的", "嗯", "是的", "不是", "不知道", "什么", "怎么", "为什么", "哪里"
+]
+
+# 回答中明确的医疗健康建议关键词
+CITATION_INDICATORS = {
+    "饮食建议": [
+        "饮食建议", "营养建议", "膳食指南", "食物选择", "营养搭配", "健康饮食",
+        "维生素补充", "蛋白质摄入", "碳水化合物", "脂肪摄入", "蔬菜水果",
+        "饮食调理", "营养均衡", "膳食平衡", "食物营养", "饮食健康"
+    ],
+    "运动建议": [
+        "运动建议", "锻炼计划", "健身指导", "运动处方", "有氧运动", "力量训练",
+        "运动强度", "运动频率", "运动时间", "运动方式", "运动安全"
+    ],
+    "睡眠建议": [
+        "睡眠建议", "睡眠指导", "睡眠调理", "失眠治疗", "睡眠质量", "睡眠习惯",
+        "作息调整", "睡眠环境", "睡眠卫生", "睡眠障碍"
+    ],
+    "心理健康": [
+        "心理健康", "心理建议", "情绪管理", "压力管理", "心理调节", "心理支持",
+        "焦虑缓解", "抑郁治疗", "心理疏导", "心理干预"
+    ],
+    "慢性病管理": [
+        "糖尿病管理", "高血压控制", "心脏病预防", "慢性病治疗", "血糖控制",
+        "血压控制", "血脂管理", "并发症预防", "疾病管理"
+    ]
+}
+
+# 医疗建议句式
+MEDICAL_PATTERNS = [
+    "建议您", "推荐您", "应该", "需要", "可以尝试", "有助于", "对健康有益",
+    "健康建议", "医疗建议", "专业建议", "医生建议"
+]
+
+# 健康相关词
+HEALTH_KEYWORDS = [
+    "健康", "医疗", "疾病", "症状", "治疗", "预防", "营养", "运动", "睡眠", "心理"
+]
+
+# 回答包含医疗建议句式时使用的宽松主题关键词
+BASIC_INDICATORS = {
+    "饮食建议": ["饮食", "食物", "营养", "膳食", "维生素", "蛋白质", "蔬菜", "水果"],
+    "运动建议": ["运动", "锻炼", "健身", "跑步", "游泳", "瑜伽"],
+    "睡眠建议": ["睡眠", "睡觉", "失眠", "作息", "休息"],
+    "心理健康": ["心理", "情绪", "压力", "焦虑", "抑郁"],
+    "慢性病管理": ["糖尿病", "高血压", "心脏病", "血糖", "血压"]
+}
+
+TOPIC_ORDER = list(TOPIC_KEYWORDS)
+
+
+def _build_matcher(*groups):
+    """groups: (label_prefix, {topic: [keywords]} or [keywords])；标签为 (prefix, topic) 或 (prefix, None)"""
+    table = {}
+    for prefix, keywords in groups:
+        items = keywords.items() if isinstance(keywords, dict) else [(None, keywords)]
+        for topic, words in items:
+            for word in words:
+                table.setdefault(word.lower(), set()).add((prefix, topic))
+    return KeywordMatcher(table)
+
+
+# 启动时预编译一次，请求中不再重复构建关键词表
+_GREETING_MATCHER = _build_matcher(("greeting", SIMPLE_GREETINGS))
+_TOPIC_MATCHER = _build_matcher(("topic", TOPIC_KEYWORDS))
+_CITATION_MATCHER = _build_matcher(
+    ("indicator", CITATION_INDICATORS),
+    ("pattern", MEDICAL_PATTERNS),
+    ("health", HEALTH_KEYWORDS),
+    ("basic", BASIC_INDICATORS),
+)
+
 def _get_conn():
     """
     获取数据库连接
@@ -186,7 +291,7 @@ def _get_conn():
         cur.execute("SET SESSION MAX_EXECUTION_TIME=15000")
     finally:
         cur.close()
-    return conn
+    return trace_connection(conn)
 
 def _fetch_user_data(user_id, start_date):
     """
@@ -197,10 +302,12 @@ def _fetch_user_data(user_id, start_date):
         cursor = conn.cursor(dictionary=True)
         
         try:
+            for table in ("metrics_files", "diet_files", "case_files"):
+                ensure_record_columns(conn, table)
             
             # 获取健康指标数据
-            metrics_query = """
-                SELECT id, user_id, username, file_name, content, created_at
+            metrics_query = f"""
+                SELECT id, user_id, username, file_name, {CONTENT_COLUMNS}, created_at
                 FROM metrics_files 
                 WHERE user_id = %s AND created_at >= %s
                 ORDER BY created_at DESC 
@@ -210,8 +317,8 @@ def _fetch_user_data(user_id, start_date):
             metrics_data = cursor.fetchall()
             
             # 获取饮食数据
-            diet_query = """
-                SELECT id, user_id, username, file_name, content, created_at
+            diet_query = f"""
+                SELECT id, user_id, username, file_name, {CONTENT_COLUMNS}, created_at
                 FROM diet_files 
                 WHERE user_id = %s AND created_at >= %s
                 ORDER BY created_at DESC 
@@ -222,8 +329,8 @@ def _fetch_user_data(user_id, start_date):
             
             # 如果没有找到数据，尝试不限制时间范围
             if len(diet_data) == 0:
-                diet_query_all = """
-                    SELECT id, user_id, username, file_name, content, created_at
+                diet_query_all = f"""
+                    SELECT id, user_id, username, file_name, {CONTENT_COLUMNS}, created_at
                     FROM diet_files 
                     WHERE user_id = %s
                     ORDER BY created_at DESC 
@@ -233,8 +340,8 @@ def _fetch_user_data(user_id, start_date):
                 diet_data = cursor.fetchall()
             
             # 获取病例数据
-            case_query = """
-                SELECT id, user_id, username, file_name, content, created_at
+            case_query = f"""
+                SELECT id, user_id, username, file_name, {CONTENT_COLUMNS}, created_at
                 FROM case_files 
                 WHERE user_id = %s AND created_at >= %s
                 ORDER BY created_at DESC 
@@ -243,10 +350,11 @@ def _fetch_user_data(user_id, start_date):
             cursor.execute(case_query, (user_id, f"{start_date} 00:00:00"))
             case_data = cursor.fetchall()
             
+            # 压缩存储的记录解回 JSON 文本
             return {
-                'metrics': metrics_data,
-                'diet': diet_data,
-                'case': case_data
+                'metrics': [decode_row(r) for r in metrics_data],
+                'diet': [decode_row(r) for r in diet_data],
+                'case': [decode_row(r) for r in case_data]
             }
             
         finally:
@@ -370,61 +478,34 @@ def _detect_medical_topic(text):
     检测文本中的医疗主题，返回相关的引用
     只有在明确涉及医疗健康话题时才返回主题
     """
+    # 如果输入太短，不检测医疗主题
+    if len(text.strip()) < 3:
+        return []
+
     text_lower = text.lower()
-    detected_topics = []
-    
-    # 首先检查是否是简单的问候或非医疗话题
-    simple_greetings = [
-        "hi", "hello", "你好", "嗨", "早上好", "下午好", "晚上好", "谢谢", "再见", "拜拜",
-        "ok", "好的", "嗯", "是的", "不是", "不知道", "什么", "怎么", "为什么", "哪里"
-    ]
-    
-    # 如果输入太短或只是简单问候，不检测医疗主题
-    if len(text.strip()) < 3 or any(greeting in text_lower for greeting in simple_greetings):
-        return detected_topics
-    
-    # 更精确的关键词匹配，包含同义词和上下文
-    topic_keywords = {
-        "饮食建议": [
-            "饮食建议", "营养建议", "膳食指南", "食物选择", "营养搭配", "健康饮食",
-            "维生素补充", "蛋白质摄入", "碳水化合物", "脂肪摄入", "蔬菜水果",
-            "饮食调理", "营养均衡", "膳食平衡", "食物营养", "饮食健康",
-            "减肥", "增重", "控制体重", "卡路里", "热量", "糖分", "盐分"
-        ],
-        "运动建议": [
-            "运动建议", "锻炼计划", "健身指导", "运动处方", "有氧运动", "力量训练",
-            "运动强度", "运动频率", "运动时间", "运动方式", "运动安全",
-            "跑步", "游泳", "瑜伽", "散步", "快走", "健身房", "器械"
-        ],
-        "睡眠建议": [
-            "睡眠建议", "睡眠指导", "睡眠调理", "失眠治疗", "睡眠质量", "睡眠习惯",
-            "作息调整", "睡眠环境", "睡眠卫生", "睡眠障碍", "多梦", "噩梦"
-        ],
-        "心理健康": [
-            "心理健康", "心理建议", "情绪管理", "压力管理", "心理调节", "心理支持",
-            "焦虑缓解", "抑郁治疗", "心理疏导", "心理干预", "冥想", "正念"
-        ],
-        "慢性病管理": [
-            "糖尿病管理", "高血压控制", "心脏病预防", "慢性病治疗", "血糖控制",
-            "血压控制", "血脂管理", "并发症预防", "疾病管理", "心血管", "动脉硬化"
-        ]
-    }
-    
-    # 计算每个主题的匹配度
-    topic_scores = {}
-    for topic, keywords in topic_keywords.items():
-        score = 0
-        for keyword in keywords:
-            if keyword in text_lower:
-                score += 1
-        if score > 0:
-            topic_scores[topic] = score
-    
-    # 只返回匹配度较高的主题（避免误判）
-    for topic, score in topic_scores.items():
-        if score >= 1:  # 至少匹配一个关键词
-            detected_topics.append(topic)
-    
+    # 简单问候或非医疗话题，不检测医疗主题
+    if _GREETING_MATCHER.scan(text_lower):
+        return []
+
+    hits = _TOPIC_MATCHER.scan(text_lower)
+
+    # 至少匹配一个关键词的主题，按主题顺序返回
+    return [topic for topic in TOPIC_ORDER if ("topic", topic) in hits]
+
+def _citation_topics(hits, response_len):
+    """
+    根据回答的关键词命中结果确定引用主题
+    hits: _CITATION_MATCHER 的命中标签集合；response_len: 回答原文长度
+    """
+    # 检查回答中是否包含明确的医疗健康建议
+    detected_topics = [topic for topic in TOPIC_ORDER if ("indicator", topic) in hits]
+
+    # 只有在包含医疗模式且长度超过50字符，且确实涉及健康话题时，才补充宽松关键词命中的主题
+    if response_len > 50 and ("pattern", None) in hits and ("health", None) in hits:
+        for topic in TOPIC_ORDER:
+            if ("basic", topic) in hits and topic not in detected_topics:
+                detected_topics.append(topic)
+
     return detected_topics
 
 def _analyze_response_for_citations(response_text, user_input):
@@ -432,67 +513,7 @@ def _analyze_response_for_citations(response_text, user_input):
     分析AI回答内容，匹配相关引用
     只有在明确涉及医疗健康话题时才返回引用
     """
-    response_lower = response_text.lower()
-    detected_topics = []
-    
-    # 更精确的医疗健康关键词检测
-    medical_indicators = {
-        "饮食建议": [
-            "饮食建议", "营养建议", "膳食指南", "食物选择", "营养搭配", "健康饮食",
-            "维生素补充", "蛋白质摄入", "碳水化合物", "脂肪摄入", "蔬菜水果",
-            "饮食调理", "营养均衡", "膳食平衡", "食物营养", "饮食健康"
-        ],
-        "运动建议": [
-            "运动建议", "锻炼计划", "健身指导", "运动处方", "有氧运动", "力量训练",
-            "运动强度", "运动频率", "运动时间", "运动方式", "运动安全"
-        ],
-        "睡眠建议": [
-            "睡眠建议", "睡眠指导", "睡眠调理", "失眠治疗", "睡眠质量", "睡眠习惯",
-            "作息调整", "睡眠环境", "睡眠卫生", "睡眠障碍"
-        ],
-        "心理健康": [
-            "心理健康", "心理建议", "情绪管理", "压力管理", "心理调节", "心理支持",
-            "焦虑缓解", "抑郁治疗", "心理疏导", "心理干预"
-        ],
-        "慢性病管理": [
-            "糖尿病管理", "高血压控制", "心脏病预防", "慢性病治疗", "血糖控制",
-            "血压控制", "血脂管理", "并发症预防", "疾病管理"
-        ]
-    }
-    
-    # 检查回答中是否包含明确的医疗健康建议
-    for topic, indicators in medical_indicators.items():
-        if any(indicator in response_lower for indicator in indicators):
-            detected_topics.append(topic)
-    
-    # 额外检查：如果回答中包含具体的医疗建议模式
-    medical_patterns = [
-        "建议您", "推荐您", "应该", "需要", "可以尝试", "有助于", "对健康有益",
-        "健康建议", "医疗建议", "专业建议", "医生建议"
-    ]
-    
-    # 只有在包含医疗模式且长度超过50字符时才考虑添加引用
-    if len(response_text) > 50 and any(pattern in response_lower for pattern in medical_patterns):
-        # 进一步检查是否真的涉及医疗健康话题
-        health_keywords = [
-            "健康", "医疗", "疾病", "症状", "治疗", "预防", "营养", "运动", "睡眠", "心理"
-        ]
-        if any(keyword in response_lower for keyword in health_keywords):
-            # 如果检测到医疗主题，使用原有的关键词检测
-            basic_indicators = {
-                "饮食建议": ["饮食", "食物", "营养", "膳食", "维生素", "蛋白质", "蔬菜", "水果"],
-                "运动建议": ["运动", "锻炼", "健身", "跑步", "游泳", "瑜伽"],
-                "睡眠建议": ["睡眠", "睡觉", "失眠", "作息", "休息"],
-                "心理健康": ["心理", "情绪", "压力", "焦虑", "抑郁"],
-                "慢性病管理": ["糖尿病", "高血压", "心脏病", "血糖", "血压"]
-            }
-            
-            for topic, keywords in basic_indicators.items():
-                if any(keyword in response_lower for keyword in keywords):
-                    if topic not in detected_topics:
-                        detected_topics.append(topic)
-    
-    return detected_topics
+    return _citation_topics(_CITATION_MATCHER.scan(response_text.lower()), len(response_text))
 
 def _generate_citations(topics):
     """
@@ -885,6 +906,8 @@ def deepseek_chat_stream():
             def generate():
                 logger.info("/deepseek/chat_stream stream start")
                 full_text = ""
+                # 随流增量匹配引用关键词，收到 [DONE] 时主题已就绪
+                citation_scan = _CITATION_MATCHER.stream()
                 try:
                     for line in response.iter_lines():
                         if line:
@@ -897,7 +920,7 @@ def deepseek_chat_stream():
                                     session['messages'].append({"role": "assistant", "content": full_text})
                                     
                                     # 基于AI回答内容分析医疗主题并生成引用
-                                    response_topics = _analyze_response_for_citations(full_text, user_input)
+                                    response_topics = _citation_topics(citation_scan.result(), len(full_text))
                                     all_topics = list(set(medical_topics + response_topics))  # 合并用户输入和回答的主题
                                     citations = _generate_citations(all_topics)
                                     
@@ -917,6 +940,7 @@ def deepseek_chat_stream():
                                         if 'content' in delta:
                                             content = delta['content']
                                             full_text += content
+                                            citation_scan.feed(content.lower())
                                             yield f"data: {json.dumps({'content': content, 'type': 'content'})}\n\n"
                                 except json.JSONDecodeError:
                                     logger.debug("/deepseek/chat_stream non-json line encountered")
@@ -5,6 +5,11 @@ from dotenv import load_dotenv
 from flask import Blueprint, request, jsonify
 import mysql.connector
 from mysql.connector import errors as mysql_errors
+from routes.dbstats import trace_connection
+from routes.credentials import hash_password, CredentialBusy
+from routes.userstore import PROFILE_COLUMNS, ensure_users_schema
+from routes.profile_cache import invalidate as invalidate_profile
+from routes.session_token import resolve_identity, AuthError
 
 # read information of DB
 load_dotenv()
@@ -29,7 +34,7 @@ def _get_conn():
         cur.execute("SET SESSION MAX_EXECUTION_TIME=15000")  # 15s
     finally:
         cur.close()
-    return conn
+    return trace_connection(conn)
 
 ALLOWED_TABLES = {"users"}  # For security reasons, only the users table is allowed to be updated. If you need to expand it, you can add it to the whitelist
 
@@ -50,7 +55,8 @@ def editdata():
     Request JSON example:
     {
       "table_name": "users",            # Optional, default is users
-      "user_id": "uuid-xxx",            # user_id and username must provide at least one
+      "user_id": "uuid-xxx",            # user_id and username must provide at least one,
+                                        # unless an "Authorization: Bearer <token>" header is sent
       "username": "JunxiBao",
       "age": 20,                          # Optional: update age (integer 0~120)
       "new_password": "Abc12345"         # Optional: update password (or use field name password)
@@ -70,11 +76,11 @@ def editdata():
 
     try:
         data = request.get_json(silent=True) or {}
-        logger.info("/editdata request data=%s", data)
+        logger.info("/editdata body_keys=%s", list(data.keys()) if isinstance(data, dict) else None)
 
         table_name = (data.get("table_name") or "users").strip()
-        user_id = data.get("user_id")
-        username = data.get("username")
+        # Identity comes from the session token when present (no lookup), else from the body
+        user_id, username = resolve_identity(data)
 
         # Verification form name
         if not _validate_table(table_name):
@@ -110,7 +116,7 @@ def editdata():
                 logger.warning("/editdata invalid password format username=%s user_id=%s", username, user_id)
                 return jsonify({"success": False, "message": "新密码必须为8到20位，包含大写字母、小写字母和数字"}), 400
             updated_fields.append("password = %s")
-            params.append(new_password)
+            params.append(hash_password(str(new_password)))
 
         if not updated_fields:
             logger.warning("/editdata no fields to update username=%s user_id=%s", username, user_id)
@@ -129,10 +135,15 @@ def editdata():
         conn = _get_conn()
         cursor = conn.cursor(dictionary=True)
         try:
+            if table_name == "users":
+                ensure_users_schema(conn)
             update_sql = f"UPDATE {table_name} SET " + ", ".join(updated_fields) + where_clause
-            logger.info("/editdata executing update table=%s set=%s where=%s params=%s", table_name, ", ".join(updated_fields), where_clause.strip(), params)
+            # params 含新密码等字段值，不写入日志
+            logger.info("/editdata executing update table=%s set=%s where=%s", table_name, ", ".join(updated_fields), where_clause.strip())
             cursor.execute(update_sql, params)
             conn.commit()
+            if table_name == "users":
+                invalidate_profile(user_id, username)
 
             affected = cursor.rowcount
             if affected <= 0:
@@ -146,7 +157,9 @@ def editdata():
                 select_where = " WHERE user_id = %s"; select_params.append(user_id)
             else:
                 select_where = " WHERE username = %s"; select_params.append(username)
-            select_sql = f"SELECT * FROM {table_name}" + select_where
+            # Never echo the password column back
+            columns = PROFILE_COLUMNS if table_name == "users" else "*"
+            select_sql = f"SELECT {columns} FROM {table_name}" + select_where
             cursor.execute(select_sql, select_params)
             updated_row = cursor.fetchone()
         finally:
@@ -169,6 +182,12 @@ def editdata():
             "data": updated_row
         })
 
+    except AuthError as e:
+        logger.warning("/editdata auth rejected status=%s", e.status)
+        return jsonify({"success": False, "message": e.message}), e.status
+    except CredentialBusy:
+        logger.warning("/editdata password hashing pool saturated")
+        return jsonify({"success": False, "message": "服务器繁忙，请稍后重试"}), 503
     except mysql_errors.Error as e:
         # 3024: MAX_EXECUTION_TIME exceeded; 1205: Lock wait timeout; 1213: Deadlock found
         if getattr(e, 'errno', None) in (3024, 1205, 1213):
@@ -1,4 +1,5 @@
 import os
+import json
 import logging
 from typing import Optional
 
@@ -6,6 +7,11 @@ from dotenv import load_dotenv
 from flask import Blueprint, request, jsonify
 import mysql.connector
 from mysql.connector import errors as mysql_errors
+from routes.dbstats import trace_connection
+from routes.conditional import conditional
+from routes.sync import owner_version, list_version
+from routes import records
+from routes.records import CONTENT_COLUMNS, ymd as _ymd, record_date as _record_date
 
 load_dotenv()
 
@@ -35,13 +41,98 @@ def _get_conn():
         cur.execute("SET SESSION MAX_EXECUTION_TIME=15000")
     finally:
         cur.close()
-    return conn
+    return trace_connection(conn)
 
 def _parse_kind(kind: str) -> Optional[str]:
     kind = (kind or "").strip().lower()
     return kind if kind in KIND_TO_TABLE else None
 
+def _with_conn(fn, *args):
+    conn = _get_conn()
+    try:
+        return fn(conn, *args)
+    finally:
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+def _monthly_version(user_id, year, month):
+    user_id = (user_id or "").strip()
+    if not user_id:
+        return None
+    return _with_conn(owner_version, KIND_TO_TABLE["symptoms"], user_id, None)
+
+def _record_version(conn, table_name, file_id):
+    # 记录写入后不再修改：主键查 created_at 即可作为版本
+    cur = conn.cursor()
+    try:
+        cur.execute(f"SELECT created_at FROM {table_name} WHERE id = %s LIMIT 1", (file_id,))
+        row = cur.fetchone()
+    finally:
+        cur.close()
+    return (f"r{file_id}.{row[0].isoformat() if row[0] else ''}", row[0]) if row else None
+
+def _detail_version(kind, file_id):
+    kind = _parse_kind(kind)
+    if not kind:
+        return None
+    return _with_conn(_record_version, KIND_TO_TABLE[kind], file_id)
+
+def _matches_date(content, kind: str, filter_date: str) -> bool:
+    """记录日期命中 filter_date；diet 另按每餐的 date/timestamp 匹配，任一餐命中即可"""
+    if _record_date(content) == filter_date:
+        return True
+    if kind != 'diet':
+        return False
+    diet_data = (content or {}).get('dietData') or {}
+    for meal in (diet_data.values() if isinstance(diet_data, dict) else []):
+        if not isinstance(meal, dict):
+            continue
+        md = (meal.get('date') or '').strip()
+        if (md or _ymd(meal.get('timestamp'))) == filter_date:
+            return True
+    return False
+
+def _summary_matches_date(summary, kind: str, filter_date: str) -> Optional[bool]:
+    """_matches_date 的摘要版本；摘要不足以判断时（无摘要，或 diet 缺 mealDates）返回 None"""
+    if not summary:
+        return None
+    if summary.get('date') == filter_date:
+        return True
+    if kind != 'diet':
+        return False
+    if 'mealDates' not in summary:
+        return None
+    return filter_date in summary['mealDates']
+
+def _summaries_from_content(conn, table_name: str, kind: str, ids) -> dict:
+    """没有（当前版本）摘要的旧记录：一次读出 content 现场生成摘要，{id: summary}"""
+    if not ids:
+        return {}
+    cur = conn.cursor(dictionary=True)
+    try:
+        cur.execute(
+            f"SELECT id, {CONTENT_COLUMNS} FROM {table_name} WHERE id IN ({', '.join(['%s'] * len(ids))})",
+            tuple(ids),
+        )
+        rows = cur.fetchall()
+    finally:
+        try:
+            cur.close()
+        except Exception:
+            pass
+    out = {}
+    for row in rows:
+        try:
+            content = json.loads(records.decode_row(row)['content'] or '{}')
+        except ValueError:
+            content = None
+        out[row['id']] = json.loads(records.summarize(kind, content))
+    return out
+
 @getjson_blueprint.route("/getjson/symptoms/monthly/<user_id>/<year>/<month>", methods=["GET", "OPTIONS"])
+@conditional(_monthly_version)
 def get_monthly_symptoms(user_id, year, month):
     """获取用户指定月份的症状数据，用于日历高亮显示"""
     if request.method == "OPTIONS":
@@ -73,17 +164,23 @@ def get_monthly_symptoms(user_id, year, month):
         conn = _get_conn()
         
         try:
+            records.ensure_columns(conn, table_name)
             cur = conn.cursor(dictionary=True)
             try:
-                # 查询指定月份的症状数据
+                # 查询指定月份的症状数据：有 summary 的行只读 summary（content 可能已压缩），
+                # 尚未迁移的旧行仍从 content 中提取
                 sql = f"""
                 SELECT 
-                    JSON_EXTRACT(content, '$.exportInfo.recordTime') as record_time,
-                    JSON_EXTRACT(content, '$.symptomData.symptoms') as symptoms
+                    CASE WHEN summary IS NOT NULL THEN JSON_EXTRACT(summary, '$.date')
+                         ELSE JSON_EXTRACT(content, '$.exportInfo.recordTime') END as record_time,
+                    CASE WHEN summary IS NOT NULL THEN JSON_EXTRACT(summary, '$.symptoms')
+                         ELSE JSON_EXTRACT(content, '$.symptomData.symptoms') END as symptoms
                 FROM {table_name} 
                 WHERE user_id = %s 
-                AND DATE(JSON_UNQUOTE(JSON_EXTRACT(content, '$.exportInfo.recordTime'))) BETWEEN %s AND %s
-                ORDER BY JSON_UNQUOTE(JSON_EXTRACT(content, '$.exportInfo.recordTime'))
+                AND (CASE WHEN summary IS NOT NULL THEN JSON_UNQUOTE(JSON_EXTRACT(summary, '$.date'))
+                          ELSE DATE(JSON_UNQUOTE(JSON_EXTRACT(content, '$.exportInfo.recordTime'))) END) BETWEEN %s AND %s
+                ORDER BY (CASE WHEN summary IS NOT NULL THEN JSON_UNQUOTE(JSON_EXTRACT(summary, '$.date'))
+                               ELSE JSON_UNQUOTE(JSON_EXTRACT(content, '$.exportInfo.recordTime')) END), created_at
                 """
                 
                 cur.execute(sql, (user_id, start_date.date(), end_date.date()))
@@ -98,7 +195,6 @@ def get_monthly_symptoms(user_id, year, month):
                         date_part = record_time.split(' ')[0]  # 获取 YYYY-MM-DD 部分
                         
                         # 解析症状数组
-                        import json
                         try:
                             symptoms = json.loads(row['symptoms'])
                             if isinstance(symptoms, list):
@@ -143,6 +239,7 @@ def get_monthly_symptoms(user_id, year, month):
         return jsonify({"success": False, "message": "服务器错误", "error": str(e)}), 500
 
 @getjson_blueprint.route("/getjson/<kind>", methods=["GET", "OPTIONS"])
+@conditional(list_version)
 def get_user_files(kind):
     if request.method == "OPTIONS":
         return "", 200
@@ -177,6 +274,7 @@ def get_user_files(kind):
         conn = _get_conn()
         
         try:
+            records.ensure_columns(conn, table_name)
             cur = conn.cursor(dictionary=True)
             try:
                 # 构建查询语句
@@ -192,8 +290,7 @@ def get_user_files(kind):
                     params.append(f"{start_date} 00:00:00")
                 
                 query = f"""
-                    SELECT id, user_id, username, file_name, created_at, 
-                           SUBSTRING(content, 1, 200) as content_preview
+                    SELECT id, user_id, username, file_name, created_at, summary
                     FROM {table_name} 
                     WHERE {base_where}{time_filter}
                     ORDER BY created_at DESC 
@@ -206,88 +303,47 @@ def get_user_files(kind):
                 cur.execute(query, params)
                 rows = cur.fetchall()
                 
-                # 处理内容预览
+                # 预览即 summary 列（不读取 content）；尚无当前版本摘要的旧记录一次性补算
+                previews = {}
+                for row in rows:
+                    summary = records.load_summary(row.pop('summary', None))
+                    if summary is not None:
+                        previews[row['id']] = summary
+                stale = [row['id'] for row in rows if row['id'] not in previews]
+                if stale:
+                    previews.update(_summaries_from_content(conn, table_name, kind, stale))
+
                 filtered_rows = []
                 for row in rows:
-                    if row.get('content_preview'):
-                        try:
-                            import json
-                            preview_data = json.loads(row['content_preview'])
-                            row['preview'] = preview_data
-                        except:
-                            row['preview'] = None
-                    else:
-                        row['preview'] = None
-                    
-                    # 移除原始的长内容字段
-                    if 'content_preview' in row:
-                        del row['content_preview']
+                    row['preview'] = previews.get(row['id'])
 
                     # 如指定 date，则按 exportInfo.recordTime(缺失退回 exportTime) 的日期过滤；
                     # 若为 diet，再进一步按每餐的 date/timestamp 进行匹配，任一餐命中即可。
                     if filter_date:
                         try:
-                            exp = (row.get('preview') or {}).get('exportInfo') or {}
-                            rt = (exp.get('recordTime') or exp.get('exportTime') or '').strip()
-                            ds = None
-                            if rt:
-                                import re
-                                m = re.match(r"^(\d{4})[-/.](\d{2})[-/.](\d{2})", rt)
-                                if m:
-                                    ds = f"{m.group(1)}-{m.group(2)}-{m.group(3)}"
-                            if ds == filter_date:
-                                filtered_rows.append(row)
-                            else:
-                                # 预览内容不足时，回退读取完整 content 再判断
+                            matched = _summary_matches_date(row['preview'], kind, filter_date)
+                            if matched is None:
+                                # 摘要不足以判断时，回退读取完整 content 再判断
+                                cur2 = conn.cursor(dictionary=True)
                                 try:
-                                    cur2 = conn.cursor(dictionary=True)
+                                    cur2.execute(f"SELECT {CONTENT_COLUMNS} FROM {table_name} WHERE id=%s LIMIT 1", (row['id'],))
+                                    full = cur2.fetchone()
+                                    if full:
+                                        records.decode_row(full)
+                                finally:
+                                    try:
+                                        cur2.close()
+                                    except Exception:
+                                        pass
+                                matched = False
+                                if full and full.get('content'):
                                     try:
-                                        cur2.execute(f"SELECT content FROM {table_name} WHERE id=%s LIMIT 1", (row['id'],))
-                                        full = cur2.fetchone()
-                                    finally:
-                                        try:
-                                            cur2.close()
-                                        except Exception:
-                                            pass
-                                    if full and full.get('content'):
-                                        import json, re
-                                        try:
-                                            content_obj = json.loads(full['content'])
-                                        except Exception:
-                                            content_obj = {}
-                                        exp2 = (content_obj.get('exportInfo') or {})
-                                        rt2 = (exp2.get('recordTime') or exp2.get('exportTime') or '').strip()
-                                        ds2 = None
-                                        if rt2:
-                                            m2 = re.match(r"^(\d{4})[-/.](\d{2})[-/.](\d{2})", rt2)
-                                            if m2:
-                                                ds2 = f"{m2.group(1)}-{m2.group(2)}-{m2.group(3)}"
-                                        include = (ds2 == filter_date)
-                                        # diet: 任一餐命中也包括
-                                        if not include and kind == 'diet':
-                                            try:
-                                                diet_data = content_obj.get('dietData') or {}
-                                                for meal in (diet_data.values() if isinstance(diet_data, dict) else []):
-                                                    if not isinstance(meal, dict):
-                                                        continue
-                                                    md = (meal.get('date') or '').strip()
-                                                    mt = (meal.get('timestamp') or '').strip()
-                                                    mds = None
-                                                    if md:
-                                                        mds = md
-                                                    elif mt:
-                                                        m3 = re.match(r"^(\d{4})[-/.](\d{2})[-/.](\d{2})", mt)
-                                                        if m3:
-                                                            mds = f"{m3.group(1)}-{m3.group(2)}-{m3.group(3)}"
-                                                    if mds == filter_date:
-                                                        include = True
-                                                        break
-                                            except Exception:
-                                                pass
-                                        if include:
-                                            filtered_rows.append(row)
-                                except Exception:
-                                    pass
+                                        content_obj = json.loads(full['content'])
+                                    except Exception:
+                                        content_obj = {}
+                                    matched = _matches_date(content_obj, kind, filter_date)
+                            if matched:
+                                filtered_rows.append(row)
                         except Exception:
                             # 忽略解析失败
                             pass
@@ -320,6 +376,7 @@ def get_user_files(kind):
         return jsonify({"success": False, "message": "服务器错误", "error": str(e)}), 500
 
 @getjson_blueprint.route("/getjson/<kind>/<file_id>", methods=["GET", "OPTIONS"])
+@conditional(_detail_version)
 def get_file_detail(kind, file_id):
     if request.method == "OPTIONS":
         return "", 200
@@ -333,10 +390,11 @@ def get_file_detail(kind, file_id):
         conn = _get_conn()
         
         try:
+            records.ensure_columns(conn, table_name)
             cur = conn.cursor(dictionary=True)
             try:
                 query = f"""
-                    SELECT id, user_id, username, file_name, content, created_at
+                    SELECT id, user_id, username, file_name, {CONTENT_COLUMNS}, created_at
                     FROM {table_name} 
                     WHERE id = %s 
                     LIMIT 1
@@ -348,8 +406,8 @@ def get_file_detail(kind, file_id):
                     return jsonify({"success": False, "message": "未找到记录"}), 404
                 
                 # 解析 JSON 内容
+                records.decode_row(row)
                 try:
-                    import json
                     row['content'] = json.loads(row.get('content') or '{}')
                 except:
                     row['content'] = {}
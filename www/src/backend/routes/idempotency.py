@@ -0,0 +1,342 @@
+"""
+Idempotency-Key support for write endpoints
+- @idempotent on a view (below the route decorator): a request carrying an Idempotency-Key header
+  runs the view once per (endpoint, caller, key); a retry gets the stored response replayed with
+  Idempotent-Replayed: true instead of writing again. Requests without the header are untouched
+- keys are claimed in MySQL (idempotency_keys), so a retry that lands on the other gunicorn worker
+  is caught as well. A duplicate that arrives while the first request is still running waits for
+  it (same worker: a threading.Event; other worker: polling the row) for up to
+  IDEMPOTENCY_WAIT_SECONDS, then gets 409 and can retry later
+- finished responses are also kept in a bounded per-process LRU (IDEMPOTENCY_CACHE_SIZE) so a
+  replay on the same worker does not touch the database
+- 2xx / 4xx responses are stored for IDEMPOTENCY_TTL_SECONDS; 5xx (and oversized or streamed)
+  responses release the key so the retry runs the view again. A claim left behind by a killed
+  worker is taken over after IDEMPOTENCY_INFLIGHT_TIMEOUT
+- reusing a key with a different request body is rejected with 422
+- the caller is the session identity, else the body's user_id / username, else the client IP
+- if the key store itself is unavailable the view runs without the guarantee (fail open)
+"""
+import os
+import time
+import hashlib
+import logging
+import threading
+from functools import wraps
+from collections import OrderedDict
+
+from dotenv import load_dotenv
+from flask import Response, g, jsonify, make_response, request
+import mysql.connector
+from mysql.connector import errors as mysql_errors
+from routes.dbstats import trace_connection
+from routes.ratelimit import client_ip
+
+load_dotenv()
+
+logger = logging.getLogger("app.idempotency")
+
+DB_CONFIG = {
+    "host": os.getenv("DB_HOST"),
+    "user": os.getenv("DB_USER"),
+    "password": os.getenv("DB_PASSWORD"),
+    "database": os.getenv("DB_NAME"),
+}
+
+IDEMPOTENCY_TTL_SECONDS = int(os.getenv("IDEMPOTENCY_TTL_SECONDS", "86400"))
+IDEMPOTENCY_WAIT_SECONDS = float(os.getenv("IDEMPOTENCY_WAIT_SECONDS", "10"))
+IDEMPOTENCY_INFLIGHT_TIMEOUT = int(os.getenv("IDEMPOTENCY_INFLIGHT_TIMEOUT", "60"))
+IDEMPOTENCY_CACHE_SIZE = int(os.getenv("IDEMPOTENCY_CACHE_SIZE", "2000"))
+IDEMPOTENCY_MAX_BODY = int(os.getenv("IDEMPOTENCY_MAX_BODY", str(256 * 1024)))
+
+HEADER = "Idempotency-Key"
+MAX_KEY_LENGTH = 255
+
+_POLL_INTERVAL = 0.1
+_PURGE_EVERY = 300
+
+_table_ready = False
+_lock = threading.Lock()
+_inflight = {}           # key_hash -> threading.Event, requests running on this worker
+_cache = OrderedDict()   # key_hash -> (fingerprint, status, mimetype, body, expires_monotonic)
+_last_purge = 0.0
+
+
+class _KeyStoreError(Exception):
+    pass
+
+
+def _get_conn():
+    conn = mysql.connector.connect(**DB_CONFIG, connection_timeout=5, autocommit=False)
+    cur = conn.cursor()
+    try:
+        cur.execute("SET SESSION MAX_EXECUTION_TIME=15000")
+    finally:
+        cur.close()
+    return trace_connection(conn)
+
+
+def _ensure_table(conn):
+    global _table_ready
+    if _table_ready:
+        return
+    ddl = """
+    CREATE TABLE IF NOT EXISTS idempotency_keys (
+        key_hash CHAR(64) PRIMARY KEY,
+        fingerprint CHAR(64) NOT NULL,
+        status SMALLINT NULL,
+        mimetype VARCHAR(100) NULL,
+        body MEDIUMBLOB NULL,
+        claimed_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+        expires_at DATETIME NOT NULL,
+        INDEX idx_expires_at (expires_at)
+    ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+    """
+    cur = conn.cursor()
+    try:
+        cur.execute(ddl)
+        conn.commit()
+        _table_ready = True
+    finally:
+        cur.close()
+
+
+def _caller():
+    identity = getattr(g, "identity", None)
+    if identity:
+        return "u:" + str(identity["user_id"])
+    data = request.get_json(silent=True)
+    if isinstance(data, dict):
+        # /report/* names its caller reporter_id
+        owner = data.get("user_id") or data.get("username") or data.get("reporter_id")
+        if owner:
+            return "b:" + str(owner)
+    return "ip:" + client_ip(request)
+
+
+def _fingerprint():
+    h = hashlib.sha256()
+    h.update(request.method.encode())
+    h.update(b"\0")
+    h.update(request.full_path.encode("utf-8"))
+    h.update(b"\0")
+    h.update(request.get_data(cache=True))
+    return h.hexdigest()
+
+
+# ---- process-local cache ----
+
+def _cache_get(key_hash):
+    with _lock:
+        entry = _cache.get(key_hash)
+        if entry is None:
+            return None
+        if entry[4] < time.monotonic():
+            del _cache[key_hash]
+            return None
+        _cache.move_to_end(key_hash)
+        return entry
+
+
+def _cache_put(key_hash, fingerprint, status, mimetype, body):
+    with _lock:
+        _cache[key_hash] = (fingerprint, status, mimetype, body, time.monotonic() + IDEMPOTENCY_TTL_SECONDS)
+        _cache.move_to_end(key_hash)
+        while len(_cache) > IDEMPOTENCY_CACHE_SIZE:
+            _cache.popitem(last=False)
+
+
+def _replay(entry, fingerprint):
+    stored_fp, status, mimetype, body = entry[:4]
+    if stored_fp != fingerprint:
+        return jsonify({"success": False, "message": "幂等键已用于不同的请求"}), 422
+    resp = Response(bytes(body or b""), status=status, mimetype=mimetype)
+    resp.headers["Idempotent-Replayed"] = "true"
+    return resp
+
+
+def _in_progress():
+    resp = jsonify({"success": False, "message": "相同请求正在处理中，请稍后重试"})
+    resp.headers["Retry-After"] = "1"
+    return resp, 409
+
+
+# ---- key store ----
+
+def _maybe_purge(cur):
+    global _last_purge
+    now = time.monotonic()
+    if now - _last_purge < _PURGE_EVERY:
+        return
+    _last_purge = now
+    cur.execute("DELETE FROM idempotency_keys WHERE expires_at < NOW() LIMIT 1000")
+    if cur.rowcount:
+        logger.info("idempotency keys purged: %d", cur.rowcount)
+
+
+def _claim(key_hash, fingerprint):
+    """
+    Returns None if this request now owns the key, else the existing row
+    (fingerprint, status, mimetype, body) — status None while it is still running elsewhere.
+    """
+    try:
+        conn = _get_conn()
+    except mysql_errors.Error as e:
+        raise _KeyStoreError(str(e))
+    try:
+        _ensure_table(conn)
+        cur = conn.cursor()
+        try:
+            _maybe_purge(cur)
+            for _ in range(2):
+                # expired rows, and claims abandoned by a worker that died mid-request, are up for grabs
+                cur.execute(
+                    "DELETE FROM idempotency_keys WHERE key_hash = %s AND (expires_at < NOW() "
+                    "OR (status IS NULL AND claimed_at < NOW() - INTERVAL %s SECOND))",
+                    (key_hash, IDEMPOTENCY_INFLIGHT_TIMEOUT),
+                )
+                conn.commit()
+                try:
+                    cur.execute(
+                        "INSERT INTO idempotency_keys (key_hash, fingerprint, expires_at) "
+                        "VALUES (%s, %s, NOW() + INTERVAL %s SECOND)",
+                        (key_hash, fingerprint, IDEMPOTENCY_TTL_SECONDS),
+                    )
+                    conn.commit()
+                    return None
+                except mysql_errors.IntegrityError:
+                    conn.rollback()
+                cur.execute(
+                    "SELECT fingerprint, status, mimetype, body FROM idempotency_keys WHERE key_hash = %s",
+                    (key_hash,),
+                )
+                row = cur.fetchone()
+                conn.commit()
+                if row is not None:
+                    return row
+                # released between our INSERT and SELECT (the other request failed): try again
+            return (fingerprint, None, None, None)
+        finally:
+            cur.close()
+    except mysql_errors.Error as e:
+        raise _KeyStoreError(str(e))
+    finally:
+        conn.close()
+
+
+def _wait_for_row(key_hash):
+    deadline = time.monotonic() + IDEMPOTENCY_WAIT_SECONDS
+    conn = _get_conn()
+    try:
+        cur = conn.cursor()
+        try:
+            while time.monotonic() < deadline:
+                time.sleep(_POLL_INTERVAL)
+                cur.execute(
+                    "SELECT fingerprint, status, mimetype, body FROM idempotency_keys WHERE key_hash = %s",
+                    (key_hash,),
+                )
+                row = cur.fetchone()
+                conn.commit()  # fresh snapshot for the next poll
+                if row is None or row[1] is not None:
+                    return row
+            return "pending"
+        finally:
+            cur.close()
+    finally:
+        conn.close()
+
+
+def _finish(key_hash, fingerprint, resp):
+    """Store resp for replays, or release the key (resp None: the view raised) so a retry runs again."""
+    keep = (resp is not None and 200 <= resp.status_code < 500
+            and not resp.is_streamed and not resp.direct_passthrough)
+    body = resp.get_data() if keep else None
+    if body is not None and len(body) > IDEMPOTENCY_MAX_BODY:
+        keep = False
+    try:
+        conn = _get_conn()
+        try:
+            cur = conn.cursor()
+            try:
+                if keep:
+                    cur.execute(
+                        "UPDATE idempotency_keys SET status = %s, mimetype = %s, body = %s WHERE key_hash = %s",
+                        (resp.status_code, resp.mimetype, body, key_hash),
+                    )
+                else:
+                    cur.execute("DELETE FROM idempotency_keys WHERE key_hash = %s", (key_hash,))
+                conn.commit()
+            finally:
+                cur.close()
+        finally:
+            conn.close()
+    except mysql_errors.Error as e:
+        # the claim expires after IDEMPOTENCY_INFLIGHT_TIMEOUT; until then retries get 409
+        logger.warning("idempotency: could not store result for key %s…: %s", key_hash[:12], e)
+    if keep:
+        _cache_put(key_hash, fingerprint, resp.status_code, resp.mimetype, body)
+
+
+def idempotent(view):
+    """Run view at most once per Idempotency-Key (see module docstring)."""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        key = (request.headers.get(HEADER) or "").strip()
+        if request.method == "OPTIONS" or not key:
+            return view(*args, **kwargs)
+        if len(key) > MAX_KEY_LENGTH:
+            return jsonify({"success": False, "message": "Idempotency-Key 过长"}), 400
+
+        key_hash = hashlib.sha256(f"{request.endpoint}|{_caller()}|{key}".encode("utf-8")).hexdigest()
+        fingerprint = _fingerprint()
+
+        entry = _cache_get(key_hash)
+        if entry is not None:
+            return _replay(entry, fingerprint)
+
+        with _lock:
+            running = _inflight.get(key_hash)
+            if running is None:
+                mine = threading.Event()
+                _inflight[key_hash] = mine
+        if running is not None:
+            # duplicate of a request this worker is still executing
+            running.wait(IDEMPOTENCY_WAIT_SECONDS)
+            entry = _cache_get(key_hash)
+            return _replay(entry, fingerprint) if entry is not None else _in_progress()
+
+        try:
+            try:
+                row = _claim(key_hash, fingerprint)
+            except _KeyStoreError as e:
+                logger.warning("idempotency: key store unavailable, running %s unguarded: %s", request.endpoint, e)
+                return view(*args, **kwargs)
+
+            if row is not None:
+                if row[1] is None:
+                    # running on another worker
+                    try:
+                        row = _wait_for_row(key_hash)
+                    except mysql_errors.Error:
+                        row = "pending"
+                    if row == "pending":
+                        return _in_progress()
+                    if row is None:
+                        # the other request failed and released the key: let the client retry
+                        return _in_progress()
+                _cache_put(key_hash, row[0], row[1], row[2], row[3])
+                return _replay(row, fingerprint)
+
+            try:
+                resp = make_response(view(*args, **kwargs))
+            except Exception:
+                _finish(key_hash, fingerprint, None)
+                raise
+            _finish(key_hash, fingerprint, resp)
+            return resp
+        finally:
+            with _lock:
+                _inflight.pop(key_hash, None)
+            mine.set()
+
+    return wrapper
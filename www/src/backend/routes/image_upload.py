@@ -12,6 +12,8 @@ from dotenv import load_dotenv
 from flask import Blueprint, request, jsonify
 import mysql.connector
 from mysql.connector import errors as mysql_errors
+from routes.dbstats import trace_connection
+from routes.idempotency import idempotent
 from PIL import Image
 import io
 
@@ -49,7 +51,7 @@ def _get_conn():
         cur.execute("SET SESSION MAX_EXECUTION_TIME=15000")  # 15s
     finally:
         cur.close()
-    return conn
+    return trace_connection(conn)
 
 def process_image(image_data, image_type, user_id):
     """处理图片，保存到文件系统"""
@@ -88,6 +90,7 @@ def process_image(image_data, image_type, user_id):
         raise Exception("图片处理失败")
 
 @image_upload_blueprint.route('/upload_image', methods=['POST'])
+@idempotent
 def upload_image():
     """上传图片到文件系统"""
     if request.method == 'OPTIONS':
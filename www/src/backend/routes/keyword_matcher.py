@@ -0,0 +1,86 @@
+"""
+Precompiled multi-keyword matcher
+- KeywordMatcher is built once from {keyword: label(s)} and returns every label whose keyword
+  occurs in the text; keywords are grouped by label set and a group stops being tested as soon
+  as one of its keywords matched (or its labels were already hit by another group)
+- stream() returns an incremental scanner for text that arrives in chunks (SSE deltas): chunks are
+  scanned in blocks as they come in, with an overlap so keywords spanning a chunk boundary are
+  still found, and result() only has the last partial block left to scan
+
+Matching is exact and case-sensitive; callers lower-case the text the same way they
+lower-case their keyword lists. Substring tests run in C (str.__contains__), which for a few
+hundred short keywords is faster in CPython than a character-by-character automaton.
+"""
+
+
+class KeywordMatcher:
+    def __init__(self, keywords):
+        """keywords: mapping keyword -> label or iterable of labels (several keywords may share a label)."""
+        groups = {}
+        for keyword, labels in dict(keywords).items():
+            if not keyword:
+                continue
+            if isinstance(labels, (str, tuple)) or not hasattr(labels, "__iter__"):
+                labels = (labels,)
+            groups.setdefault(frozenset(labels), []).append(keyword)
+        # Keywords sharing the same label set are tried together; the first hit settles the group
+        self._groups = tuple((labels, tuple(words)) for labels, words in groups.items())
+        self.max_len = max((len(k) for words in groups.values() for k in words), default=0)
+
+    def scan(self, text: str, hits: set = None) -> set:
+        """Add the labels whose keyword occurs in text to hits (a new set by default) and return it."""
+        if hits is None:
+            hits = set()
+        if not text:
+            return hits
+        for labels, words in self._groups:
+            if labels <= hits:
+                continue
+            for keyword in words:
+                if keyword in text:
+                    hits |= labels
+                    break
+        return hits
+
+    def stream(self, block: int = 256) -> "KeywordStream":
+        return KeywordStream(self, block)
+
+
+class KeywordStream:
+    """Incremental scanner over one logical text delivered in chunks."""
+
+    __slots__ = ("_matcher", "_block", "_carry", "_pending", "_pending_len", "hits", "length")
+
+    def __init__(self, matcher: KeywordMatcher, block: int = 256):
+        self._matcher = matcher
+        self._block = max(block, matcher.max_len)
+        self._carry = ""
+        self._pending = []
+        self._pending_len = 0
+        self.hits = set()
+        self.length = 0
+
+    def feed(self, chunk: str) -> None:
+        if not chunk:
+            return
+        self.length += len(chunk)
+        self._pending.append(chunk)
+        self._pending_len += len(chunk)
+        if self._pending_len >= self._block:
+            self._flush()
+
+    def _flush(self) -> None:
+        if not self._pending:
+            return
+        window = self._carry + "".join(self._pending)
+        self._pending = []
+        self._pending_len = 0
+        self._matcher.scan(window, self.hits)
+        # Keep enough tail to complete any keyword that starts before the next chunk
+        keep = self._matcher.max_len - 1
+        self._carry = window[-keep:] if keep > 0 else ""
+
+    def result(self) -> set:
+        """Scan whatever is still buffered and return the labels hit so far."""
+        self._flush()
+        return self.hits
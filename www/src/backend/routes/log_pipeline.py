@@ -0,0 +1,184 @@
+"""
+Asynchronous, batched log shipping (one pipeline per worker process)
+- install_log_pipeline() puts a single QueueHandler on the root logger; request threads only
+  render the message and put the record on a bounded queue, and never block: when the queue
+  is full the record is dropped and counted
+- a listener thread drains the queue in batches (LOG_BATCH_SIZE records or LOG_FLUSH_INTERVAL
+  seconds, whichever comes first; WARNING and above flush right away) and hands each target
+  handler one combined record per batch, so ConcurrentRotatingFileHandler takes its
+  cross-process lock and checks rotation once per batch instead of once per line
+- pipeline_stats() reports queued / dropped / written counters (served at /logs/pipeline)
+
+Set LOG_ASYNC=0 to attach the handlers directly as before.
+"""
+import os
+import time
+import queue
+import atexit
+import logging
+import threading
+from logging.handlers import QueueHandler
+
+LOG_ASYNC = os.getenv("LOG_ASYNC", "1").strip().lower() not in {"0", "false", "no", "off"}
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+LOG_BATCH_SIZE = int(os.getenv("LOG_BATCH_SIZE", "200"))
+LOG_FLUSH_INTERVAL = float(os.getenv("LOG_FLUSH_INTERVAL", "0.5"))
+
+_PASSTHROUGH = logging.Formatter("%(message)s")
+_STOP = object()
+
+
+class _DroppingQueueHandler(QueueHandler):
+    """QueueHandler that drops (and counts) instead of blocking when the queue is full."""
+
+    def __init__(self, pipeline):
+        super().__init__(pipeline.queue)
+        self.pipeline = pipeline
+
+    def enqueue(self, record):
+        try:
+            self.pipeline.queue.put_nowait(record)
+        except queue.Full:
+            self.pipeline.count_drop()
+
+
+class _Pipeline:
+    def __init__(self, targets):
+        # targets: [(handler, formatter)]; the handlers themselves get a pass-through formatter
+        self.targets = targets
+        self.queue = queue.Queue(LOG_QUEUE_SIZE)
+        self.handler = _DroppingQueueHandler(self)
+        self._lock = threading.Lock()
+        self._thread = None
+        self.pid = os.getpid()
+        self.dropped = 0
+        self.written = 0
+        self.batches = 0
+        self.max_batch = 0
+        self.errors = 0
+        self.last_flush = None
+
+    def count_drop(self):
+        with self._lock:
+            self.dropped += 1
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="log-pipeline", daemon=True)
+        self._thread.start()
+
+    def after_fork(self):
+        # Threads do not survive fork(); give the child its own queue and listener
+        self.queue = queue.Queue(LOG_QUEUE_SIZE)
+        self._lock = threading.Lock()
+        self.pid = os.getpid()
+        self.dropped = self.written = self.batches = self.max_batch = self.errors = 0
+        self.last_flush = None
+        self.start()
+
+    def stop(self, timeout: float = 2.0):
+        if self._thread is None or not self._thread.is_alive():
+            return
+        try:
+            self.queue.put(_STOP, timeout=timeout)
+        except queue.Full:
+            return
+        self._thread.join(timeout)
+
+    def _run(self):
+        q = self.queue
+        while True:
+            record = q.get()
+            if record is _STOP:
+                return
+            batch = [record]
+            urgent = record.levelno >= logging.WARNING
+            deadline = time.monotonic() + LOG_FLUSH_INTERVAL
+            stop = False
+            while not urgent and len(batch) < LOG_BATCH_SIZE:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    record = q.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if record is _STOP:
+                    stop = True
+                    break
+                batch.append(record)
+                urgent = record.levelno >= logging.WARNING
+            # Pick up whatever else is already waiting without blocking
+            while not stop and len(batch) < LOG_BATCH_SIZE:
+                try:
+                    record = q.get_nowait()
+                except queue.Empty:
+                    break
+                if record is _STOP:
+                    stop = True
+                    break
+                batch.append(record)
+            self._write(batch)
+            if stop:
+                return
+
+    def _write(self, batch):
+        for handler, formatter in self.targets:
+            try:
+                lines = [formatter.format(r) for r in batch if r.levelno >= handler.level]
+                if not lines:
+                    continue
+                level = max(r.levelno for r in batch)
+                combined = logging.LogRecord("app.log_pipeline", level, "", 0, "\n".join(lines), None, None)
+                handler.handle(combined)
+            except Exception:
+                self.errors += 1
+        self.written += len(batch)
+        self.batches += 1
+        self.max_batch = max(self.max_batch, len(batch))
+        self.last_flush = time.time()
+
+    def stats(self) -> dict:
+        return {
+            "enabled": True,
+            "pid": self.pid,
+            "queued": self.queue.qsize(),
+            "capacity": LOG_QUEUE_SIZE,
+            "dropped": self.dropped,
+            "written": self.written,
+            "batches": self.batches,
+            "max_batch": self.max_batch,
+            "errors": self.errors,
+            "last_flush": self.last_flush,
+            "batch_size": LOG_BATCH_SIZE,
+            "flush_interval": LOG_FLUSH_INTERVAL,
+        }
+
+
+_pipeline = None
+
+
+def install_log_pipeline(root: logging.Logger, handlers) -> bool:
+    """
+    Route root's records through the queue pipeline to `handlers` (each keeps its own formatter
+    for per-line formatting). Returns False if a pipeline was already installed in this process.
+    """
+    global _pipeline
+    if _pipeline is not None and _pipeline.handler in root.handlers:
+        return False
+    targets = []
+    for h in handlers:
+        targets.append((h, h.formatter or _PASSTHROUGH))
+        h.setFormatter(_PASSTHROUGH)
+    _pipeline = _Pipeline(targets)
+    _pipeline.start()
+    root.addHandler(_pipeline.handler)
+    if hasattr(os, "register_at_fork"):
+        os.register_at_fork(after_in_child=_pipeline.after_fork)
+    atexit.register(_pipeline.stop)
+    return True
+
+
+def pipeline_stats() -> dict:
+    if _pipeline is None:
+        return {"enabled": False, "pid": os.getpid()}
+    return _pipeline.stats()
@@ -1,6 +1,10 @@
 from flask import Blueprint, request, jsonify
 import mysql.connector
 from mysql.connector import errors as mysql_errors
+from routes.dbstats import trace_connection
+from routes.credentials import verify_password, schedule_upgrade, CredentialBusy
+from routes.session_token import issue_token
+from routes.userstore import AUTH_COLUMNS, ensure_users_schema
 import os
 from dotenv import load_dotenv
 import logging
@@ -28,7 +32,31 @@ def _get_conn():
         cur.execute("SET SESSION MAX_EXECUTION_TIME=15000")  # 15s
     finally:
         cur.close()
-    return conn
+    return trace_connection(conn)
+
+def _store_upgraded_hash(user_id, old_value):
+    """Return a callback that swaps a legacy/stale password value for its new hash (only if unchanged)."""
+    def store(new_hash):
+        conn = _get_conn()
+        cur = conn.cursor()
+        try:
+            ensure_users_schema(conn)
+            cur.execute(
+                "UPDATE users SET password=%s WHERE user_id=%s AND password=%s",
+                (new_hash, user_id, old_value)
+            )
+            logger.info("/login password hash upgraded user_id=%s", user_id)
+        finally:
+            try:
+                cur.close()
+            except Exception:
+                pass
+            try:
+                conn.close()
+            except Exception:
+                pass
+    return store
+
 
 @login_blueprint.route('/login', methods=['POST', 'OPTIONS'])
 def login():
@@ -42,13 +70,15 @@ def login():
         password = data.get("password")
 
         if not username or not password:
-            logger.warning("/login missing username or password data=%s", data)
+            logger.warning("/login missing username or password username=%s", username)
             return jsonify({"success": False, "message": "缺少用户名或密码"}), 400
 
         conn = _get_conn()
         cursor = conn.cursor(dictionary=True)
         try:
-            cursor.execute("SELECT * FROM users WHERE username=%s AND password=%s", (username, password))
+            ensure_users_schema(conn)
+            # Fetch by username only (covering index); the password is checked against the stored hash below
+            cursor.execute(f"SELECT {AUTH_COLUMNS} FROM users WHERE username=%s", (username,))
             user = cursor.fetchone()
         finally:
             try:
@@ -60,13 +90,27 @@ def login():
             except Exception:
                 pass
 
-        if user:
+        ok, needs_upgrade = verify_password(password, user["password"]) if user else (False, False)
+        if ok and needs_upgrade:
+            schedule_upgrade(password, _store_upgraded_hash(user["user_id"], user["password"]))
+
+        if ok:
             logger.info("/login success username=%s user_id=%s", username, user['user_id'])
-            return jsonify({"success": True, "userId": user["user_id"]})
+            # the stored spelling: the lookup is case-insensitive, resolve_identity compares exactly
+            session = issue_token(user["user_id"], user["username"])
+            return jsonify({
+                "success": True,
+                "userId": user["user_id"],
+                "token": session["token"],
+                "expires_at": session["expires_at"],
+            })
         else:
             logger.warning("/login failed invalid credentials username=%s", username)
             return jsonify({"success": False, "message": "用户名或密码错误"}), 401
 
+    except CredentialBusy:
+        logger.warning("/login password hashing pool saturated")
+        return jsonify({"success": False, "message": "服务器繁忙，请稍后重试"}), 503
     except mysql_errors.Error as e:
         # 3024: MAX_EXECUTION_TIME exceeded; 1205: Lock wait timeout; 1213: Deadlock found
         if getattr(e, 'errno', None) in (3024, 1205, 1213):
@@ -2,6 +2,7 @@
 日志监视器后端接口
 - 列出日志目录下可用的日志文件
 - 读取日志文件尾部内容（按行数 tail）
+- 查看当前 worker 日志管道的队列 / 丢弃计数
 """
 from __future__ import annotations
 
@@ -11,6 +12,8 @@ import time
 from typing import List
 from flask import Blueprint, jsonify, request, abort
 
+from routes.log_pipeline import pipeline_stats
+
 logs_blueprint = Blueprint("logs", __name__)
 
 # 计算日志目录：相对当前文件 ../../../log
@@ -133,3 +136,7 @@ def get_content():
     })
 
 
+@logs_blueprint.get("/logs/pipeline")
+def get_pipeline():
+    # 计数按 worker 进程统计，多 worker 时每次请求可能落到不同进程
+    return jsonify(pipeline_stats())
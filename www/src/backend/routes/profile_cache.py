@@ -0,0 +1,87 @@
+"""
+Read-through cache for user profiles (PROFILE_COLUMNS rows), one per worker process
+- get_profile() answers /readdata and /get_avatar from memory for PROFILE_CACHE_TTL seconds,
+  keyed by user_id with a username -> user_id alias, and calls the route's loader on a miss
+- invalidate() is called by editdata / upload_avatar / delete_account after they commit; other
+  workers catch up when their entry expires, so keep the TTL short
+- profile_etag() gives a strong ETag over the response payload; routes check it with
+  not_modified() (routes/conditional.py) so clients can revalidate with a 304
+"""
+import os
+import json
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+
+PROFILE_CACHE_TTL = float(os.getenv("PROFILE_CACHE_TTL", "30"))
+PROFILE_CACHE_SIZE = int(os.getenv("PROFILE_CACHE_SIZE", "10000"))
+
+_lock = threading.Lock()
+_by_id = OrderedDict()  # user_id -> (expires_at, profile)
+_alias = {}  # username -> user_id
+
+
+def _lookup(user_id, username):
+    now = time.monotonic()
+    with _lock:
+        if not user_id and username:
+            user_id = _alias.get(username)
+        if not user_id:
+            return None
+        entry = _by_id.get(user_id)
+        if entry is None:
+            return None
+        expires_at, profile = entry
+        if expires_at < now or (username and profile.get("username") != username):
+            return None
+        _by_id.move_to_end(user_id)
+        return profile
+
+
+def _store(profile):
+    user_id = profile.get("user_id")
+    if not user_id:
+        return
+    with _lock:
+        _by_id[user_id] = (time.monotonic() + PROFILE_CACHE_TTL, profile)
+        _by_id.move_to_end(user_id)
+        if profile.get("username"):
+            _alias[profile["username"]] = user_id
+        while len(_by_id) > PROFILE_CACHE_SIZE:
+            _, (_, old) = _by_id.popitem(last=False)
+            if old.get("username") and _alias.get(old["username"]) == old.get("user_id"):
+                del _alias[old["username"]]
+
+
+def get_profile(user_id=None, username=None, loader=None):
+    """
+    Profile dict for user_id (or username), or None if the user does not exist.
+    loader(user_id, username) must return the PROFILE_COLUMNS row (dict) or None.
+    """
+    if PROFILE_CACHE_TTL > 0:
+        cached = _lookup(user_id, username)
+        if cached is not None:
+            return dict(cached)
+    profile = loader(user_id, username)
+    if profile is not None and PROFILE_CACHE_TTL > 0:
+        _store(dict(profile))
+    return profile
+
+
+def invalidate(user_id=None, username=None):
+    """Drop the cached profile for user_id and/or username in this worker."""
+    with _lock:
+        if username and not user_id:
+            user_id = _alias.get(username)
+        if username:
+            _alias.pop(username, None)
+        if user_id:
+            entry = _by_id.pop(user_id, None)
+            if entry and entry[1].get("username"):
+                _alias.pop(entry[1]["username"], None)
+
+
+def profile_etag(payload) -> str:
+    raw = json.dumps(payload, sort_keys=True, ensure_ascii=False, default=str).encode("utf-8")
+    return '"p-' + hashlib.sha1(raw).hexdigest()[:20] + '"'
@@ -0,0 +1,136 @@
+"""
+In-process rate limiting primitives (per worker)
+- TokenBucketLimiter: one token bucket per key (phone, client IP, ...); keys are kept in an
+  LRU-bounded table so a flood of distinct keys cannot grow memory without limit
+- DayBlocklist: remembers keys that hit a daily cap until the (UTC) day rolls over, so repeat
+  offenders are turned away without a database round trip
+- client_ip(): caller address, honouring X-Real-IP / X-Forwarded-For only on requests that come
+  from a trusted proxy address (RATE_LIMIT_TRUSTED_PROXIES), so a client that reaches gunicorn
+  directly cannot pick its own rate-limit key
+
+These are a cheap first line; anything that must hold across workers (e.g. the OTP daily
+count in sms_codes) still needs an authoritative check in the database.
+"""
+import os
+import time
+import logging
+import threading
+import ipaddress
+from collections import OrderedDict
+from datetime import datetime
+
+logger = logging.getLogger("app.ratelimit")
+
+RATE_LIMIT_TRUST_PROXY = os.getenv("RATE_LIMIT_TRUST_PROXY", "1").strip().lower() not in {"0", "false", "no", "off"}
+# launch.sh binds gunicorn to 127.0.0.1 behind a proxy on the same host, so only loopback peers by default
+RATE_LIMIT_TRUSTED_PROXIES = os.getenv("RATE_LIMIT_TRUSTED_PROXIES", "127.0.0.1/32,::1/128")
+RATE_LIMIT_MAX_KEYS = int(os.getenv("RATE_LIMIT_MAX_KEYS", "100000"))
+
+
+def _parse_networks(spec: str) -> tuple:
+    networks = []
+    for part in (spec or "").split(","):
+        part = part.strip()
+        if not part:
+            continue
+        try:
+            networks.append(ipaddress.ip_network(part, strict=False))
+        except ValueError:
+            logger.warning("RATE_LIMIT_TRUSTED_PROXIES: ignoring invalid entry %r", part)
+    return tuple(networks)
+
+
+_TRUSTED_NETWORKS = _parse_networks(RATE_LIMIT_TRUSTED_PROXIES)
+
+
+class TokenBucketLimiter:
+    def __init__(self, capacity: float, refill_per_sec: float, max_keys: int = RATE_LIMIT_MAX_KEYS):
+        self.capacity = float(capacity)
+        self.refill_per_sec = float(refill_per_sec)
+        self.max_keys = max_keys
+        self._lock = threading.Lock()
+        self._buckets = OrderedDict()  # key -> [tokens, last_monotonic]
+
+    def allow(self, key: str, cost: float = 1.0):
+        """Take `cost` tokens for key. Returns (allowed, retry_after_seconds)."""
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = [self.capacity, now]
+                self._buckets[key] = bucket
+                while len(self._buckets) > self.max_keys:
+                    self._buckets.popitem(last=False)
+            else:
+                self._buckets.move_to_end(key)
+                bucket[0] = min(self.capacity, bucket[0] + (now - bucket[1]) * self.refill_per_sec)
+                bucket[1] = now
+            if bucket[0] >= cost:
+                bucket[0] -= cost
+                return True, 0.0
+            if self.refill_per_sec <= 0:
+                return False, float("inf")
+            return False, (cost - bucket[0]) / self.refill_per_sec
+
+    def refund(self, key: str, cost: float = 1.0):
+        """Give tokens back (e.g. the request failed validation after allow())."""
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is not None:
+                bucket[0] = min(self.capacity, bucket[0] + cost)
+
+    def __len__(self):
+        return len(self._buckets)
+
+
+class DayBlocklist:
+    def __init__(self, max_keys: int = RATE_LIMIT_MAX_KEYS):
+        self.max_keys = max_keys
+        self._lock = threading.Lock()
+        self._blocked = OrderedDict()  # key -> date it was blocked on (UTC)
+
+    def block(self, key: str, day=None):
+        day = day or datetime.utcnow().date()
+        with self._lock:
+            self._blocked[key] = day
+            self._blocked.move_to_end(key)
+            while len(self._blocked) > self.max_keys:
+                self._blocked.popitem(last=False)
+
+    def is_blocked(self, key: str, day=None) -> bool:
+        day = day or datetime.utcnow().date()
+        with self._lock:
+            blocked_on = self._blocked.get(key)
+            if blocked_on is None:
+                return False
+            if blocked_on != day:
+                del self._blocked[key]
+                return False
+            return True
+
+
+def _trusted_proxy(addr: str) -> bool:
+    try:
+        ip = ipaddress.ip_address(addr)
+    except ValueError:
+        return False
+    return any(ip in net for net in _TRUSTED_NETWORKS)
+
+
+def client_ip(req) -> str:
+    """Best-effort client address for a Flask request (forwarding headers only from a trusted proxy)."""
+    peer = req.remote_addr or ""
+    if RATE_LIMIT_TRUST_PROXY and _trusted_proxy(peer):
+        real_ip = (req.headers.get("X-Real-IP") or "").strip()
+        if real_ip:
+            return real_ip
+        forwarded = req.headers.get("X-Forwarded-For") or ""
+        if forwarded:
+            # The proxy appends the peer it saw; earlier entries are client-controlled
+            return forwarded.split(",")[-1].strip()
+    return peer
+
+
+def seconds_until_utc_midnight() -> int:
+    now = datetime.utcnow()
+    return max(1, 86400 - (now.hour * 3600 + now.minute * 60 + now.second))
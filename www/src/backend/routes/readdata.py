@@ -1,8 +1,12 @@
 import os
 from dotenv import load_dotenv
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, request, jsonify, make_response
 import mysql.connector
 from mysql.connector import errors as mysql_errors
+from routes.dbstats import trace_connection
+from routes.userstore import PROFILE_COLUMNS, LISTING_COLUMNS, ensure_users_schema, page_size
+from routes.profile_cache import get_profile, profile_etag
+from routes.conditional import not_modified
 import logging
 
 load_dotenv()
@@ -29,15 +33,48 @@ def _get_conn():
         cur.execute("SET SESSION MAX_EXECUTION_TIME=15000")  # 15s
     finally:
         cur.close()
-    return conn
+    return trace_connection(conn)
 
-@readdata_blueprint.route('/readdata', methods=['POST', 'OPTIONS'])
+def _load_profile(user_id, username):
+    """PROFILE_COLUMNS row for user_id (or username), or None. Loader for the profile cache."""
+    conn = _get_conn()
+    cursor = conn.cursor(dictionary=True)
+    try:
+        # avatar_url 列、密码列宽度与覆盖索引：每个进程只检查一次
+        ensure_users_schema(conn)
+        if user_id:
+            cursor.execute(f"SELECT {PROFILE_COLUMNS} FROM users WHERE user_id = %s LIMIT 1", (user_id,))
+        else:
+            cursor.execute(f"SELECT {PROFILE_COLUMNS} FROM users WHERE username = %s LIMIT 1", (username,))
+        return cursor.fetchone()
+    finally:
+        try:
+            cursor.close()
+        except Exception:
+            pass
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+
+@readdata_blueprint.route('/readdata', methods=['GET', 'POST', 'OPTIONS'])
 def readdata():
+    """
+    Profile read. With user_id / username returns that user's profile columns (never the password),
+    served from the per-worker profile cache with an ETag (If-None-Match -> 304). GET takes the same
+    fields as query parameters.
+    Without a filter the listing is paged: {"page_size": <=100, "after": "<last user_id>"}, and the
+    response carries paging.next_after for the following page.
+    """
     if request.method == 'OPTIONS':
         return '', 200
     try:
-        data = request.get_json(silent=True) or {}
-        logger.info("/readdata request data=%s", data)
+        if request.method == 'GET':
+            data = request.args.to_dict()
+        else:
+            data = request.get_json(silent=True) or {}
+        logger.info("/readdata body_keys=%s", list(data.keys()) if isinstance(data, dict) else None)
 
         table_name = data.get("table_name")
         user_id = data.get("user_id")
@@ -51,25 +88,40 @@ def readdata():
             logger.warning("/readdata illegal table_name=%s", table_name)
             return jsonify({"success": False, "message": "不允许访问该表"}), 400
 
+        if user_id or username:
+            profile = get_profile(user_id, username, _load_profile)
+            results = [profile] if profile else []
+            etag = profile_etag(results)
+            if not_modified(etag):
+                resp = make_response('', 304)
+            else:
+                logger.info("/readdata success table=%s count=%d", table_name, len(results))
+                resp = jsonify({
+                    "success": True,
+                    "message": "数据读取成功",
+                    "data": results,
+                    "count": len(results)
+                })
+            resp.headers["ETag"] = etag
+            resp.headers["Cache-Control"] = "private, no-cache"
+            return resp
+
         conn = _get_conn()
         cursor = conn.cursor(dictionary=True)
         try:
-            # 检查avatar_url字段是否存在，如果不存在则添加
-            cursor.execute("SHOW COLUMNS FROM users LIKE 'avatar_url'")
-            if not cursor.fetchone():
-                logger.info("/readdata adding avatar_url column to users table")
-                cursor.execute("ALTER TABLE users ADD COLUMN avatar_url VARCHAR(500) NULL")
-                conn.commit()
-            
-            query = f"SELECT * FROM {table_name}"
+            ensure_users_schema(conn)
+
+            # Unfiltered listing: keyset paging on the primary key keeps each page cheap; public
+            # fields only, phone numbers stay with the single-user profile lookup
+            size = page_size(data.get("page_size"))
+            after = (data.get("after") or "").strip()
+            query = f"SELECT {LISTING_COLUMNS} FROM {table_name}"
             params = []
-            if user_id:
-                query += " WHERE user_id = %s"
-                params.append(user_id)
-            elif username:
-                query += " WHERE username = %s"
-                params.append(username)
-            query += " LIMIT 1000"
+            if after:
+                query += " WHERE user_id > %s"
+                params.append(after)
+            query += " ORDER BY user_id LIMIT %s"
+            params.append(size)
 
             logger.info("/readdata executing query=%s params=%s", query, params)
             cursor.execute(query, params)
@@ -87,10 +139,14 @@ def readdata():
         logger.info("/readdata success table=%s count=%d", table_name, len(results))
 
         return jsonify({
-            "success": True, 
+            "success": True,
             "message": "数据读取成功",
             "data": results,
-            "count": len(results)
+            "count": len(results),
+            "paging": {
+                "page_size": size,
+                "next_after": results[-1]["user_id"] if len(results) == size else None,
+            },
         })
 
     except mysql_errors.Error as e:
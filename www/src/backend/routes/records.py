@@ -0,0 +1,351 @@
+"""
+Health-record storage: compressed content plus a small uncompressed summary
+- <kind>_files.content used to hold every record as JSON text. New rows keep the JSON compressed in
+  content_blob (content_codec says how) and leave content empty; summary holds the few fields the
+  list / calendar queries need, uncompressed, so those queries never read the blob
+- codecs: zlib with a preset dictionary, or zstd with the same dictionary when the zstandard module
+  is installed (RECORD_CODEC: auto / zstd / zlib / plain). The dictionary is the skeleton every
+  client upload shares (exportInfo, the *Data keys and field names, common values), so even a
+  200-byte symptom record shrinks. It is part of the stored format: never edit _DICT_V1, add a new
+  dictionary under new codec ids and keep the old ones decodable
+- readers select CONTENT_COLUMNS and call decode_row(), which puts the JSON text back in
+  row["content"] whatever the codec, so their json.loads stays as it was. Rows written before this
+  (content_codec 0) read unchanged until tools/compress_records.py converts them
+- a record that would not get smaller is stored plain
+- summaries carry their SUMMARY_VERSION; readers treat an older or missing one as absent and
+  summarize the content instead, and tools/compress_records.py rewrites them
+"""
+import os
+import re
+import json
+import zlib
+import logging
+import threading
+from typing import Optional
+
+from mysql.connector import errors as mysql_errors
+
+try:
+    import zstandard
+except ImportError:  # optional: zlib only
+    zstandard = None
+
+logger = logging.getLogger("app.records")
+
+RECORD_CODEC = os.getenv("RECORD_CODEC", "auto").strip().lower()
+
+CODEC_PLAIN = 0
+CODEC_ZLIB_V1 = 1
+CODEC_ZSTD_V1 = 2
+
+# Columns a reader selects instead of content / a writer fills instead of content
+CONTENT_COLUMNS = "content, content_codec, content_blob"
+STORAGE_COLUMNS = "content, content_codec, content_blob, summary"
+
+SUMMARY_VERSION = 2
+SUMMARY_PREFIX = f'{{"v":{SUMMARY_VERSION},'
+SUMMARY_MAX_CHARS = 1024
+_SUMMARY_MAX_ITEMS = 32
+_SUMMARY_MAX_MEALS = 8
+_SUMMARY_MAX_TEXT = 40
+# dropped first to last when a summary does not fit; date / time / kind always stay
+_SUMMARY_DROP_ORDER = ("foods", "sections", "symptomTypes", "diagnosis", "department", "hospital",
+                       "metrics", "images", "symptoms", "mealDates")
+
+# (metricsData section, field, key in summary["metrics"])
+_METRIC_FIELDS = (
+    ("temperature", "temperature", "temperature"),
+    ("proteinuria", "proteinuria24h", "proteinuria24h"),
+    ("self-rating", "selfRating", "selfRating"),
+    ("bleeding-point", "bleedingPoint", "bleedingPoint"),
+    ("blood-test", "wbc", "wbc"),
+    ("blood-test", "rbc", "rbc"),
+    ("blood-test", "hb", "hb"),
+    ("blood-test", "plt", "plt"),
+    ("urinalysis", "protein", "urineProtein"),
+    ("urinalysis", "blood", "urineBlood"),
+)
+
+_ZLIB_LEVEL = 6
+_ZSTD_LEVEL = 3
+
+# Record skeletons as the clients upload them (metrics.js, diet.js, case_record.js); later
+# fragments sit closer to the data and are matched more cheaply, so the most common go last
+_DICT_V1 = "".join((
+    '"hospital":"","department":"","doctor":"","diagnosis":"","prescription":"","images":[],',
+    '"caseData":{"hospital":"医院","department":"儿科","doctor":"医生","diagnosis":"过敏性紫癜",',
+    '"id":"case_","timestamp":"2025-10-01 12:00:00"}}',
+    '"urinalysis-matrix":{"urinalysisMatrix":[{"item":"protein","value":"","index":0},',
+    '{"item":"blood","value":"","index":1}]},',
+    '"blood-test":{"wbc":,"rbc":,"hb":,"plt":},"proteinuria":{"proteinuria24h":},',
+    '"bleeding-point":{"bleedingPoint":"joints"},"self-rating":{"selfRating":},',
+    '"urinalysis":{"protein":"-","glucose":"-","ketones":"-","blood":"-"},',
+    '"temperature":{"temperature":36.},',
+    '"metricsData":{"symptoms":{"items":[{"type":"skin-type","description":"出血点"}]},',
+    '"symptomData":{"symptoms":[]}}',
+    '"dietData":{"meal_1":{"mealId":1,"time":"07:30","food":"米饭、青菜、鸡蛋","images":[],',
+    '"date":"2025-10-01","timestamp":"2025-10-01 07:30:00"},',
+    '"meal_2":{"mealId":2,"time":"12:00","food":"","images":["data:image/jpeg;base64,"],',
+    '"date":"2025-10-01","timestamp":"2025-10-01 12:00:00"}}}',
+    '"dataType":"health_metrics"},"dataType":"diet_record"},"dataType":"case_record"},',
+    '"dataType":"symptom_tracking"},',
+    '{"exportInfo":{"exportTime":"2025/10/01 12:00:00","recordTime":"2025-10-01 12:00:00",',
+    '"version":"1.0","appName":"紫癜精灵",',
+)).encode("utf-8")
+
+_RECORD_MIGRATIONS = (
+    "ALTER TABLE {table} ADD COLUMN content_codec TINYINT NOT NULL DEFAULT 0",
+    "ALTER TABLE {table} ADD COLUMN content_blob LONGBLOB NULL",
+    "ALTER TABLE {table} ADD COLUMN summary VARCHAR(1024) NULL",
+)
+
+_tables_ready = set()
+
+if zstandard is not None:
+    _ZSTD_DICT = zstandard.ZstdCompressionDict(_DICT_V1, dict_type=zstandard.DICT_TYPE_RAWCONTENT)
+    _ZSTD_DICT.precompute_compress(level=_ZSTD_LEVEL)
+else:
+    _ZSTD_DICT = None
+_DECODE_ERRORS = (zlib.error, UnicodeDecodeError) + ((zstandard.ZstdError,) if zstandard else ())
+_zstd_local = threading.local()  # zstd (de)compressors are not safe to share between threads
+
+
+def _write_codec() -> int:
+    if RECORD_CODEC == "plain":
+        return CODEC_PLAIN
+    if RECORD_CODEC == "zlib" or _ZSTD_DICT is None:
+        if RECORD_CODEC == "zstd":
+            logger.warning("RECORD_CODEC=zstd but zstandard is not installed, using zlib")
+        return CODEC_ZLIB_V1
+    return CODEC_ZSTD_V1
+
+
+WRITE_CODEC = _write_codec()
+
+
+def _zstd():
+    if getattr(_zstd_local, "compressor", None) is None:
+        _zstd_local.compressor = zstandard.ZstdCompressor(dict_data=_ZSTD_DICT, level=_ZSTD_LEVEL)
+        _zstd_local.decompressor = zstandard.ZstdDecompressor(dict_data=_ZSTD_DICT)
+    return _zstd_local
+
+
+def ensure_columns(conn, table: str) -> None:
+    """Add the codec / summary columns to a record table once per process (no-op if it does not exist yet)."""
+    if table in _tables_ready:
+        return
+    cur = conn.cursor()
+    try:
+        for stmt in _RECORD_MIGRATIONS:
+            try:
+                cur.execute(stmt.format(table=table))
+            except mysql_errors.Error as e:
+                errno = getattr(e, 'errno', None)
+                if errno == 1146:
+                    return  # not created yet: uploadjson creates it with these columns
+                # 1060 duplicate column / 1061 duplicate key name: already migrated
+                if errno not in (1060, 1061):
+                    raise
+        _tables_ready.add(table)
+    finally:
+        try:
+            cur.close()
+        except Exception:
+            pass
+
+
+def encode(text: str, codec: int = None):
+    """(content, content_codec, content_blob) to store for a record's JSON text."""
+    codec = WRITE_CODEC if codec is None else codec
+    if codec == CODEC_PLAIN:
+        return text, CODEC_PLAIN, None
+    raw = text.encode("utf-8")
+    if codec == CODEC_ZSTD_V1:
+        blob = _zstd().compressor.compress(raw)
+    else:
+        c = zlib.compressobj(_ZLIB_LEVEL, zdict=_DICT_V1)
+        blob = c.compress(raw) + c.flush()
+    if len(blob) >= len(raw):
+        return text, CODEC_PLAIN, None
+    return "", codec, blob
+
+
+def decode(content, codec, blob) -> str:
+    """The record's JSON text from its stored columns; ValueError if the blob cannot be read."""
+    if not codec:
+        return content or ""
+    blob = bytes(blob or b"")
+    try:
+        if codec == CODEC_ZLIB_V1:
+            d = zlib.decompressobj(zdict=_DICT_V1)
+            raw = d.decompress(blob) + d.flush()
+        elif codec == CODEC_ZSTD_V1:
+            if _ZSTD_DICT is None:
+                raise ValueError("record stored with zstd but zstandard is not installed")
+            raw = _zstd().decompressor.decompress(blob)
+        else:
+            raise ValueError(f"unknown record codec {codec}")
+        return raw.decode("utf-8")
+    except _DECODE_ERRORS as e:
+        raise ValueError(f"corrupt record blob (codec {codec}): {e}")
+
+
+def decode_row(row: dict) -> dict:
+    """Replace the CONTENT_COLUMNS of a dictionary row with the JSON text in row["content"]."""
+    codec = row.pop("content_codec", None)
+    blob = row.pop("content_blob", None)
+    row["content"] = decode(row.get("content"), codec, blob)
+    return row
+
+
+# ---- summary ----
+
+_YMD_RE = re.compile(r"^(\d{4})[-/.](\d{2})[-/.](\d{2})")
+
+
+def ymd(value) -> Optional[str]:
+    """YYYY-MM-DD 头部（兼容 - / . 分隔符及带时间的字符串），无法解析返回 None"""
+    if not value:
+        return None
+    m = _YMD_RE.match(str(value).strip())
+    return f"{m.group(1)}-{m.group(2)}-{m.group(3)}" if m else None
+
+
+def record_date(content) -> Optional[str]:
+    """记录日期：exportInfo.recordTime，缺失退回 exportTime"""
+    exp = (content or {}).get('exportInfo') or {}
+    return ymd(exp.get('recordTime') or exp.get('exportTime'))
+
+
+def _scalars(values):
+    return [v for v in values if isinstance(v, (int, float, str)) and not isinstance(v, bool)][:_SUMMARY_MAX_ITEMS]
+
+
+def _text(value) -> Optional[str]:
+    if not isinstance(value, str) or not value.strip() or value.startswith("data:"):
+        return None
+    value = value.strip()
+    return value if len(value) <= _SUMMARY_MAX_TEXT else value[:_SUMMARY_MAX_TEXT] + "…"
+
+
+def _section(data, key) -> dict:
+    value = data.get(key) if isinstance(data, dict) else None
+    return value if isinstance(value, dict) else {}
+
+
+def _summarize_metrics(content, summary):
+    data = content.get('metricsData')
+    if not isinstance(data, dict):
+        return
+    summary["sections"] = [k for k in data if isinstance(k, str)][:_SUMMARY_MAX_ITEMS]
+    metrics = {}
+    for section, field, name in _METRIC_FIELDS:
+        value = _section(data, section).get(field)
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            metrics[name] = value
+        elif _text(value):
+            metrics[name] = _text(value)
+    if metrics:
+        summary["metrics"] = metrics
+    items = _section(data, 'symptoms').get('items')
+    if isinstance(items, list):
+        types = _scalars(item.get('type') for item in items if isinstance(item, dict))
+        if types:
+            summary["symptomTypes"] = list(dict.fromkeys(types))
+
+
+def _meal_date(meal) -> Optional[str]:
+    """Same per-meal date as getjson's ?date= filter: meal.date, else the date part of meal.timestamp."""
+    md = meal.get('date')
+    md = md.strip() if isinstance(md, str) else ''
+    return md or ymd(meal.get('timestamp'))
+
+
+def _summarize_diet(content, summary):
+    meals = [m for m in (_section(content, 'dietData').values()) if isinstance(m, dict)]
+    summary["meals"] = len(meals)
+    dates = [d for d in dict.fromkeys(_meal_date(m) for m in meals) if d]
+    if len(dates) <= _SUMMARY_MAX_ITEMS:
+        summary["mealDates"] = dates  # absent (too many to keep) means: check the content
+    foods = [f for f in (_text(m.get('food')) for m in meals) if f]
+    if foods:
+        summary["foods"] = foods[:_SUMMARY_MAX_MEALS]
+    images = sum(len(m.get('images')) for m in meals if isinstance(m.get('images'), list))
+    if images:
+        summary["images"] = images
+
+
+def _summarize_case(content, summary):
+    case = _section(content, 'caseData')
+    for field in ('hospital', 'department', 'diagnosis'):
+        value = _text(case.get(field))
+        if value:
+            summary[field] = value
+    if isinstance(case.get('images'), list) and case['images']:
+        summary["images"] = len(case['images'])
+
+
+def _summarize_symptoms(content, summary):
+    symptoms = _section(content, 'symptomData').get('symptoms')
+    if isinstance(symptoms, list):
+        summary["symptoms"] = _scalars(symptoms)
+
+
+_SUMMARIZERS = {
+    "metrics": _summarize_metrics,
+    "diet": _summarize_diet,
+    "case": _summarize_case,
+    "symptoms": _summarize_symptoms,
+}
+
+
+def summarize(kind: str, content) -> str:
+    """
+    Summary JSON stored next to the content: {"v", "kind", "date", "time", ...per kind}.
+    - date: record date (exportInfo.recordTime, else exportTime); time: that value as uploaded
+    - metrics: sections, key values (metrics), symptomTypes; diet: meals, mealDates, foods, images;
+      case: hospital, department, diagnosis, images; symptoms: symptom codes
+    Always a JSON object that starts with SUMMARY_PREFIX, so rows with a blob always have one.
+    Optional keys are dropped (_SUMMARY_DROP_ORDER) until it fits SUMMARY_MAX_CHARS.
+    """
+    summary = {"v": SUMMARY_VERSION, "kind": kind}
+    if isinstance(content, dict):
+        exp = content.get('exportInfo') if isinstance(content.get('exportInfo'), dict) else {}
+        summary["date"] = record_date(content)
+        summary["time"] = _text(exp.get('recordTime') or exp.get('exportTime'))
+        try:
+            _SUMMARIZERS[kind](content, summary)
+        except Exception as e:  # odd shapes only cost the preview fields
+            logger.warning("record summary (%s) failed: %s", kind, e)
+    text = json.dumps(summary, ensure_ascii=False, separators=(",", ":"))
+    for key in _SUMMARY_DROP_ORDER:
+        if len(text) <= SUMMARY_MAX_CHARS:
+            break
+        if summary.pop(key, None) is not None:
+            text = json.dumps(summary, ensure_ascii=False, separators=(",", ":"))
+    return text
+
+
+def summary_current(text) -> bool:
+    """True if a stored summary was written by this SUMMARY_VERSION."""
+    return isinstance(text, str) and text.startswith(SUMMARY_PREFIX)
+
+
+def load_summary(text) -> Optional[dict]:
+    """Parsed summary, or None if missing / from an older version (recompute it from the content)."""
+    if not summary_current(text):
+        return None
+    try:
+        return json.loads(text)
+    except ValueError:
+        return None
+
+
+def storage_values(kind: str, text: str, content=None) -> tuple:
+    """Values for STORAGE_COLUMNS from a record's JSON text (content: the parsed object, if at hand)."""
+    if content is None:
+        try:
+            content = json.loads(text)
+        except ValueError:
+            content = None
+    return encode(text) + (summarize(kind, content),)
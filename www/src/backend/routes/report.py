@@ -13,6 +13,8 @@ from dotenv import load_dotenv
 from flask import Blueprint, request, jsonify
 import mysql.connector
 from mysql.connector import errors as mysql_errors
+from routes.dbstats import trace_connection
+from routes.idempotency import idempotent
 
 load_dotenv()
 
@@ -35,7 +37,7 @@ def _get_conn():
         cur.execute("SET SESSION MAX_EXECUTION_TIME=15000")
     finally:
         cur.close()
-    return conn
+    return trace_connection(conn)
 
 
 def _ensure_table(conn):
@@ -72,6 +74,7 @@ def _ensure_table(conn):
 
 
 @report_blueprint.route("/report/content", methods=["POST", "OPTIONS"])
+@idempotent
 def report_content():
     """Report a post or comment"""
     if request.method == "OPTIONS":
@@ -222,7 +225,7 @@ def list_reports():
                 "reason": r.get("reason"),
                 "details": r.get("details"),
                 "status": r.get("status"),
-                "created_at": r.get("created_at").isoformat() if r.get("created_at") else None
+                "created_at": r.get("created_at")
             })
         
         return jsonify({"success": True, "data": reports, "count": len(reports)})
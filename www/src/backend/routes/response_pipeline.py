@@ -0,0 +1,193 @@
+"""
+Response pipeline: fast JSON encoding and negotiated compression for every route
+- FastJSONProvider replaces Flask's json provider: orjson when it is installed (JSON_ENCODER=std
+  forces the stdlib), UTF-8 output instead of \\u escapes, no key sorting, and datetimes / dates
+  written as ISO 8601 by the encoder itself, so routes return rows as they come from MySQL
+  instead of calling .isoformat() per field
+- dumps() is the same encoder without an app context, for code that runs off the request thread
+  (e.g. the square write-behind flusher logging events)
+- compress_response() (an after_request hook) brotli- or gzip-encodes bodies of at least
+  COMPRESS_MIN_BYTES for clients that accept it (br only if the brotli module is installed);
+  streamed / file responses, 304s and bodies that would not shrink are left alone
+- time spent encoding JSON and compressing, and the bytes before / after, are reported as
+  Server-Timing entries next to app;dur
+
+Set RESPONSE_COMPRESSION=0 when a proxy in front already compresses.
+"""
+import os
+import json
+import time
+import zlib
+import logging
+from datetime import date, datetime, time as dt_time
+
+from flask import g, request, has_request_context
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:  # optional: stdlib json is used instead
+    orjson = None
+
+try:
+    import brotli
+except ImportError:  # optional: gzip only
+    brotli = None
+
+logger = logging.getLogger("app.response_pipeline")
+
+_OFF = {"0", "false", "no", "off"}
+
+JSON_ENCODER = os.getenv("JSON_ENCODER", "auto").strip().lower()
+RESPONSE_COMPRESSION = os.getenv("RESPONSE_COMPRESSION", "1").strip().lower() not in _OFF
+COMPRESS_MIN_BYTES = int(os.getenv("COMPRESS_MIN_BYTES", "1024"))
+GZIP_LEVEL = int(os.getenv("GZIP_LEVEL", "5"))
+BROTLI_QUALITY = int(os.getenv("BROTLI_QUALITY", "4"))
+
+_COMPRESSIBLE = ("application/json", "text/", "application/javascript", "image/svg+xml")
+
+
+def _default(o):
+    if isinstance(o, (datetime, date, dt_time)):
+        return o.isoformat()
+    return DefaultJSONProvider.default(o)
+
+
+def dumps(obj) -> str:
+    """JSON text as FastJSONProvider writes it (defaults: unsorted keys, UTF-8, ISO datetimes); needs no app."""
+    if orjson is not None and JSON_ENCODER != "std":
+        try:
+            return orjson.dumps(obj, default=_default, option=orjson.OPT_NON_STR_KEYS).decode("utf-8")
+        except TypeError:
+            pass  # e.g. integers beyond 64 bits: let the stdlib handle it
+    return json.dumps(obj, default=_default, ensure_ascii=False)
+
+
+def _note_json_time(started):
+    if has_request_context():
+        g._json_ms = getattr(g, "_json_ms", 0.0) + (time.perf_counter() - started) * 1000
+
+
+class FastJSONProvider(DefaultJSONProvider):
+    sort_keys = False
+    ensure_ascii = False
+
+    def __init__(self, app):
+        super().__init__(app)
+        self.use_orjson = orjson is not None and JSON_ENCODER != "std"
+
+    def _orjson_bytes(self, obj, indent=False) -> bytes:
+        option = orjson.OPT_NON_STR_KEYS
+        if self.sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        if indent:
+            option |= orjson.OPT_INDENT_2
+        return orjson.dumps(obj, default=_default, option=option)
+
+    def dumps(self, obj, **kwargs) -> str:
+        started = time.perf_counter()
+        try:
+            if not kwargs and not self.sort_keys and self.ensure_ascii is False:
+                return dumps(obj)
+            if self.use_orjson and set(kwargs) <= {"separators", "indent"}:
+                try:
+                    return self._orjson_bytes(obj, kwargs.get("indent")).decode("utf-8")
+                except TypeError:
+                    pass  # e.g. integers beyond 64 bits: let the stdlib handle it
+            kwargs.setdefault("default", _default)
+            kwargs.setdefault("ensure_ascii", self.ensure_ascii)
+            kwargs.setdefault("sort_keys", self.sort_keys)
+            return json.dumps(obj, **kwargs)
+        finally:
+            _note_json_time(started)
+
+    def loads(self, s, **kwargs):
+        if self.use_orjson and not kwargs:
+            try:
+                return orjson.loads(s)
+            except ValueError:
+                pass  # NaN / huge integers etc.: the stdlib decides
+        return json.loads(s, **kwargs)
+
+    def response(self, *args, **kwargs):
+        if self.use_orjson:
+            obj = self._prepare_response_obj(args, kwargs)
+            indent = (self.compact is None and self._app.debug) or self.compact is False
+            started = time.perf_counter()
+            try:
+                body = self._orjson_bytes(obj, indent) + b"\n"
+            except TypeError:
+                body = None
+            finally:
+                _note_json_time(started)
+            if body is not None:
+                return self._app.response_class(body, mimetype=self.mimetype)
+        return super().response(*args, **kwargs)
+
+
+def _negotiate():
+    accept = request.accept_encodings
+    if brotli is not None and accept.quality("br") > 0:
+        return "br"
+    if accept.quality("gzip") > 0:
+        return "gzip"
+    return None
+
+
+def _encode(coding, data: bytes) -> bytes:
+    if coding == "br":
+        return brotli.compress(data, quality=BROTLI_QUALITY)
+    # wbits=31: gzip container; no file name / mtime so equal bodies compress identically
+    c = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)
+    return c.compress(data) + c.flush()
+
+
+def _add_timing(resp, entry):
+    existing = resp.headers.get("Server-Timing")
+    resp.headers["Server-Timing"] = f"{existing}, {entry}" if existing else entry
+
+
+def compress_response(resp):
+    json_ms = getattr(g, "_json_ms", None)
+    if json_ms is not None:
+        _add_timing(resp, f"json;dur={json_ms:.1f}")
+
+    if (not RESPONSE_COMPRESSION or request.method == "HEAD"
+            or resp.status_code < 200 or resp.status_code in (204, 206, 304)
+            or resp.direct_passthrough or resp.is_streamed
+            or "Content-Encoding" in resp.headers):
+        return resp
+    mimetype = resp.mimetype or ""
+    if not mimetype.startswith(_COMPRESSIBLE):
+        return resp
+    resp.vary.add("Accept-Encoding")
+
+    data = resp.get_data()
+    if len(data) < COMPRESS_MIN_BYTES:
+        return resp
+    coding = _negotiate()
+    if coding is None:
+        return resp
+
+    started = time.perf_counter()
+    body = _encode(coding, data)
+    took_ms = (time.perf_counter() - started) * 1000
+    if len(body) >= len(data):
+        return resp
+    resp.set_data(body)
+    resp.headers["Content-Encoding"] = coding
+    etag = resp.headers.get("ETag")
+    if etag and not etag.startswith("W/"):
+        # Same resource, different bytes: a strong validator no longer applies
+        resp.headers["ETag"] = "W/" + etag
+    _add_timing(resp, f'{coding};dur={took_ms:.1f};desc="{len(data)}>{len(body)}"')
+    return resp
+
+
+def install_response_pipeline(app):
+    """Swap in FastJSONProvider and register compress_response (register it after hooks that time the request)."""
+    app.json = FastJSONProvider(app)
+    app.after_request(compress_response)
+    logger.info("response pipeline: json=%s compression=%s brotli=%s min_bytes=%d",
+                "orjson" if app.json.use_orjson else "stdlib", RESPONSE_COMPRESSION,
+                brotli is not None, COMPRESS_MIN_BYTES)
@@ -0,0 +1,120 @@
+"""
+Stateless signed session tokens
+- issue_token() is called by /login and /sms/verify; the token carries user_id, username and expiry
+  and is signed with HMAC-SHA256 under SESSION_SECRET (falls back to SERVER_SECRET), so every
+  worker can verify it without a database lookup
+- load_identity() runs as an app.before_request hook: it reads "Authorization: Bearer <token>"
+  (or X-Session-Token) and puts the verified identity on g.identity
+- resolve_identity() is what routes call: the token identity when present, otherwise the legacy
+  user_id / username fields from the body (older clients), raising AuthError on a bad or
+  mismatching token
+
+Tokens cannot be revoked before they expire (SESSION_TTL_SECONDS); keep the TTL modest.
+"""
+import os
+import hmac
+import json
+import time
+import base64
+import hashlib
+import logging
+
+from dotenv import load_dotenv
+from flask import g, request
+
+load_dotenv()
+
+logger = logging.getLogger("app.session_token")
+
+SESSION_SECRET = os.getenv("SESSION_SECRET") or os.getenv("SERVER_SECRET", "replace-with-strong-random")
+SESSION_TTL_SECONDS = int(os.getenv("SESSION_TTL_SECONDS", str(7 * 24 * 3600)))
+
+TOKEN_VERSION = "v1"
+_KEY = SESSION_SECRET.encode("utf-8")
+
+
+class AuthError(Exception):
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+
+def _b64(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).decode("ascii").rstrip("=")
+
+
+def _unb64(text: str) -> bytes:
+    return base64.urlsafe_b64decode(text + "=" * (-len(text) % 4))
+
+
+def _sign(body: str) -> str:
+    return _b64(hmac.new(_KEY, f"{TOKEN_VERSION}.{body}".encode("ascii"), hashlib.sha256).digest())
+
+
+def issue_token(user_id: str, username: str = None, ttl: int = None) -> dict:
+    """Return {"token", "expires_at"} for the given user."""
+    exp = int(time.time()) + (SESSION_TTL_SECONDS if ttl is None else ttl)
+    payload = {"uid": str(user_id), "exp": exp}
+    if username:
+        payload["un"] = str(username)
+    body = _b64(json.dumps(payload, separators=(",", ":"), ensure_ascii=False).encode("utf-8"))
+    return {"token": f"{TOKEN_VERSION}.{body}.{_sign(body)}", "expires_at": exp}
+
+
+def verify_token(token: str):
+    """Return {"user_id", "username", "expires_at"} for a valid token, "expired" if it has expired, else None."""
+    try:
+        version, body, sig = token.split(".")
+    except (AttributeError, ValueError):
+        return None
+    if version != TOKEN_VERSION or not hmac.compare_digest(sig, _sign(body)):
+        return None
+    try:
+        payload = json.loads(_unb64(body))
+        exp = int(payload["exp"])
+        user_id = str(payload["uid"])
+    except (ValueError, KeyError, TypeError):
+        return None
+    if exp < time.time():
+        return "expired"
+    return {"user_id": user_id, "username": payload.get("un"), "expires_at": exp}
+
+
+def load_identity():
+    """before_request hook: verify the request's session token (if any) into g.identity."""
+    g.identity = None
+    g.token_error = None
+    auth = request.headers.get("Authorization") or ""
+    token = auth[7:].strip() if auth[:7].lower() == "bearer " else (request.headers.get("X-Session-Token") or "").strip()
+    if not token:
+        return None
+    result = verify_token(token)
+    if isinstance(result, dict):
+        g.identity = result
+    else:
+        g.token_error = result or "invalid"
+        logger.warning("session token rejected reason=%s path=%s", g.token_error, request.path)
+    return None
+
+
+def resolve_identity(data=None):
+    """
+    (user_id, username) for this request. With a valid token the body may omit identity fields,
+    but must not name a different user. Without a token the body fields are used as before.
+    """
+    token_error = getattr(g, "token_error", None)
+    if token_error:
+        raise AuthError(401, "登录已过期，请重新登录" if token_error == "expired" else "登录凭证无效，请重新登录")
+    body_user_id = body_username = None
+    if isinstance(data, dict):
+        body_user_id = data.get("user_id") or None
+        body_username = data.get("username") or None
+    identity = getattr(g, "identity", None)
+    if identity is None:
+        return body_user_id, body_username
+    if body_user_id and str(body_user_id) != identity["user_id"]:
+        raise AuthError(403, "身份不匹配")
+    if body_username and identity.get("username") and body_username != identity["username"]:
+        raise AuthError(403, "身份不匹配")
+    return identity["user_id"], identity.get("username") or body_username
@@ -4,8 +4,14 @@
  File: sms.py
  Description: SMS routes (send / verify) for CN mainland phone numbers.
 - Stores OTP hashes locally (no plaintext) with TTL.
-- Delegates rate limiting to Aliyun (no local cooldown or daily limit).
+- Enforces OTP_SEND_COOLDOWN_SECONDS / OTP_DAILY_LIMIT_PER_PHONE: per-phone and per-IP token
+  buckets in each worker reject bursts before MySQL or the provider is touched; the
+  last_sent_at / day_key / daily_count columns are the cross-worker authority, checked and
+  bumped in the same UPDATE that stores the new OTP hash.
 - Verification enforces TTL and max fail attempts locally.
+- Delivery runs on a per-worker background queue (routes/sms_queue.py) with retries;
+  /sms/send returns a job id once the OTP hash is stored and /sms/status reports delivery.
+- SMS_PROVIDER=fake swaps Aliyun for an in-process stand-in (no network, codes kept in memory).
 """
 import os
 import re
@@ -14,6 +20,8 @@ import uuid
 import time
 import hashlib
 import random
+import threading
+from collections import OrderedDict
 from datetime import datetime, timedelta
 import logging
 
@@ -21,6 +29,10 @@ from dotenv import load_dotenv
 from flask import Blueprint, request, jsonify
 import mysql.connector
 from mysql.connector import errors as mysql_errors
+from routes.dbstats import trace_connection
+from routes.sms_queue import SendQueue, SendError, QueueFull
+from routes.session_token import issue_token
+from routes.ratelimit import TokenBucketLimiter, DayBlocklist, client_ip, seconds_until_utc_midnight
 
 try:
     from alibabacloud_dysmsapi20170525.client import Client as DysmsapiClient
@@ -55,6 +67,12 @@ ALIYUN_ACCESS_KEY_SECRET = os.getenv("ALIYUN_ACCESS_KEY_SECRET")
 ALIYUN_REGION_ID = os.getenv("ALIYUN_REGION_ID", "cn-hangzhou")
 ALIYUN_SIGN_NAME = os.getenv("ALIYUN_SIGN_NAME")
 ALIYUN_TEMPLATE_CODE = os.getenv("ALIYUN_TEMPLATE_CODE") 
+# Overridable so load tests can point the SDK at a local stand-in (see bench/fakes.py)
+ALIYUN_SMS_ENDPOINT = os.getenv("ALIYUN_SMS_ENDPOINT", "dysmsapi.aliyuncs.com")
+ALIYUN_SMS_PROTOCOL = os.getenv("ALIYUN_SMS_PROTOCOL", "https")
+# "aliyun" (default) or "fake" for local development and tests
+SMS_PROVIDER = os.getenv("SMS_PROVIDER", "aliyun").strip().lower()
+SMS_FAKE_LATENCY_MS = float(os.getenv("SMS_FAKE_LATENCY_MS", "0"))
 
 SERVER_SECRET = os.getenv("SERVER_SECRET", "replace-with-strong-random")
 
@@ -63,6 +81,9 @@ OTP_LENGTH = int(os.getenv("OTP_LENGTH", "6"))
 OTP_SEND_COOLDOWN_SECONDS = int(os.getenv("OTP_SEND_COOLDOWN_SECONDS", "60"))
 OTP_DAILY_LIMIT_PER_PHONE = int(os.getenv("OTP_DAILY_LIMIT_PER_PHONE", "10"))
 OTP_VERIFY_MAX_FAILS = int(os.getenv("OTP_VERIFY_MAX_FAILS", "5"))
+# Per client IP: burst size and sustained sends per minute (all phones combined)
+OTP_IP_BURST = int(os.getenv("OTP_IP_BURST", "5"))
+OTP_IP_PER_MINUTE = float(os.getenv("OTP_IP_PER_MINUTE", "10"))
 
 # Generic E.164-ish quick check (loose). Real validation is in normalize_cn_phone().
 PHONE_REGEX = re.compile(r"^\+?\d{6,15}$")
@@ -99,12 +120,30 @@ def _get_conn(autocommit=False):
         cur.execute("SET SESSION MAX_EXECUTION_TIME=15000")  # 15s for any single statement
     finally:
         cur.close()
-    return conn
+    return trace_connection(conn)
 
 
-def ensure_tables():
-    """Ensure the sms_codes table exists. Does not mutate users schema."""
-    conn = _get_conn(autocommit=False)
+_tables_ready = False
+
+# Delivery-status columns added after the table first shipped; duplicates are ignored
+_SMS_CODES_MIGRATIONS = (
+    "ALTER TABLE sms_codes ADD COLUMN send_job_id VARCHAR(32) NULL",
+    "ALTER TABLE sms_codes ADD COLUMN send_status VARCHAR(16) NULL",
+    "ALTER TABLE sms_codes ADD COLUMN send_error VARCHAR(255) NULL",
+    "ALTER TABLE sms_codes ADD COLUMN send_updated_at DATETIME NULL",
+    "ALTER TABLE sms_codes ADD INDEX idx_send_job_id (send_job_id)",
+)
+
+
+def ensure_tables(conn=None):
+    """Ensure the sms_codes table (and its delivery-status columns) exists. Does not mutate users schema.
+    Runs once per process; pass `conn` to reuse the caller's connection instead of opening one."""
+    global _tables_ready
+    if _tables_ready:
+        return
+    own_conn = conn is None
+    if own_conn:
+        conn = _get_conn(autocommit=False)
     cur = conn.cursor()
     try:
         cur.execute(
@@ -116,20 +155,34 @@ def ensure_tables():
                 last_sent_at DATETIME,
                 day_key DATE,
                 daily_count INT DEFAULT 0,
-                fail_count INT DEFAULT 0
+                fail_count INT DEFAULT 0,
+                send_job_id VARCHAR(32) NULL,
+                send_status VARCHAR(16) NULL,
+                send_error VARCHAR(255) NULL,
+                send_updated_at DATETIME NULL,
+                INDEX idx_send_job_id (send_job_id)
             ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
             """
         )
+        for stmt in _SMS_CODES_MIGRATIONS:
+            try:
+                cur.execute(stmt)
+            except mysql_errors.Error as e:
+                # 1060 duplicate column / 1061 duplicate key name: already migrated
+                if getattr(e, 'errno', None) not in (1060, 1061):
+                    raise
         conn.commit()
+        _tables_ready = True
     finally:
         try:
             cur.close()
         except Exception:
             pass
-        try:
-            conn.close()
-        except Exception:
-            pass
+        if own_conn:
+            try:
+                conn.close()
+            except Exception:
+                pass
 
 
 # Hash verification code (not stored in plain text)
@@ -149,8 +202,16 @@ def gen_code(length: int = 6) -> str:
 
 # ---------- alibaba cloud SMS ----------
 
-def get_aliyun_client():
-    """Create and return a DysmsapiClient. Raises if SDK/keys missing."""
+# One client per worker process; the SDK client holds no per-request state
+_client_lock = threading.Lock()
+_client_cache = None  # (pid, client)
+
+# Aliyun "isv.*" codes are caller-side problems (bad number, template, limit control): no retry
+_PERMANENT_CODE_PREFIX = "isv."
+
+
+def _build_aliyun_client():
+    """Create a DysmsapiClient. Raises if SDK/keys missing."""
     if not _ALIYUN_SMS_AVAILABLE:
         raise RuntimeError("阿里云短信 SDK 未安装，请先 pip install alibabacloud_dysmsapi20170525 alibabacloud_tea_openapi alibabacloud_tea_util")
     if not (ALIYUN_ACCESS_KEY_ID and ALIYUN_ACCESS_KEY_SECRET and ALIYUN_SIGN_NAME and ALIYUN_TEMPLATE_CODE):
@@ -160,13 +221,26 @@ def get_aliyun_client():
         access_key_id=ALIYUN_ACCESS_KEY_ID,
         access_key_secret=ALIYUN_ACCESS_KEY_SECRET,
         region_id=ALIYUN_REGION_ID,
-        endpoint='dysmsapi.aliyuncs.com',
+        endpoint=ALIYUN_SMS_ENDPOINT,
+        protocol=ALIYUN_SMS_PROTOCOL,
     )
     return DysmsapiClient(config)
 
 
+def get_aliyun_client():
+    """Return this worker's cached DysmsapiClient, building it on first use (or after fork)."""
+    global _client_cache
+    cached = _client_cache
+    if cached is not None and cached[0] == os.getpid():
+        return cached[1]
+    with _client_lock:
+        if _client_cache is None or _client_cache[0] != os.getpid():
+            _client_cache = (os.getpid(), _build_aliyun_client())
+        return _client_cache[1]
+
+
 def send_sms_code_via_aliyun(phone: str, code: str):
-    """Call Aliyun SMS to send a single OTP. Raises RuntimeError on non-OK code."""
+    """Call Aliyun SMS to send a single OTP. Raises SendError on non-OK code."""
     client = get_aliyun_client()
     send_req = dysmsapi_20170525_models.SendSmsRequest(
         sign_name=ALIYUN_SIGN_NAME,
@@ -178,24 +252,126 @@ def send_sms_code_via_aliyun(phone: str, code: str):
     resp = client.send_sms_with_options(send_req, runtime)
     body = getattr(resp, 'body', None)
     if not body or getattr(body, 'code', None) != 'OK':
-        raise RuntimeError(getattr(body, 'message', 'SMS send failed'))
+        err_code = getattr(body, 'code', None) or ''
+        # Hint: isv.BUSINESS_LIMIT_CONTROL indicates Aliyun daily cap has been hit.
+        raise SendError(getattr(body, 'message', None) or 'SMS send failed', code=err_code,
+                        retryable=not err_code.startswith(_PERMANENT_CODE_PREFIX))
+    return True
+
+
+# ---------- fake provider (SMS_PROVIDER=fake) ----------
+
+_fake_lock = threading.Lock()
+_fake_outbox = OrderedDict()  # phone -> last code, bounded
+
+
+def send_sms_code_via_fake(phone: str, code: str):
+    """Stand-in provider: remembers the last code per phone instead of sending it."""
+    if SMS_FAKE_LATENCY_MS > 0:
+        time.sleep(SMS_FAKE_LATENCY_MS / 1000.0)
+    with _fake_lock:
+        _fake_outbox[phone] = code
+        _fake_outbox.move_to_end(phone)
+        while len(_fake_outbox) > 1000:
+            _fake_outbox.popitem(last=False)
+    logger.info("fake sms phone=%s code=%s", phone, code[:2] + "*" * (len(code) - 2))
     return True
 
 
+def fake_outbox(phone: str):
+    """Last code "sent" to phone by the fake provider in this process (for tests), or None."""
+    with _fake_lock:
+        return _fake_outbox.get(phone)
+
+
+def _deliver(phone: str, code: str):
+    if SMS_PROVIDER == "fake":
+        return send_sms_code_via_fake(phone, code)
+    return send_sms_code_via_aliyun(phone, code)
+
+
+def _persist_send_status(job: dict):
+    """Mirror queue status into sms_codes so /sms/status works from any worker."""
+    conn = _get_conn(autocommit=True)
+    cur = conn.cursor()
+    try:
+        cur.execute(
+            """
+            UPDATE sms_codes SET send_status=%s, send_error=%s, send_updated_at=%s
+            WHERE phone=%s AND send_job_id=%s
+            """,
+            (job["status"], (job.get("error") or "")[:255] or None, datetime.utcnow(),
+             job["phone"], job["job_id"])
+        )
+    finally:
+        try:
+            cur.close()
+        except Exception:
+            pass
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+
+_send_queue = SendQueue(_deliver, on_status=_persist_send_status)
+
+
+# ---------- rate limiting ----------
+
+# One send per cooldown window per phone, and a bounded send rate per client IP (per worker)
+_phone_limiter = TokenBucketLimiter(1, 1.0 / max(1, OTP_SEND_COOLDOWN_SECONDS))
+_ip_limiter = TokenBucketLimiter(OTP_IP_BURST, OTP_IP_PER_MINUTE / 60.0)
+# Phones the database has already reported at their daily cap today
+_daily_capped = DayBlocklist()
+
+
+def _too_many(message: str, retry_after: float):
+    retry_after = max(1, int(retry_after + 0.999))
+    resp = jsonify({"success": False, "message": message, "retry_after": retry_after})
+    resp.headers["Retry-After"] = str(retry_after)
+    return resp, 429
+
+
+def _local_limit(phone: str, ip: str):
+    """Return a 429 response if this worker already knows the send must be refused, else None."""
+    if _daily_capped.is_blocked(phone):
+        logger.warning("/sms/send daily cap (cached) phone=%s", phone)
+        return _too_many("今日验证码发送次数已达上限，请明天再试", seconds_until_utc_midnight())
+    ok, wait = _ip_limiter.allow(ip)
+    if not ok:
+        logger.warning("/sms/send ip rate limited ip=%s retry_after=%.1f", ip, wait)
+        return _too_many("请求过于频繁，请稍后再试", wait)
+    ok, wait = _phone_limiter.allow(phone)
+    if not ok:
+        _ip_limiter.refund(ip)
+        logger.warning("/sms/send phone cooldown phone=%s retry_after=%.1f", phone, wait)
+        return _too_many(f"发送过于频繁，请 {max(1, int(wait + 0.999))} 秒后再试", wait)
+    return None
+
+
+def _refund_local(phone: str, ip: str):
+    """Give back the tokens _local_limit took when no SMS is going out after all."""
+    _ip_limiter.refund(ip)
+    _phone_limiter.refund(phone)
+
+
 # ---------- route ----------
 
 @sms_blueprint.route('/sms/send', methods=['POST', 'OPTIONS'])
 def sms_send():
     """POST /sms/send
     Body: {"phone": "+86..." or plain 11-digit}
-    Behavior: normalize phone, upsert OTP hash/expiry, then call Aliyun to send.
-    No local cooldown or daily limit; Aliyun enforces provider-side throttling.
+    Behavior: normalize phone, upsert OTP hash/expiry, then queue the SMS for background
+    delivery and return {"job_id"} right away (poll /sms/status?job_id=...).
+    Rate limits: OTP_SEND_COOLDOWN_SECONDS per phone, OTP_DAILY_LIMIT_PER_PHONE per UTC day and
+    OTP_IP_BURST / OTP_IP_PER_MINUTE per client IP; refusals are 429 with Retry-After.
     """
     if request.method == 'OPTIONS':
         return '', 200
 
+    local_taken = None  # (phone, ip) while this request holds local limiter tokens
     try:
-        ensure_tables()
         data = request.get_json(silent=True) or {}
         raw_phone = data.get('phone', '').strip()
         if not raw_phone:
@@ -207,41 +383,79 @@ def sms_send():
             logger.warning("/sms/send invalid phone raw=%r", raw_phone)
             return jsonify({"success": False, "message": "手机号格式不正确（仅支持中国大陆 11 位或带 +86）"}), 400
 
+        ip = client_ip(request)
+        limited = _local_limit(phone, ip)
+        if limited is not None:
+            return limited
+        local_taken = (phone, ip)
+
         logger.info("/sms/send request phone=%s", phone)
 
         now = datetime.utcnow()  # store UTC timestamps in DB
+        today = now.date()
+
+        # Generate a new OTP and store only its HMAC hash (+ expiry)
+        code = gen_code(OTP_LENGTH)
+        expires_at = now + timedelta(seconds=OTP_TTL_SECONDS)
+        logger.debug("/sms/send generated OTP(masked) for %s expires_at=%s", phone, expires_at.isoformat())
+        code_hash = hash_code(phone, code)
+        job_id = uuid.uuid4().hex
 
         conn = _get_conn(autocommit=False)
         cur = conn.cursor(dictionary=True)
         try:
-            # Read existing OTP row for this phone (if any)
-            cur.execute("SELECT * FROM sms_codes WHERE phone=%s", (phone,))
-            row = cur.fetchone()
-
-            # Generate a new OTP and store only its HMAC hash (+ expiry)
-            code = gen_code(OTP_LENGTH)
-            masked_code = code[:2] + "*"*(len(code)-2)
-            expires_at = now + timedelta(seconds=OTP_TTL_SECONDS)
-            logger.debug("/sms/send generated OTP(masked) for %s expires_at=%s", phone, expires_at.isoformat())
-
-            code_hash = hash_code(phone, code)
-
-            if row:
+            ensure_tables(conn)
+            # Cooldown and daily cap are checked and bumped in the same statement that stores the
+            # new OTP, so concurrent sends from any worker cannot both pass
+            cur.execute(
+                """
+                UPDATE sms_codes SET
+                    daily_count = IF(day_key = %s, daily_count + 1, 1),
+                    day_key = %s,
+                    code_hash=%s, expires_at=%s, last_sent_at=%s,
+                    send_job_id=%s, send_status='queued', send_error=NULL, send_updated_at=%s
+                WHERE phone=%s
+                  AND (last_sent_at IS NULL OR last_sent_at <= %s)
+                  AND (day_key IS NULL OR day_key <> %s OR daily_count < %s)
+                """,
+                (today, today, code_hash, expires_at, now, job_id, now, phone,
+                 now - timedelta(seconds=OTP_SEND_COOLDOWN_SECONDS), today, OTP_DAILY_LIMIT_PER_PHONE)
+            )
+            claimed = cur.rowcount == 1
+            if not claimed:
+                try:
+                    cur.execute(
+                        """
+                        INSERT INTO sms_codes (phone, code_hash, expires_at, last_sent_at, day_key, daily_count, fail_count,
+                            send_job_id, send_status, send_updated_at)
+                        VALUES (%s, %s, %s, %s, %s, 1, 0, %s, 'queued', %s)
+                        """,
+                        (phone, code_hash, expires_at, now, today, job_id, now)
+                    )
+                    claimed = True
+                except mysql_errors.IntegrityError as e:
+                    if getattr(e, 'errno', None) != 1062:
+                        raise
+            if not claimed:
+                # Row exists but the conditional UPDATE refused it: find out which limit applies
                 cur.execute(
-                    """
-                    UPDATE sms_codes SET code_hash=%s, expires_at=%s, last_sent_at=%s
-                    WHERE phone=%s
-                    """,
-                    (code_hash, expires_at, now, phone)
+                    "SELECT last_sent_at, day_key, daily_count FROM sms_codes WHERE phone=%s",
+                    (phone,)
                 )
+                row = cur.fetchone() or {}
             else:
-                cur.execute(
-                    """
-                    INSERT INTO sms_codes (phone, code_hash, expires_at, last_sent_at, day_key, daily_count, fail_count)
-                    VALUES (%s, %s, %s, %s, NULL, 0, 0)
-                    """,
-                    (phone, code_hash, expires_at, now)
-                )
+                # Hand off to the background sender before committing: if the queue is full the
+                # claim is rolled back, so the previous code, the cooldown and the daily count stay
+                # as they were. (Provider-side throttling such as daily caps is expected.)
+                try:
+                    _send_queue.enqueue(phone, code, job_id=job_id)
+                except QueueFull:
+                    conn.rollback()
+                    _refund_local(*local_taken)
+                    local_taken = None
+                    logger.error("/sms/send queue full phone=%s", phone)
+                    return jsonify({"success": False, "message": "短信服务繁忙，请稍后重试"}), 503
+                logger.info("/sms/send queued phone=%s job_id=%s", phone, job_id)
             conn.commit()
         finally:
             try:
@@ -253,40 +467,107 @@ def sms_send():
             except Exception:
                 pass
 
-        # Send via Aliyun (provider-side throttling such as daily caps is expected)
-        try:
-            send_sms_code_via_aliyun(phone, code)
-            logger.info("/sms/send success phone=%s", phone)
-        except Exception as e:
-            logger.exception("/sms/send failed phone=%s error=%s", phone, e)
-            # Hint: BUSINESS_LIMIT_CONTROL indicates Aliyun daily cap has been hit.
-            return jsonify({"success": False, "message": f"短信发送失败: {str(e)}"}), 500
+        if not claimed:
+            if row.get('day_key') == today and (row.get('daily_count') or 0) >= OTP_DAILY_LIMIT_PER_PHONE:
+                _daily_capped.block(phone, today)
+                logger.warning("/sms/send daily cap phone=%s count=%s", phone, row.get('daily_count'))
+                return _too_many("今日验证码发送次数已达上限，请明天再试", seconds_until_utc_midnight())
+            last_sent_at = row.get('last_sent_at') or now
+            wait = OTP_SEND_COOLDOWN_SECONDS - (now - last_sent_at).total_seconds()
+            logger.warning("/sms/send cooldown (db) phone=%s retry_after=%.1f", phone, wait)
+            return _too_many(f"发送过于频繁，请 {max(1, int(wait + 0.999))} 秒后再试", wait)
 
-        return jsonify({"success": True, "message": "验证码已发送"})
+        return jsonify({"success": True, "message": "验证码已发送", "job_id": job_id, "status": "queued"})
 
     except mysql_errors.Error as e:
+        if local_taken:
+            _refund_local(*local_taken)
         if getattr(e, 'errno', None) in (3024, 1205, 1213):
             logger.warning("/sms/send db timeout/deadlock errno=%s msg=%s", getattr(e, 'errno', None), str(e))
             return jsonify({"success": False, "message": "数据库超时或死锁，请稍后重试"}), 504
         logger.exception("/sms/send db error: %s", e)
         return jsonify({"success": False, "message": "数据库错误", "error": str(e)}), 500
     except Exception as e:
+        if local_taken:
+            _refund_local(*local_taken)
         logger.exception("/sms/send server error: %s", e)
         return jsonify({"success": False, "message": "服务器错误", "error": str(e)}), 500
 
 
+@sms_blueprint.route('/sms/status', methods=['GET', 'OPTIONS'])
+def sms_status():
+    """GET /sms/status?job_id=...
+    Returns the delivery status (queued / sending / sent / failed) of a /sms/send job. Answered
+    from this worker's queue when it owns the job, otherwise from sms_codes.
+    """
+    if request.method == 'OPTIONS':
+        return '', 200
+
+    job_id = (request.args.get('job_id') or '').strip()
+    if not re.fullmatch(r"[0-9a-f]{32}", job_id):
+        return jsonify({"success": False, "message": "job_id 无效"}), 400
+
+    job = _send_queue.status(job_id)
+    if job:
+        return jsonify({
+            "success": True,
+            "job_id": job_id,
+            "status": job["status"],
+            "attempts": job["attempts"],
+            "error": job["error"],
+        })
+
+    try:
+        ensure_tables()
+        conn = _get_conn(autocommit=True)
+        cur = conn.cursor(dictionary=True)
+        try:
+            cur.execute(
+                "SELECT send_status, send_error, send_updated_at FROM sms_codes WHERE send_job_id=%s LIMIT 1",
+                (job_id,)
+            )
+            row = cur.fetchone()
+        finally:
+            try:
+                cur.close()
+            except Exception:
+                pass
+            try:
+                conn.close()
+            except Exception:
+                pass
+        if not row:
+            return jsonify({"success": False, "message": "发送任务不存在"}), 404
+        return jsonify({
+            "success": True,
+            "job_id": job_id,
+            "status": row["send_status"],
+            "error": row["send_error"],
+        })
+    except mysql_errors.Error as e:
+        if getattr(e, 'errno', None) in (3024, 1205, 1213):
+            logger.warning("/sms/status db timeout/deadlock errno=%s msg=%s", getattr(e, 'errno', None), str(e))
+            return jsonify({"success": False, "message": "数据库超时或死锁，请稍后重试"}), 504
+        logger.exception("/sms/status db error: %s", e)
+        return jsonify({"success": False, "message": "数据库错误", "error": str(e)}), 500
+    except Exception as e:
+        logger.exception("/sms/status server error: %s", e)
+        return jsonify({"success": False, "message": "服务器错误", "error": str(e)}), 500
+
+
 @sms_blueprint.route('/sms/verify', methods=['POST', 'OPTIONS'])
 def sms_verify():
     """POST /sms/verify
     Body: {"phone": "+86...", "code": "######"}
-    Behavior: normalize phone, check OTP hash + TTL + fail_count; on success, clear OTP and
-    return user id if the phone is registered in users table.
+    Behavior: normalize phone, then one compare-and-clear UPDATE keyed on (phone, code_hash,
+    unexpired, fail_count below max); on success look up the user id in the same transaction.
+    A wrong code bumps fail_count in a single UPDATE; only the rare "why did it fail" case
+    (missing / expired / locked) reads the row.
     """
     if request.method == 'OPTIONS':
         return '', 200
 
     try:
-        ensure_tables()
         data = request.get_json(silent=True) or {}
         raw_phone = data.get('phone', '').strip()
         code = data.get('code', '').strip()
@@ -299,58 +580,59 @@ def sms_verify():
             logger.warning("/sms/verify invalid code format phone=%s", phone)
             return jsonify({"success": False, "message": f"验证码应为 {OTP_LENGTH} 位数字"}), 400
 
+        incoming_hash = hash_code(phone, code)
+        now = datetime.utcnow()
+        user = None
+
         conn = _get_conn(autocommit=False)
         cur = conn.cursor(dictionary=True)
         try:
-            # Fetch current OTP row
-            cur.execute("SELECT * FROM sms_codes WHERE phone=%s", (phone,))
-            row = cur.fetchone()
-            if not row or not row.get('code_hash'):
-                return jsonify({"success": False, "message": "验证码不存在或已过期"}), 400
-
-            # TTL check
-            expires_at = row['expires_at']
-            if isinstance(expires_at, str):
-                expires_at = datetime.fromisoformat(expires_at)
-            if datetime.utcnow() > expires_at:
-                logger.info("/sms/verify expired phone=%s", phone)
-                return jsonify({"success": False, "message": "验证码已过期"}), 400
-
-            # Max wrong attempts (local protection)
-            fail_count = row.get('fail_count', 0) or 0
-            if fail_count >= OTP_VERIFY_MAX_FAILS:
-                logger.warning("/sms/verify too many attempts phone=%s fail_count=%d", phone, fail_count)
-                return jsonify({"success": False, "message": "尝试次数过多，请稍后再试"}), 429
+            ensure_tables(conn)
 
-            # Hash compare (no plaintext OTP stored)
-            incoming_hash = hash_code(phone, code)
-            if incoming_hash != row['code_hash']:
-                cur.execute("UPDATE sms_codes SET fail_count = fail_count + 1 WHERE phone=%s", (phone,))
-                conn.commit()
-                left = max(0, OTP_VERIFY_MAX_FAILS - fail_count - 1)
-                logger.warning("/sms/verify wrong code phone=%s attempts_left=%d", phone, left)
-                return jsonify({"success": False, "message": f"验证码不正确，还可尝试 {left} 次"}), 400
-
-            # Success: clear OTP state
+            # Compare-and-clear: only a matching, unexpired, not-locked code is consumed
             cur.execute(
-                "UPDATE sms_codes SET code_hash=NULL, expires_at=NULL, fail_count=0 WHERE phone=%s",
-                (phone,)
+                """
+                UPDATE sms_codes SET code_hash=NULL, expires_at=NULL, fail_count=0
+                WHERE phone=%s AND code_hash=%s AND expires_at > %s AND fail_count < %s
+                """,
+                (phone, incoming_hash, now, OTP_VERIFY_MAX_FAILS)
             )
-
-            # Map phone to user (supports legacy username==+86...)
-            try:
-                logger.info("/sms/verify lookup phone=%s", phone)
-            except Exception:
-                pass
-            cur.execute("SELECT user_id FROM users WHERE phone_number=%s OR username=%s LIMIT 1", (phone, phone))
-            user = cur.fetchone()
-            try:
-                logger.info("/sms/verify user lookup result: %s", user)
-            except Exception:
-                pass
-
-            conn.commit()
-
+            if cur.rowcount == 1:
+                # Map phone to user (supports legacy username==+86...)
+                cur.execute("SELECT user_id, username FROM users WHERE phone_number=%s OR username=%s LIMIT 1", (phone, phone))
+                user = cur.fetchone()
+                conn.commit()
+                logger.info("/sms/verify user lookup phone=%s result=%s", phone, user)
+            else:
+                # Wrong code on a live OTP: count the failure; LAST_INSERT_ID(expr) hands the new
+                # count back in the OK packet so no extra SELECT is needed
+                cur.execute(
+                    """
+                    UPDATE sms_codes SET fail_count = LAST_INSERT_ID(fail_count + 1)
+                    WHERE phone=%s AND code_hash IS NOT NULL AND expires_at > %s AND fail_count < %s
+                    """,
+                    (phone, now, OTP_VERIFY_MAX_FAILS)
+                )
+                if cur.rowcount == 1:
+                    fail_count = cur.lastrowid or OTP_VERIFY_MAX_FAILS
+                    conn.commit()
+                    left = max(0, OTP_VERIFY_MAX_FAILS - fail_count)
+                    logger.warning("/sms/verify wrong code phone=%s attempts_left=%d", phone, left)
+                    return jsonify({"success": False, "message": f"验证码不正确，还可尝试 {left} 次"}), 400
+
+                cur.execute("SELECT code_hash, expires_at, fail_count FROM sms_codes WHERE phone=%s", (phone,))
+                row = cur.fetchone()
+                conn.commit()
+                if not row or not row.get('code_hash'):
+                    return jsonify({"success": False, "message": "验证码不存在或已过期"}), 400
+                expires_at = row['expires_at']
+                if isinstance(expires_at, str):
+                    expires_at = datetime.fromisoformat(expires_at)
+                if not expires_at or now >= expires_at:
+                    logger.info("/sms/verify expired phone=%s", phone)
+                    return jsonify({"success": False, "message": "验证码已过期"}), 400
+                logger.warning("/sms/verify too many attempts phone=%s fail_count=%s", phone, row.get('fail_count'))
+                return jsonify({"success": False, "message": "尝试次数过多，请稍后再试"}), 429
         finally:
             try:
                 cur.close()
@@ -363,11 +645,14 @@ def sms_verify():
 
         if user and user.get('user_id'):
             logger.info("/sms/verify success with user user_id=%s phone=%s", user["user_id"], phone)
+            session = issue_token(user["user_id"], user.get("username"))
             return jsonify({
                 "success": True,
                 "message": "验证码校验通过",
                 "user_id": user["user_id"],
-                "userId": user["user_id"]
+                "userId": user["user_id"],
+                "token": session["token"],
+                "expires_at": session["expires_at"],
             })
         else:
             logger.info("/sms/verify success without user phone=%s", phone)
@@ -376,6 +661,12 @@ def sms_verify():
                 "message": "验证码校验通过"
             })
 
+    except mysql_errors.Error as e:
+        if getattr(e, 'errno', None) in (3024, 1205, 1213):
+            logger.warning("/sms/verify db timeout/deadlock errno=%s msg=%s", getattr(e, 'errno', None), str(e))
+            return jsonify({"success": False, "message": "数据库超时或死锁，请稍后重试"}), 504
+        logger.exception("/sms/verify db error: %s", e)
+        return jsonify({"success": False, "message": "数据库错误", "error": str(e)}), 500
     except Exception as e:
         logger.exception("/sms/verify server error: %s", e)
-        return jsonify({"success": False, "message": "服务器错误", "error": str(e)}), 500
\ No newline at end of file
+        return jsonify({"success": False, "message": "服务器错误", "error": str(e)}), 500
@@ -0,0 +1,139 @@
+"""
+Background send queue for OTP SMS (one queue per worker process)
+- enqueue() returns a job id immediately; SMS_SEND_WORKERS daemon threads deliver jobs with
+  up to SMS_SEND_RETRIES retries and exponential backoff (SMS_RETRY_BACKOFF seconds, doubled
+  per attempt) for retryable failures
+- job status (queued / sending / sent / failed) is kept in a bounded in-memory table so
+  /sms/status can answer without a round trip; an on_status callback lets the caller persist
+  it for other workers
+- the queue is bounded (SMS_QUEUE_SIZE): enqueue() raises QueueFull instead of blocking the
+  request thread
+- threads are started lazily and restarted after fork, so gunicorn workers each get their own
+"""
+import os
+import time
+import uuid
+import queue
+import logging
+import threading
+from collections import OrderedDict
+
+logger = logging.getLogger("app.sms_queue")
+
+SMS_QUEUE_SIZE = int(os.getenv("SMS_QUEUE_SIZE", "1000"))
+SMS_SEND_WORKERS = max(1, int(os.getenv("SMS_SEND_WORKERS", "2")))
+SMS_SEND_RETRIES = max(0, int(os.getenv("SMS_SEND_RETRIES", "2")))
+SMS_RETRY_BACKOFF = float(os.getenv("SMS_RETRY_BACKOFF", "0.5"))
+SMS_STATUS_KEEP = int(os.getenv("SMS_STATUS_KEEP", "5000"))
+
+QueueFull = queue.Full
+
+
+class SendError(RuntimeError):
+    """Provider rejected the message. retryable=False stops the retry loop (e.g. bad number)."""
+
+    def __init__(self, message: str, code: str = None, retryable: bool = True):
+        super().__init__(message)
+        self.code = code
+        self.retryable = retryable
+
+
+class SendQueue:
+    def __init__(self, send, on_status=None):
+        # send(phone, code) raises on failure; on_status(job) is called after every state change
+        self._send = send
+        self._on_status = on_status
+        self._lock = threading.Lock()
+        self._jobs = OrderedDict()
+        self._queue = None
+        self._pid = None
+        self.sent = 0
+        self.failed = 0
+        self.retried = 0
+
+    def _ensure_started(self):
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            # First use in this process (or first use after fork): fresh queue and threads
+            self._queue = queue.Queue(SMS_QUEUE_SIZE)
+            self._jobs.clear()
+            self.sent = self.failed = self.retried = 0
+            for i in range(SMS_SEND_WORKERS):
+                threading.Thread(target=self._run, args=(self._queue,), name=f"sms-send-{i}", daemon=True).start()
+            self._pid = os.getpid()
+
+    def enqueue(self, phone: str, code: str, job_id: str = None) -> str:
+        """Queue one OTP for delivery and return its job id. Raises QueueFull when saturated."""
+        self._ensure_started()
+        job = {
+            "job_id": job_id or uuid.uuid4().hex,
+            "phone": phone,
+            "status": "queued",
+            "attempts": 0,
+            "error": None,
+            "updated_at": time.time(),
+        }
+        self._queue.put_nowait((job, code))
+        with self._lock:
+            self._jobs[job["job_id"]] = job
+            while len(self._jobs) > SMS_STATUS_KEEP:
+                self._jobs.popitem(last=False)
+        return job["job_id"]
+
+    def status(self, job_id: str):
+        """Return a copy of the job's status dict, or None if this worker does not know it."""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return dict(job) if job else None
+
+    def stats(self) -> dict:
+        return {
+            "pid": os.getpid(),
+            "queued": self._queue.qsize() if self._queue is not None else 0,
+            "capacity": SMS_QUEUE_SIZE,
+            "workers": SMS_SEND_WORKERS,
+            "sent": self.sent,
+            "failed": self.failed,
+            "retried": self.retried,
+        }
+
+    def _set(self, job, **fields):
+        with self._lock:
+            job.update(fields, updated_at=time.time())
+        if self._on_status:
+            try:
+                self._on_status(dict(job))
+            except Exception as e:
+                logger.warning("sms status callback failed job=%s error=%s", job["job_id"], e)
+
+    def _run(self, q):
+        while True:
+            job, code = q.get()
+            self._deliver(job, code)
+
+    def _deliver(self, job, code):
+        for attempt in range(SMS_SEND_RETRIES + 1):
+            self._set(job, status="sending", attempts=attempt + 1)
+            try:
+                self._send(job["phone"], code)
+            except Exception as e:
+                retryable = getattr(e, "retryable", True)
+                if retryable and attempt < SMS_SEND_RETRIES:
+                    with self._lock:
+                        self.retried += 1
+                    logger.warning("sms send retry phone=%s attempt=%d error=%s", job["phone"], attempt + 1, e)
+                    time.sleep(SMS_RETRY_BACKOFF * (2 ** attempt))
+                    continue
+                with self._lock:
+                    self.failed += 1
+                logger.error("sms send failed phone=%s attempts=%d error=%s", job["phone"], attempt + 1, e)
+                self._set(job, status="failed", error=str(e))
+                return
+            with self._lock:
+                self.sent += 1
+            logger.info("sms send success phone=%s attempts=%d", job["phone"], attempt + 1)
+            self._set(job, status="sent", error=None)
+            return
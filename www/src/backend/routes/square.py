@@ -5,15 +5,22 @@ File: square.py
 Description: Square (广场) posts backend routes: create table, publish and list posts
 """
 import os
+import time
 import uuid
 import json
+import queue
 import logging
 from datetime import datetime
 
 from dotenv import load_dotenv
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, Response, request, jsonify
 import mysql.connector
 from mysql.connector import errors as mysql_errors
+from routes.dbstats import trace_connection
+from routes.userstore import ensure_users_schema
+from routes import square_events
+from routes.write_behind import WriteBehindJournal
+from routes.idempotency import idempotent
 
 load_dotenv()
 
@@ -36,10 +43,66 @@ def _get_conn():
         cur.execute("SET SESSION MAX_EXECUTION_TIME=15000")
     finally:
         cur.close()
-    return conn
+    return trace_connection(conn)
+
+
+# Related-updates badge counts at most this many unread items ("99+" on the client)
+RELATED_UNREAD_CAP = 100
+ANONYMOUS_NAME = "匿名用户"
+
+# /square/stream holds a gunicorn thread per connection: keep the rest of the pool for requests
+SQUARE_STREAM_MAX_CLIENTS = int(os.getenv("SQUARE_STREAM_MAX_CLIENTS", "2"))
+SQUARE_STREAM_MAX_SECONDS = int(os.getenv("SQUARE_STREAM_MAX_SECONDS", "300"))
+SQUARE_STREAM_HEARTBEAT = float(os.getenv("SQUARE_STREAM_HEARTBEAT", "15"))
+_STREAM_REPLAY_LIMIT = 200
+_STREAM_BLOCKLIST_REFRESH = 60
+
+# Write-behind: publish / comment are acknowledged once journaled on local disk and inserted
+# in batches by a flusher thread (routes/write_behind.py)
+SQUARE_WRITE_BEHIND = os.getenv("SQUARE_WRITE_BEHIND", "0").strip().lower() not in {"0", "false", "no", "off", ""}
+_FLUSH_CHUNK = 200
+
+_tables_ready = False
+
+# post_user_id / parent_user_id: authors of the commented post and of the replied-to comment,
+# copied onto each comment so "comments related to me" is two index range scans
+_COMMENT_MIGRATIONS = (
+    "ALTER TABLE square_comments ADD COLUMN post_user_id VARCHAR(128) NULL",
+    "ALTER TABLE square_comments ADD COLUMN parent_user_id VARCHAR(128) NULL",
+    "ALTER TABLE square_comments ADD INDEX idx_post_user_created (post_user_id, created_at)",
+    "ALTER TABLE square_comments ADD INDEX idx_parent_user_created (parent_user_id, created_at)",
+)
+_COMMENT_BACKFILL = (
+    # IS NULL is answered from the new indexes, so re-running this per process is cheap
+    """
+    UPDATE square_comments c JOIN square_posts p ON p.id = c.post_id
+    SET c.post_user_id = p.user_id
+    WHERE c.post_user_id IS NULL AND p.user_id IS NOT NULL
+    """,
+    """
+    UPDATE square_comments c JOIN square_comments pc ON pc.id = c.parent_comment_id
+    SET c.parent_user_id = pc.user_id
+    WHERE c.parent_user_id IS NULL AND c.parent_comment_id IS NOT NULL AND pc.user_id IS NOT NULL
+    """,
+)
+
+
+def _current_avatar(alias):
+    """
+    SELECT expression for the author's current (versioned) avatar: joined users.avatar_url,
+    falling back to the snapshot stored on the row. Anonymous rows keep their snapshot so
+    the join cannot reveal who wrote them. Requires `LEFT JOIN users u ON u.user_id = <alias>.user_id`.
+    """
+    return (
+        f"CASE WHEN {alias}.username = '匿名用户' THEN {alias}.avatar_url "
+        f"ELSE COALESCE(u.avatar_url, {alias}.avatar_url) END AS avatar_url"
+    )
 
 
 def _ensure_table(conn):
+    global _tables_ready
+    if _tables_ready:
+        return
     # 创建广场消息表
     posts_ddl = """
     CREATE TABLE IF NOT EXISTS square_posts (
@@ -90,8 +153,23 @@ def _ensure_table(conn):
             # 字段已存在，忽略错误
             if "Duplicate column name" not in str(e) and "Duplicate key name" not in str(e):
                 raise
-        
+
+        for stmt in _COMMENT_MIGRATIONS:
+            try:
+                cur.execute(stmt)
+                logger.info("square schema: %s", stmt)
+            except mysql_errors.Error as e:
+                # 1060 duplicate column / 1061 duplicate key name: already migrated
+                if getattr(e, "errno", None) not in (1060, 1061):
+                    raise
+        for stmt in _COMMENT_BACKFILL:
+            cur.execute(stmt)
+            if cur.rowcount:
+                logger.info("square backfill: %d comment(s) updated", cur.rowcount)
+
         conn.commit()
+        square_events.ensure_events_table(conn)
+        _tables_ready = True
     finally:
         try:
             cur.close()
@@ -99,6 +177,124 @@ def _ensure_table(conn):
             pass
 
 
+def _post_event(cur, post, created_at):
+    """Log the post event for an inserted square_posts row (post: the publish / journal entry fields)."""
+    is_anonymous = post.get("username") == ANONYMOUS_NAME
+    return square_events.log_event(cur, square_events.EVENT_POST, {"post": {
+        "id": post["id"],
+        "user_id": None if is_anonymous else post.get("user_id"),
+        "username": post.get("username"),
+        "avatar_url": post.get("avatar_url"),
+        "text": post.get("text") or "",
+        "images": post.get("images") or [],
+        "created_at": created_at,
+    }}, author_id=post.get("user_id"), anonymous=is_anonymous)
+
+
+def _comment_event(cur, comment, created_at):
+    is_anonymous = comment.get("username") == ANONYMOUS_NAME
+    return square_events.log_event(cur, square_events.EVENT_COMMENT, {"comment": {
+        "id": comment["id"],
+        "post_id": comment["post_id"],
+        "parent_comment_id": comment.get("parent_comment_id"),
+        "user_id": None if is_anonymous else comment.get("user_id"),
+        "username": comment.get("username"),
+        "avatar_url": comment.get("avatar_url"),
+        "text": comment.get("text") or "",
+        "created_at": created_at,
+    }}, author_id=comment.get("user_id"), anonymous=is_anonymous)
+
+
+def _created_at_by_id(cur, table, ids):
+    cur.execute(
+        f"SELECT id, created_at FROM {table} WHERE id IN ({', '.join(['%s'] * len(ids))})",
+        tuple(ids),
+    )
+    return {r[0]: r[1] for r in cur.fetchall()}
+
+
+def _flush_journal(entries):
+    """
+    Insert journaled posts / comments (write-behind mode) in one transaction, _FLUSH_CHUNK rows per
+    INSERT IGNORE. Replays are harmless: ids were generated at append time, and events are only
+    logged for rows this call actually inserted. Comments on posts deleted meanwhile are dropped
+    by the foreign key (IGNORE turns the violation into a warning).
+    """
+    posts = [e for e in entries if e.get("op") == "post"]
+    comments = [e for e in entries if e.get("op") == "comment"]
+    events = []
+    conn = _get_conn()
+    try:
+        _ensure_table(conn)
+        cur = conn.cursor()
+        try:
+            for i in range(0, len(posts), _FLUSH_CHUNK):
+                chunk = posts[i:i + _FLUSH_CHUNK]
+                ids = [e["id"] for e in chunk]
+                existing = _created_at_by_id(cur, "square_posts", ids)
+                params = []
+                for e in chunk:
+                    params.extend((e["id"], e.get("user_id"), e.get("username"), e.get("avatar_url"), e.get("text"),
+                                   json.dumps(e.get("images") or [], ensure_ascii=False), e["ts"]))
+                cur.execute(
+                    "INSERT IGNORE INTO square_posts (id, user_id, username, avatar_url, text_content, image_urls, created_at) "
+                    "VALUES " + ", ".join(["(%s, %s, %s, %s, %s, %s, FROM_UNIXTIME(%s))"] * len(chunk)),
+                    params,
+                )
+                stored = _created_at_by_id(cur, "square_posts", ids)
+                events.extend(_post_event(cur, e, stored[e["id"]]) for e in chunk
+                              if e["id"] in stored and e["id"] not in existing)
+
+            # A reply whose parent comment is in the same batch waits for the next wave (foreign key)
+            pending = comments
+            while pending:
+                pending_ids = {e["id"] for e in pending}
+                wave = [e for e in pending if e.get("parent_comment_id") not in pending_ids] or pending
+                wave_ids = {e["id"] for e in wave}
+                pending = [e for e in pending if e["id"] not in wave_ids]
+                for i in range(0, len(wave), _FLUSH_CHUNK):
+                    chunk = wave[i:i + _FLUSH_CHUNK]
+                    ids = [e["id"] for e in chunk]
+                    existing = _created_at_by_id(cur, "square_comments", ids)
+                    params = []
+                    for e in chunk:
+                        params.extend((e["id"], e["post_id"], e.get("parent_comment_id"), e.get("user_id"),
+                                       e.get("username"), e.get("avatar_url"), e.get("text"), e["ts"]))
+                    cur.execute(
+                        "INSERT IGNORE INTO square_comments "
+                        "(id, post_id, parent_comment_id, user_id, username, avatar_url, text_content, created_at) "
+                        "VALUES " + ", ".join(["(%s, %s, %s, %s, %s, %s, %s, FROM_UNIXTIME(%s))"] * len(chunk)),
+                        params,
+                    )
+                    placeholders = ", ".join(["%s"] * len(ids))
+                    cur.execute(
+                        f"""
+                        UPDATE square_comments c
+                        JOIN square_posts p ON p.id = c.post_id
+                        LEFT JOIN square_comments pc ON pc.id = c.parent_comment_id
+                        SET c.post_user_id = p.user_id, c.parent_user_id = pc.user_id
+                        WHERE c.id IN ({placeholders})
+                        """,
+                        tuple(ids),
+                    )
+                    stored = _created_at_by_id(cur, "square_comments", ids)
+                    events.extend(_comment_event(cur, e, stored[e["id"]]) for e in chunk
+                                  if e["id"] in stored and e["id"] not in existing)
+        finally:
+            cur.close()
+        conn.commit()
+    finally:
+        conn.close()
+    logger.info("square write-behind flushed posts=%d comments=%d new=%d", len(posts), len(comments), len(events))
+    for event in events:
+        square_events.publish_local(event)
+
+
+_journal = WriteBehindJournal("square", _flush_journal) if SQUARE_WRITE_BEHIND else None
+if _journal is not None:
+    _journal.start()  # replays segments left by workers that stopped before flushing
+
+
 @square_blueprint.route("/square/list", methods=["POST", "OPTIONS"])
 def list_posts():
     if request.method == "OPTIONS":
@@ -124,23 +320,25 @@ def list_posts():
                 if current_user_id:
                     cur.execute(
                         """
-                        SELECT p.id, p.user_id, p.username, p.avatar_url, p.text_content, p.image_urls, p.created_at
+                        SELECT p.id, p.user_id, p.username, {avatar}, p.text_content, p.image_urls, p.created_at
                         FROM square_posts p
+                        LEFT JOIN users u ON u.user_id = p.user_id
                         LEFT JOIN blocked_users b ON b.blocker_id = %s AND b.blocked_id = p.user_id
                         WHERE b.id IS NULL
                         ORDER BY p.created_at DESC
                         LIMIT %s
-                        """,
+                        """.format(avatar=_current_avatar("p")),
                         (current_user_id, limit),
                     )
                 else:
                     cur.execute(
                         """
-                        SELECT id, user_id, username, avatar_url, text_content, image_urls, created_at
-                        FROM square_posts
-                        ORDER BY created_at DESC
+                        SELECT p.id, p.user_id, p.username, {avatar}, p.text_content, p.image_urls, p.created_at
+                        FROM square_posts p
+                        LEFT JOIN users u ON u.user_id = p.user_id
+                        ORDER BY p.created_at DESC
                         LIMIT %s
-                        """,
+                        """.format(avatar=_current_avatar("p")),
                         (limit,),
                     )
                 rows = cur.fetchall()
@@ -176,7 +374,7 @@ def list_posts():
                     "avatar_url": r.get("avatar_url"),
                     "text": r.get("text_content") or "",
                     "images": images or [],
-                    "created_at": r.get("created_at").isoformat() if r.get("created_at") else None,
+                    "created_at": r.get("created_at"),
                 }
             )
 
@@ -194,6 +392,7 @@ def list_posts():
 
 
 @square_blueprint.route("/square/publish", methods=["POST", "OPTIONS"])
+@idempotent
 def publish_post():
     if request.method == "OPTIONS":
         return "", 200
@@ -224,6 +423,13 @@ def publish_post():
                     safe_images.append(it)
 
         post_id = uuid.uuid4().hex
+        post = {"id": post_id, "user_id": user_id, "username": username, "avatar_url": avatar_url,
+                "text": text_content, "images": safe_images}
+
+        if _journal is not None:
+            # 先写本地日志即返回，稍后批量写入数据库（SSE 在入库时推送）
+            _journal.append({"op": "post", "ts": time.time(), **post})
+            return jsonify({"success": True, "message": "发布成功", "data": {"id": post_id, "queued": True}})
 
         conn = _get_conn()
         try:
@@ -238,11 +444,14 @@ def publish_post():
                     """,
                     (post_id, user_id, username, avatar_url, text_content, json.dumps(safe_images, ensure_ascii=False)),
                 )
+                cur.execute("SELECT created_at FROM square_posts WHERE id = %s", (post_id,))
+                event = _post_event(cur, post, cur.fetchone()[0])
                 conn.commit()
             finally:
                 cur.close()
         finally:
             conn.close()
+        square_events.publish_local(event)
 
         return jsonify({
             "success": True,
@@ -284,22 +493,24 @@ def list_comments():
                 if current_user_id:
                     cur.execute(
                         """
-                        SELECT c.id, c.parent_comment_id, c.user_id, c.username, c.avatar_url, c.text_content, c.created_at
+                        SELECT c.id, c.parent_comment_id, c.user_id, c.username, {avatar}, c.text_content, c.created_at
                         FROM square_comments c
+                        LEFT JOIN users u ON u.user_id = c.user_id
                         LEFT JOIN blocked_users b ON b.blocker_id = %s AND b.blocked_id = c.user_id
                         WHERE c.post_id = %s AND b.id IS NULL
                         ORDER BY c.created_at ASC
-                        """,
+                        """.format(avatar=_current_avatar("c")),
                         (current_user_id, post_id),
                     )
                 else:
                     cur.execute(
                         """
-                        SELECT id, parent_comment_id, user_id, username, avatar_url, text_content, created_at
-                        FROM square_comments
-                        WHERE post_id = %s
-                        ORDER BY created_at ASC
-                        """,
+                        SELECT c.id, c.parent_comment_id, c.user_id, c.username, {avatar}, c.text_content, c.created_at
+                        FROM square_comments c
+                        LEFT JOIN users u ON u.user_id = c.user_id
+                        WHERE c.post_id = %s
+                        ORDER BY c.created_at ASC
+                        """.format(avatar=_current_avatar("c")),
                         (post_id,),
                     )
                 rows = cur.fetchall()
@@ -327,7 +538,7 @@ def list_comments():
                 "username": r.get("username"),
                 "avatar_url": r.get("avatar_url"),
                 "text": r.get("text_content") or "",
-                "created_at": r.get("created_at").isoformat() if r.get("created_at") else None,
+                "created_at": r.get("created_at"),
             })
 
         return jsonify({"success": True, "data": comments, "count": len(comments)})
@@ -344,6 +555,7 @@ def list_comments():
 
 
 @square_blueprint.route("/square/comment", methods=["POST", "OPTIONS"])
+@idempotent
 def add_comment():
     """添加评论"""
     if request.method == "OPTIONS":
@@ -369,25 +581,46 @@ def add_comment():
             return jsonify({"success": False, "message": "缺少用户标识"}), 400
 
         comment_id = uuid.uuid4().hex
+        comment = {"id": comment_id, "post_id": post_id, "parent_comment_id": parent_comment_id,
+                   "user_id": user_id, "username": username, "avatar_url": avatar_url, "text": text_content}
+
+        if _journal is not None:
+            # 写后入库模式无法同步确认帖子是否存在；帖子已删除的评论在入库时被丢弃
+            _journal.append({"op": "comment", "ts": time.time(), **comment})
+            return jsonify({"success": True, "message": "评论成功", "data": {"id": comment_id, "queued": True}})
 
         conn = _get_conn()
         try:
             _ensure_table(conn)
             cur = conn.cursor()
             try:
+                # 同一语句带上帖子作者与被回复评论作者，供“与我相关”按索引查询
                 cur.execute(
                     """
-                    INSERT INTO square_comments (id, post_id, parent_comment_id, user_id, username, avatar_url, text_content)
-                    VALUES (%s, %s, %s, %s, %s, %s, %s)
+                    INSERT INTO square_comments
+                        (id, post_id, parent_comment_id, user_id, username, avatar_url, text_content, post_user_id, parent_user_id)
+                    SELECT %s, p.id, %s, %s, %s, %s, %s, p.user_id,
+                           (SELECT pc.user_id FROM square_comments pc WHERE pc.id = %s)
+                    FROM square_posts p
+                    WHERE p.id = %s
                     """,
-                    (comment_id, post_id, parent_comment_id, user_id, username, avatar_url, text_content),
+                    (comment_id, parent_comment_id, user_id, username, avatar_url, text_content, parent_comment_id, post_id),
                 )
+                inserted = cur.rowcount
+                event = None
+                if inserted:
+                    cur.execute("SELECT created_at FROM square_comments WHERE id = %s", (comment_id,))
+                    event = _comment_event(cur, comment, cur.fetchone()[0])
                 conn.commit()
             finally:
                 cur.close()
         finally:
             conn.close()
 
+        if not inserted:
+            return jsonify({"success": False, "message": "消息不存在或已删除"}), 404
+        square_events.publish_local(event)
+
         return jsonify({
             "success": True,
             "message": "评论成功",
@@ -417,6 +650,7 @@ def list_user_related():
     try:
         payload = request.get_json(silent=True) or {}
         current_user_id = (payload.get("current_user_id") or "").strip()
+        mark_seen = bool(payload.get("mark_seen"))
         limit = payload.get("limit") or 200
         try:
             limit = int(limit)
@@ -432,55 +666,38 @@ def list_user_related():
             _ensure_table(conn)
             cur = conn.cursor(dictionary=True)
             try:
-                # 1) 找到当前用户发布的帖子ID
+                # 我发布的帖子下的全部评论 + 对我评论的直接回复：两次索引范围扫描
                 cur.execute(
-                    "SELECT id FROM square_posts WHERE user_id = %s",
-                    (current_user_id,)
-                )
-                post_rows = cur.fetchall() or []
-                my_post_ids = [r["id"] for r in post_rows]
-
-                related_comments = []
-
-                # 2) 这些帖子下的全部评论（包含嵌套，因为同post_id）
-                if my_post_ids:
-                    in_clause = ",".join(["%s"] * len(my_post_ids))
-                    query = f"""
-                        SELECT c.id, c.post_id, c.parent_comment_id, c.user_id, c.username, c.avatar_url, c.text_content, c.created_at,
-                               p.user_id AS post_user_id, p.username AS post_username
-                        FROM square_comments c
-                        JOIN square_posts p ON p.id = c.post_id
-                        WHERE c.post_id IN ({in_clause})
-                    """
-                    cur.execute(query, tuple(my_post_ids))
-                    related_comments.extend(cur.fetchall() or [])
-
-                # 3) 所有对当前用户评论的直接回复（parent_comment_id 属于我发的评论）
-                cur.execute(
-                    "SELECT id FROM square_comments WHERE user_id = %s",
-                    (current_user_id,)
+                    f"""
+                    SELECT c.id, c.post_id, c.parent_comment_id, c.user_id, c.username, {_current_avatar('c')}, c.text_content, c.created_at,
+                           p.user_id AS post_user_id, p.username AS post_username
+                    FROM (
+                        (SELECT id, created_at FROM square_comments WHERE post_user_id = %s ORDER BY created_at DESC LIMIT %s)
+                        UNION
+                        (SELECT id, created_at FROM square_comments WHERE parent_user_id = %s ORDER BY created_at DESC LIMIT %s)
+                    ) r
+                    JOIN square_comments c ON c.id = r.id
+                    JOIN square_posts p ON p.id = c.post_id
+                    LEFT JOIN users u ON u.user_id = c.user_id
+                    ORDER BY c.created_at DESC
+                    LIMIT %s
+                    """,
+                    (current_user_id, limit, current_user_id, limit, limit),
                 )
-                my_comment_rows = cur.fetchall() or []
-                my_comment_ids = [r["id"] for r in my_comment_rows]
-                if my_comment_ids:
-                    in_clause = ",".join(["%s"] * len(my_comment_ids))
-                    query = f"""
-                        SELECT c.id, c.post_id, c.parent_comment_id, c.user_id, c.username, c.avatar_url, c.text_content, c.created_at,
-                               p.user_id AS post_user_id, p.username AS post_username
-                        FROM square_comments c
-                        JOIN square_posts p ON p.id = c.post_id
-                        WHERE c.parent_comment_id IN ({in_clause})
-                    """
-                    cur.execute(query, tuple(my_comment_ids))
-                    related_comments.extend(cur.fetchall() or [])
+                items = cur.fetchall() or []
 
-                # 去重（按评论ID）并按时间倒序
-                uniq = {}
-                for r in related_comments:
-                    uniq[r["id"]] = r
-                items = list(uniq.values())
-                items.sort(key=lambda r: r.get("created_at") or datetime(1970,1,1), reverse=True)
-                items = items[:limit]
+                if mark_seen:
+                    # 水位取本次返回的最新评论时间，避免漏掉读取之后才写入的评论
+                    ensure_users_schema(conn)
+                    newest = items[0]["created_at"] if items else None
+                    cur.execute(
+                        """
+                        UPDATE users SET square_related_seen_at = COALESCE(%s, NOW())
+                        WHERE user_id = %s AND (square_related_seen_at IS NULL OR square_related_seen_at < COALESCE(%s, NOW()))
+                        """,
+                        (newest, current_user_id, newest),
+                    )
+                    conn.commit()
 
                 # 过滤被我拉黑的用户内容（如果存在block表）
                 # 这里保持简单：仅在最终列表中过滤
@@ -501,7 +718,7 @@ def list_user_related():
         data = []
         for r in items:
             # 匿名处理：匿名且不是我时隐藏user_id
-            is_anon_comment = (r.get("username") == "匿名用户") and (r.get("user_id") != current_user_id)
+            is_anon_comment = (r.get("username") == ANONYMOUS_NAME) and (r.get("user_id") != current_user_id)
             user_id = None if is_anon_comment else r.get("user_id")
 
             if user_id and user_id in blocked:
@@ -515,7 +732,7 @@ def list_user_related():
                 "username": r.get("username"),
                 "avatar_url": r.get("avatar_url"),
                 "text": r.get("text_content") or "",
-                "created_at": r.get("created_at").isoformat() if r.get("created_at") else None,
+                "created_at": r.get("created_at"),
                 "post_user_id": r.get("post_user_id"),
                 "post_username": r.get("post_username"),
             })
@@ -532,6 +749,71 @@ def list_user_related():
         logger.exception("/square/related server error: %s", e)
         return jsonify({"success": False, "message": "服务器错误", "error": str(e)}), 500
 
+@square_blueprint.route("/square/related/unread_count", methods=["GET", "POST", "OPTIONS"])
+def related_unread_count():
+    """“与我相关”的未读数：水位（users.square_related_seen_at，/square/related 传 mark_seen 时推进）之后的评论，
+    不含自己发的与被我拉黑用户的（匿名评论照常计入），最多统计 RELATED_UNREAD_CAP 条。
+    """
+    if request.method == "OPTIONS":
+        return "", 200
+    try:
+        payload = (request.get_json(silent=True) or {}) if request.method == "POST" else request.args
+        current_user_id = (payload.get("current_user_id") or "").strip()
+        if not current_user_id:
+            return jsonify({"success": False, "message": "缺少用户ID"}), 400
+
+        conn = _get_conn()
+        try:
+            _ensure_table(conn)
+            ensure_users_schema(conn)
+            cur = conn.cursor()
+            try:
+                cur.execute("SELECT square_related_seen_at FROM users WHERE user_id = %s", (current_user_id,))
+                row = cur.fetchone()
+                seen_at = row[0] if row and row[0] else datetime(1970, 1, 2)
+                unread_filter = """
+                    c.created_at > %s
+                    AND (c.user_id IS NULL OR c.user_id <> %s)
+                    AND (c.username = %s OR NOT EXISTS (
+                        SELECT 1 FROM blocked_users b WHERE b.blocker_id = %s AND b.blocked_id = c.user_id))
+                """
+                filter_params = (seen_at, current_user_id, ANONYMOUS_NAME, current_user_id)
+                cur.execute(
+                    f"""
+                    SELECT COUNT(*) FROM (
+                        (SELECT c.id FROM square_comments c WHERE c.post_user_id = %s AND {unread_filter} LIMIT %s)
+                        UNION
+                        (SELECT c.id FROM square_comments c WHERE c.parent_user_id = %s AND {unread_filter} LIMIT %s)
+                        LIMIT %s
+                    ) t
+                    """,
+                    (current_user_id, *filter_params, RELATED_UNREAD_CAP,
+                     current_user_id, *filter_params, RELATED_UNREAD_CAP, RELATED_UNREAD_CAP),
+                )
+                count = int(cur.fetchone()[0])
+            finally:
+                cur.close()
+            conn.commit()
+        finally:
+            conn.close()
+
+        return jsonify({
+            "success": True,
+            "count": count,
+            "capped": count >= RELATED_UNREAD_CAP,
+            "seen_at": seen_at if row and row[0] else None,
+        })
+
+    except mysql_errors.Error as e:
+        if getattr(e, "errno", None) in (3024, 1205, 1213):
+            logger.warning("/square/related/unread_count db timeout/deadlock errno=%s msg=%s", getattr(e, "errno", None), str(e))
+            return jsonify({"success": False, "message": "数据库超时或死锁，请稍后重试"}), 504
+        logger.exception("/square/related/unread_count db error: %s", e)
+        return jsonify({"success": False, "message": "数据库错误", "error": str(e)}), 500
+    except Exception as e:
+        logger.exception("/square/related/unread_count server error: %s", e)
+        return jsonify({"success": False, "message": "服务器错误", "error": str(e)}), 500
+
 @square_blueprint.route("/square/post/<post_id>", methods=["DELETE", "OPTIONS"])
 def delete_post(post_id):
     """删除消息"""
@@ -553,8 +835,11 @@ def delete_post(post_id):
                     "DELETE FROM square_posts WHERE id = %s",
                     (post_id,),
                 )
-                conn.commit()
                 affected_rows = cur.rowcount
+                event = None
+                if affected_rows:
+                    event = square_events.log_event(cur, square_events.EVENT_POST_DELETED, {"post_id": post_id})
+                conn.commit()
             finally:
                 cur.close()
         finally:
@@ -562,6 +847,7 @@ def delete_post(post_id):
 
         if affected_rows == 0:
             return jsonify({"success": False, "message": "消息不存在"}), 404
+        square_events.publish_local(event)
 
         return jsonify({
             "success": True,
@@ -596,12 +882,18 @@ def delete_comment(comment_id):
                 # 删除评论（子评论会因为外键级联删除自动删除）
                 # 由于外键约束：FOREIGN KEY (parent_comment_id) REFERENCES square_comments(id) ON DELETE CASCADE
                 # 删除主评论时会自动删除所有相关的子评论
+                cur.execute("SELECT post_id FROM square_comments WHERE id = %s FOR UPDATE", (comment_id,))
+                row = cur.fetchone()
                 cur.execute(
                     "DELETE FROM square_comments WHERE id = %s",
                     (comment_id,),
                 )
-                conn.commit()
                 affected_rows = cur.rowcount
+                event = None
+                if affected_rows and row:
+                    event = square_events.log_event(cur, square_events.EVENT_COMMENT_DELETED,
+                                                    {"comment_id": comment_id, "post_id": row[0]})
+                conn.commit()
             finally:
                 cur.close()
         finally:
@@ -609,6 +901,7 @@ def delete_comment(comment_id):
 
         if affected_rows == 0:
             return jsonify({"success": False, "message": "评论不存在"}), 404
+        square_events.publish_local(event)
 
         return jsonify({
             "success": True,
@@ -626,3 +919,134 @@ def delete_comment(comment_id):
         return jsonify({"success": False, "message": "服务器错误", "error": str(e)}), 500
 
 
+
+
+def _load_blocked(conn, user_id):
+    if not user_id:
+        return set()
+    cur = conn.cursor()
+    try:
+        cur.execute("SELECT blocked_id FROM blocked_users WHERE blocker_id = %s", (user_id,))
+        return {r[0] for r in cur.fetchall()}
+    finally:
+        cur.close()
+
+
+def _sse(event_name, data, seq=None):
+    head = f"id: {seq}\n" if seq is not None else ""
+    return f"{head}event: {event_name}\ndata: {data}\n\n"
+
+
+@square_blueprint.route("/square/stream", methods=["GET", "OPTIONS"])
+def stream_events():
+    """广场实时更新（Server-Sent Events）：post / comment / post_deleted / comment_deleted 事件，
+    按当前用户过滤被拉黑作者；断线重连带 Last-Event-ID（或 ?last_event_id=）补发错过的事件，
+    首次连接先发 ready（id 为当前最新序号，供之后续传），
+    补发不全或推送积压时发 resync，客户端应重新拉取 /square/list。
+    每个 worker 最多 SQUARE_STREAM_MAX_CLIENTS 条连接，满了返回 503，客户端退回到普通刷新。
+    """
+    if request.method == "OPTIONS":
+        return "", 200
+    current_user_id = (request.args.get("current_user_id") or "").strip() or None
+    last_event_id = request.headers.get("Last-Event-ID") or request.args.get("last_event_id")
+    try:
+        after_seq = int(last_event_id) if last_event_id else None
+    except ValueError:
+        after_seq = None
+
+    # subscribe before reading the backlog so nothing committed in between is missed
+    sub = square_events.subscribe(SQUARE_STREAM_MAX_CLIENTS)
+    if sub is None:
+        resp = jsonify({"success": False, "message": "实时连接已满，请稍后重试"})
+        resp.headers["Retry-After"] = "30"
+        return resp, 503
+    handed_off = False
+    ready = False
+    try:
+        conn = _get_conn()
+        try:
+            _ensure_table(conn)
+            blocked = _load_blocked(conn, current_user_id)
+            backlog = []
+            if after_seq is not None:
+                backlog = square_events.replay(conn, after_seq, _STREAM_REPLAY_LIMIT + 1)
+            else:
+                # first connect: hand the client a position to resume from
+                after_seq = square_events.latest_seq(conn)
+                ready = True
+            conn.commit()
+        finally:
+            conn.close()
+        resync = len(backlog) > _STREAM_REPLAY_LIMIT
+        if resync:
+            backlog = []
+        logger.info("/square/stream open user=%s after=%s replay=%d resync=%s",
+                    current_user_id, after_seq, len(backlog), resync)
+
+        def generate():
+            nonlocal blocked
+            deadline = time.monotonic() + SQUARE_STREAM_MAX_SECONDS
+            blocked_at = time.monotonic()
+            replayed = set()
+            try:
+                yield "retry: 3000\n\n"
+                if ready:
+                    yield _sse("ready", json.dumps({"seq": after_seq}), after_seq)
+                if resync:
+                    yield _sse("resync", "{}")
+                for event in backlog:
+                    replayed.add(event.seq)
+                    data = square_events.visible_data(event, current_user_id, blocked)
+                    if data is not None:
+                        yield _sse(event.kind, data, event.seq)
+                while True:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break  # the client reconnects with Last-Event-ID; frees the thread meanwhile
+                    try:
+                        event = sub.get(timeout=min(SQUARE_STREAM_HEARTBEAT, remaining))
+                    except queue.Empty:
+                        yield ": ping\n\n"
+                        continue
+                    if event is square_events.RESYNC:
+                        yield _sse("resync", "{}")
+                        continue
+                    if event.seq in replayed:
+                        continue
+                    if current_user_id and time.monotonic() - blocked_at > _STREAM_BLOCKLIST_REFRESH:
+                        blocked_at = time.monotonic()
+                        try:
+                            c = _get_conn()
+                            try:
+                                blocked = _load_blocked(c, current_user_id)
+                                c.commit()
+                            finally:
+                                c.close()
+                        except mysql_errors.Error as e:
+                            logger.warning("/square/stream blocklist refresh failed: %s", e)
+                    data = square_events.visible_data(event, current_user_id, blocked)
+                    if data is not None:
+                        yield _sse(event.kind, data, event.seq)
+            finally:
+                square_events.unsubscribe(sub)
+
+        resp = Response(generate(), mimetype="text/event-stream")
+        resp.headers["Cache-Control"] = "no-cache"
+        resp.headers["X-Accel-Buffering"] = "no"  # nginx: flush each event
+        # a generator that never started does not run its finally block when closed
+        resp.call_on_close(lambda: square_events.unsubscribe(sub))
+        handed_off = True
+        return resp
+
+    except mysql_errors.Error as e:
+        if getattr(e, "errno", None) in (3024, 1205, 1213):
+            logger.warning("/square/stream db timeout/deadlock errno=%s msg=%s", getattr(e, "errno", None), str(e))
+            return jsonify({"success": False, "message": "数据库超时或死锁，请稍后重试"}), 504
+        logger.exception("/square/stream db error: %s", e)
+        return jsonify({"success": False, "message": "数据库错误", "error": str(e)}), 500
+    except Exception as e:
+        logger.exception("/square/stream server error: %s", e)
+        return jsonify({"success": False, "message": "服务器错误", "error": str(e)}), 500
+    finally:
+        if not handed_off:
+            square_events.unsubscribe(sub)
@@ -0,0 +1,314 @@
+"""
+Square live updates: event log, in-process pub/sub and cross-worker relay for /square/stream
+- Writes in square.py call log_event() inside their own transaction, so an event exists exactly
+  when the post / comment / delete it describes was committed; square_events.seq is the SSE id
+- After commit the writer calls publish_local() to hand the event straight to this worker's
+  subscribers; other gunicorn workers pick it up through the relay below
+- The relay is one thread per worker, running only while that worker has subscribers. It polls
+  square_events for rows after the highest seq it has seen (SQUARE_EVENT_POLL seconds). An
+  AUTO_INCREMENT value is taken at insert but becomes visible at commit, so a lower seq can show
+  up after a higher one: skipped numbers are re-polled for SQUARE_EVENT_GAP_WAIT seconds before
+  they are written off as rolled back. A bounded set of delivered seqs drops the duplicates
+  between local publishes, relay polls and Last-Event-ID replays
+- Each subscriber has a bounded queue (SQUARE_STREAM_QUEUE). A client too slow to drain it is
+  not allowed to hold memory: its queue is cleared and it is told to resync (reload the list)
+- Payloads are encoded once at log time; per-connection filtering (blocked authors, anonymous
+  user_id) happens in visible_data() so the fan-out never re-encodes for the common case
+- Events older than SQUARE_EVENT_RETENTION_HOURS are purged by the relay in small batches
+"""
+import os
+import json
+import time
+import queue
+import logging
+import threading
+from collections import deque, namedtuple
+
+from dotenv import load_dotenv
+import mysql.connector
+from mysql.connector import errors as mysql_errors
+from routes.dbstats import trace_connection
+from routes.response_pipeline import dumps as json_dumps
+
+load_dotenv()
+
+logger = logging.getLogger("app.square_events")
+
+DB_CONFIG = {
+    "host": os.getenv("DB_HOST"),
+    "user": os.getenv("DB_USER"),
+    "password": os.getenv("DB_PASSWORD"),
+    "database": os.getenv("DB_NAME"),
+}
+
+SQUARE_EVENT_POLL = float(os.getenv("SQUARE_EVENT_POLL", "1.0"))
+SQUARE_EVENT_GAP_WAIT = float(os.getenv("SQUARE_EVENT_GAP_WAIT", "10"))
+SQUARE_EVENT_RETENTION_HOURS = int(os.getenv("SQUARE_EVENT_RETENTION_HOURS", "24"))
+SQUARE_STREAM_QUEUE = int(os.getenv("SQUARE_STREAM_QUEUE", "256"))
+
+EVENT_POST = "post"
+EVENT_COMMENT = "comment"
+EVENT_POST_DELETED = "post_deleted"
+EVENT_COMMENT_DELETED = "comment_deleted"
+
+# sentinel put on a subscriber's queue after it overflowed
+RESYNC = object()
+
+_RELAY_BATCH = 500
+_MAX_GAPS = 1000
+_DELIVERED_KEEP = 4096
+_PURGE_EVERY = 600
+_RELAY_IDLE_EXIT = 30
+
+SquareEvent = namedtuple("SquareEvent", "seq kind author_id anonymous data")
+
+_table_ready = False
+
+_lock = threading.Lock()
+_subscribers = set()
+_delivered = set()
+_delivered_order = deque()
+_relay_thread = None
+
+
+def _get_conn():
+    conn = mysql.connector.connect(**DB_CONFIG, connection_timeout=5, autocommit=False)
+    cur = conn.cursor()
+    try:
+        cur.execute("SET SESSION MAX_EXECUTION_TIME=15000")
+    finally:
+        cur.close()
+    return trace_connection(conn)
+
+
+def ensure_events_table(conn):
+    global _table_ready
+    if _table_ready:
+        return
+    ddl = """
+    CREATE TABLE IF NOT EXISTS square_events (
+        seq BIGINT NOT NULL AUTO_INCREMENT PRIMARY KEY,
+        kind VARCHAR(32) NOT NULL,
+        author_id VARCHAR(128) NULL,
+        anonymous TINYINT(1) NOT NULL DEFAULT 0,
+        payload MEDIUMTEXT NOT NULL,
+        created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+        INDEX idx_created_at (created_at)
+    ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+    """
+    cur = conn.cursor()
+    try:
+        cur.execute(ddl)
+        conn.commit()
+        _table_ready = True
+    finally:
+        cur.close()
+
+
+def log_event(cur, kind, payload, author_id=None, anonymous=False):
+    """
+    Append an event in the caller's transaction and return it (seq is its SSE id).
+    For anonymous content pass the real author_id (block filtering still applies) and leave
+    user_id out of payload; only the author's own connection gets it back.
+    """
+    data = json_dumps(payload)  # no current_app: the write-behind flusher calls this off the request thread
+    cur.execute(
+        "INSERT INTO square_events (kind, author_id, anonymous, payload) VALUES (%s, %s, %s, %s)",
+        (kind, author_id, 1 if anonymous else 0, data),
+    )
+    return SquareEvent(cur.lastrowid, kind, author_id, bool(anonymous), data)
+
+
+def _mark_delivered(seq) -> bool:
+    """Record seq as fanned out; False if it already was. Caller holds _lock."""
+    if seq in _delivered:
+        return False
+    _delivered.add(seq)
+    _delivered_order.append(seq)
+    while len(_delivered_order) > _DELIVERED_KEEP:
+        _delivered.discard(_delivered_order.popleft())
+    return True
+
+
+def _fan_out(event):
+    with _lock:
+        if not _mark_delivered(event.seq):
+            return
+        targets = list(_subscribers)
+    for sub in targets:
+        sub.offer(event)
+
+
+def publish_local(event):
+    """Deliver a committed event to this worker's subscribers (call after conn.commit())."""
+    if event is None:
+        return
+    try:
+        _fan_out(event)
+    except Exception as e:  # live updates must never fail the write that caused them
+        logger.warning("square event publish failed seq=%s: %s", event.seq, e)
+
+
+class Subscription:
+    def __init__(self, maxsize: int = SQUARE_STREAM_QUEUE):
+        self.queue = queue.Queue(maxsize=maxsize)
+        self.dropped = 0
+        self._lock = threading.Lock()  # publishers (writer threads, relay) take turns
+
+    def offer(self, event):
+        with self._lock:
+            try:
+                self.queue.put_nowait(event)
+            except queue.Full:
+                # Slow consumer: drop the backlog and make it reload instead of buffering more
+                self.dropped += 1
+                try:
+                    while True:
+                        self.queue.get_nowait()
+                except queue.Empty:
+                    pass
+                self.queue.put_nowait(RESYNC)
+
+    def get(self, timeout):
+        return self.queue.get(timeout=timeout)
+
+
+def subscribe(max_clients: int):
+    """Register a subscriber on this worker, or None if max_clients are already connected."""
+    global _relay_thread
+    with _lock:
+        if len(_subscribers) >= max_clients:
+            return None
+        sub = Subscription()
+        _subscribers.add(sub)
+        if _relay_thread is None or not _relay_thread.is_alive():
+            _relay_thread = threading.Thread(target=_relay_loop, name="square-event-relay", daemon=True)
+            _relay_thread.start()
+    return sub
+
+
+def unsubscribe(sub):
+    """Remove a subscriber; safe to call more than once."""
+    with _lock:
+        was_subscribed = sub in _subscribers
+        _subscribers.discard(sub)
+    if was_subscribed and sub.dropped:
+        logger.info("square stream closed after %d overflow(s)", sub.dropped)
+
+
+def latest_seq(conn) -> int:
+    cur = conn.cursor()
+    try:
+        cur.execute("SELECT COALESCE(MAX(seq), 0) FROM square_events")
+        return int(cur.fetchone()[0])
+    finally:
+        cur.close()
+
+
+def _row_event(row):
+    seq, kind, author_id, anonymous, data = row
+    return SquareEvent(int(seq), kind, author_id, bool(anonymous), data)
+
+
+def replay(conn, after_seq: int, limit: int):
+    """Events after after_seq (oldest first), at most limit of them, for Last-Event-ID resumes."""
+    cur = conn.cursor()
+    try:
+        cur.execute(
+            "SELECT seq, kind, author_id, anonymous, payload FROM square_events "
+            "WHERE seq > %s ORDER BY seq LIMIT %s",
+            (after_seq, limit),
+        )
+        return [_row_event(r) for r in cur.fetchall()]
+    finally:
+        cur.close()
+
+
+def visible_data(event, viewer_id, blocked):
+    """The event's data line as this viewer may see it, or None if it should be skipped."""
+    if event.author_id and event.author_id in blocked:
+        return None
+    if event.anonymous and viewer_id and event.author_id == viewer_id:
+        # the list endpoints show authors their own anonymous user_id (delete button)
+        body = json.loads(event.data)
+        for key in ("post", "comment"):
+            if isinstance(body.get(key), dict):
+                body[key]["user_id"] = viewer_id
+        return json.dumps(body, ensure_ascii=False)
+    return event.data
+
+
+def _relay_loop():
+    global _relay_thread
+    conn = None
+    cursor_seq = None
+    gaps = {}  # seq -> monotonic deadline after which it is presumed rolled back
+    last_purge = 0.0
+    idle_since = None
+    while True:
+        with _lock:
+            if _subscribers:
+                idle_since = None
+            else:
+                idle_since = idle_since or time.monotonic()
+                if time.monotonic() - idle_since > _RELAY_IDLE_EXIT:
+                    # under the lock, so subscribe() either sees this thread gone or keeps it busy
+                    _relay_thread = None
+                    break
+        try:
+            if conn is None:
+                conn = _get_conn()
+                ensure_events_table(conn)
+            cur = conn.cursor()
+            try:
+                if cursor_seq is None:
+                    cursor_seq = latest_seq(conn)
+                floor = min(min(gaps) - 1, cursor_seq) if gaps else cursor_seq
+                cur.execute(
+                    "SELECT seq, kind, author_id, anonymous, payload FROM square_events "
+                    "WHERE seq > %s ORDER BY seq LIMIT %s",
+                    (floor, _RELAY_BATCH),
+                )
+                rows = cur.fetchall()
+                now = time.monotonic()
+                if now - last_purge > _PURGE_EVERY:
+                    cur.execute(
+                        "DELETE FROM square_events WHERE created_at < NOW() - INTERVAL %s HOUR LIMIT 1000",
+                        (SQUARE_EVENT_RETENTION_HOURS,),
+                    )
+                    if cur.rowcount:
+                        logger.info("square events purged: %d", cur.rowcount)
+                    last_purge = now
+            finally:
+                cur.close()
+            # end the read snapshot so the next poll sees newly committed rows
+            conn.commit()
+
+            for row in rows:
+                event = _row_event(row)
+                gaps.pop(event.seq, None)
+                if event.seq > cursor_seq + 1:
+                    for missing in range(cursor_seq + 1, min(event.seq, cursor_seq + 1 + _MAX_GAPS)):
+                        gaps.setdefault(missing, now + SQUARE_EVENT_GAP_WAIT)
+                cursor_seq = max(cursor_seq, event.seq)
+                _fan_out(event)
+            for seq in [s for s, deadline in gaps.items() if deadline < now]:
+                del gaps[seq]
+            while len(gaps) > _MAX_GAPS:
+                del gaps[min(gaps)]
+        except mysql_errors.Error as e:
+            logger.warning("square event relay db error: %s", e)
+            try:
+                if conn is not None:
+                    conn.close()
+            except Exception:
+                pass
+            conn = None
+        except Exception as e:
+            logger.exception("square event relay error: %s", e)
+        time.sleep(SQUARE_EVENT_POLL)
+    try:
+        if conn is not None:
+            conn.close()
+    except Exception:
+        pass
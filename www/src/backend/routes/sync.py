@@ -0,0 +1,417 @@
+"""
+Delta sync for health records (metrics / diet / case / symptom files)
+- Every insert or delete of a record is logged to record_changes in the writer's transaction,
+  numbered by a per-owner counter in record_sync_state. Bumping the counter takes that row's
+  lock until commit, so one owner's sequence numbers become visible in order and a change token
+  can never skip a write that was still in flight
+- GET /sync/records?since=<token> returns the owner's changes after the token: upserts carry the
+  record's metadata (and content with content=1), deletes are tombstones. next_token is what the
+  client sends next time; has_more means call again straight away
+- The first sync of an owner backfills records that predate the change log, so clients start
+  from since=0 and never need to refetch a full window
+- owner_version() gives the read endpoints a cheap validator for conditional GETs; list_version()
+  is the @conditional validator both record list endpoints (/getjson/<kind>, /uploadjson/<kind>/list)
+  share, so their ETags follow the same rules
+- owner is user_id, or username for legacy username-only uploads
+"""
+import os
+import json
+import logging
+from datetime import datetime
+
+from dotenv import load_dotenv
+from flask import Blueprint, request, jsonify
+import mysql.connector
+from mysql.connector import errors as mysql_errors
+from routes.dbstats import trace_connection
+from routes.session_token import resolve_identity, AuthError
+from routes.records import CONTENT_COLUMNS, decode_row, ensure_columns as ensure_record_columns
+
+load_dotenv()
+
+logger = logging.getLogger("app.sync")
+
+sync_blueprint = Blueprint("sync", __name__)
+
+DB_CONFIG = {
+    "host": os.getenv("DB_HOST"),
+    "user": os.getenv("DB_USER"),
+    "password": os.getenv("DB_PASSWORD"),
+    "database": os.getenv("DB_NAME"),
+}
+
+# Same kinds as getjson / uploadjson
+KIND_TO_TABLE = {
+    "metrics": "metrics_files",
+    "diet": "diet_files",
+    "case": "case_files",
+    "symptoms": "symptom_files",
+}
+
+SYNC_PAGE_SIZE = int(os.getenv("SYNC_PAGE_SIZE", "200"))
+SYNC_MAX_PAGE_SIZE = 1000
+
+OP_UPSERT = "I"
+OP_DELETE = "D"
+
+_SYNC_DDL = (
+    """
+    CREATE TABLE IF NOT EXISTS record_sync_state (
+        owner VARCHAR(128) PRIMARY KEY,
+        seq BIGINT NOT NULL DEFAULT 0,
+        backfilled TINYINT(1) NOT NULL DEFAULT 0,
+        updated_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
+    ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS record_changes (
+        owner VARCHAR(128) NOT NULL,
+        seq BIGINT NOT NULL,
+        kind VARCHAR(16) NOT NULL,
+        record_id VARCHAR(64) NOT NULL,
+        op CHAR(1) NOT NULL,
+        created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+        PRIMARY KEY (owner, seq),
+        INDEX idx_changes_record (owner, record_id)
+    ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+    """,
+)
+
+_tables_ready = False
+
+
+def _get_conn():
+    conn = mysql.connector.connect(**DB_CONFIG, connection_timeout=5, autocommit=False)
+    cur = conn.cursor()
+    try:
+        cur.execute("SET SESSION MAX_EXECUTION_TIME=15000")
+    finally:
+        cur.close()
+    return trace_connection(conn)
+
+
+def ensure_sync_tables(conn):
+    """
+    Create the change-log tables once per process. DDL commits implicitly, so writers call this
+    before they start the transaction that calls record_change().
+    """
+    global _tables_ready
+    if _tables_ready:
+        return
+    cur = conn.cursor()
+    try:
+        for ddl in _SYNC_DDL:
+            cur.execute(ddl)
+        conn.commit()
+        _tables_ready = True
+    finally:
+        try:
+            cur.close()
+        except Exception:
+            pass
+
+
+def owner_key(user_id, username):
+    return user_id or username or None
+
+
+def _reserve_seqs(cur, owner, count=1):
+    """Reserve `count` sequence numbers for owner and return the last; the state row stays locked until commit."""
+    cur.execute(
+        "INSERT INTO record_sync_state (owner, seq) VALUES (%s, LAST_INSERT_ID(%s)) "
+        "ON DUPLICATE KEY UPDATE seq = LAST_INSERT_ID(seq + %s)",
+        (owner, count, count),
+    )
+    cur.execute("SELECT LAST_INSERT_ID()")
+    return int(cur.fetchone()[0])
+
+
+def record_change(conn, user_id, username, kind, record_id, op=OP_UPSERT):
+    """Log an insert (OP_UPSERT) or delete (OP_DELETE) of one record; the caller commits. Returns the seq."""
+    owner = owner_key(user_id, username)
+    if not owner:
+        return None
+    cur = conn.cursor()
+    try:
+        seq = _reserve_seqs(cur, owner)
+        cur.execute(
+            "INSERT INTO record_changes (owner, seq, kind, record_id, op) VALUES (%s, %s, %s, %s, %s)",
+            (owner, seq, kind, record_id, op),
+        )
+        return seq
+    finally:
+        try:
+            cur.close()
+        except Exception:
+            pass
+
+
+def record_changes(conn, user_id, username, changes):
+    """record_change() for several (kind, record_id, op) at once: one counter bump, one multi-row insert."""
+    owner = owner_key(user_id, username)
+    if not owner or not changes:
+        return None
+    cur = conn.cursor()
+    try:
+        last = _reserve_seqs(cur, owner, len(changes))
+        first = last - len(changes) + 1
+        params = []
+        for offset, (kind, record_id, op) in enumerate(changes):
+            params.extend((owner, first + offset, kind, record_id, op))
+        cur.execute(
+            "INSERT INTO record_changes (owner, seq, kind, record_id, op) VALUES "
+            + ", ".join(["(%s, %s, %s, %s, %s)"] * len(changes)),
+            params,
+        )
+        return last
+    finally:
+        try:
+            cur.close()
+        except Exception:
+            pass
+
+
+def owner_version(conn, table, user_id, username):
+    """
+    (tag, last_modified) for an owner's records in `table`, for conditional GETs.
+    By user_id: the owner's change counter (any insert/delete through the API bumps it).
+    Owners without a counter yet, and username lookups (whose rows may be logged under a
+    user_id), fall back to COUNT / MAX(created_at) on the table's owner index.
+    """
+    owner = owner_key(user_id, username)
+    if not owner:
+        return None
+    cur = conn.cursor()
+    try:
+        if user_id:
+            try:
+                cur.execute("SELECT seq, updated_at FROM record_sync_state WHERE owner=%s", (owner,))
+                row = cur.fetchone()
+            except mysql_errors.Error as e:
+                if getattr(e, 'errno', None) != 1146:
+                    raise
+                row = None
+            if row:
+                return f"s{row[0]}", row[1]
+        where = "user_id = %s" if user_id else "username = %s"
+        cur.execute(f"SELECT COUNT(*), MAX(created_at) FROM {table} WHERE {where}", (user_id or username,))
+        count, latest = cur.fetchone()
+        return f"n{count}.{latest.isoformat() if latest else ''}", latest
+    finally:
+        try:
+            cur.close()
+        except Exception:
+            pass
+
+
+def list_version(kind):
+    """@conditional validator for an owner's record list: kind from the URL, owner from the query string."""
+    kind = (kind or "").strip().lower()
+    user_id = (request.args.get("user_id") or "").strip() or None
+    username = (request.args.get("username") or "").strip() or None
+    if kind not in KIND_TO_TABLE or not (user_id or username):
+        return None
+    conn = _get_conn()
+    try:
+        return owner_version(conn, KIND_TO_TABLE[kind], user_id, username)
+    finally:
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+
+def _backfill(conn, owner, user_id, username):
+    """Log records written before the change log existed (once per owner); returns the owner's seq."""
+    cur = conn.cursor()
+    try:
+        cur.execute("INSERT IGNORE INTO record_sync_state (owner) VALUES (%s)", (owner,))
+        cur.execute("SELECT seq, backfilled FROM record_sync_state WHERE owner=%s FOR UPDATE", (owner,))
+        seq, backfilled = cur.fetchone()
+        if backfilled:
+            conn.commit()
+            return int(seq)
+
+        cur.execute("SELECT record_id FROM record_changes WHERE owner=%s", (owner,))
+        logged = {r[0] for r in cur.fetchall()}
+        where = "user_id = %s" if user_id else "username = %s"
+        missing = []
+        for kind, table in KIND_TO_TABLE.items():
+            try:
+                cur.execute(f"SELECT id, created_at FROM {table} WHERE {where}", (user_id or username,))
+            except mysql_errors.Error as e:
+                # 1146: table not created yet (no upload of this kind so far)
+                if getattr(e, 'errno', None) == 1146:
+                    continue
+                raise
+            missing.extend((created_at, kind, rid) for rid, created_at in cur.fetchall() if rid not in logged)
+        missing.sort(key=lambda r: (r[0] or datetime(1970, 1, 1), r[2]))
+
+        rows = [(owner, int(seq) + i, kind, rid, OP_UPSERT) for i, (_, kind, rid) in enumerate(missing, 1)]
+        if rows:
+            cur.executemany(
+                "INSERT INTO record_changes (owner, seq, kind, record_id, op) VALUES (%s, %s, %s, %s, %s)",
+                rows,
+            )
+        seq = int(seq) + len(rows)
+        cur.execute("UPDATE record_sync_state SET seq=%s, backfilled=1 WHERE owner=%s", (seq, owner))
+        conn.commit()
+        logger.info("sync backfill owner=%s records=%d", owner, len(rows))
+        return seq
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        try:
+            cur.close()
+        except Exception:
+            pass
+
+
+def _parse_kinds(raw):
+    if not raw:
+        return list(KIND_TO_TABLE)
+    kinds = [k.strip().lower() for k in raw.split(",") if k.strip()]
+    return kinds if kinds and all(k in KIND_TO_TABLE for k in kinds) else None
+
+
+def _load_records(cur, ids_by_kind, with_content):
+    """{(kind, id): row} for the records that still exist."""
+    columns = "id, user_id, username, file_name, created_at" + (f", {CONTENT_COLUMNS}" if with_content else "")
+    found = {}
+    for kind, ids in ids_by_kind.items():
+        if not ids:
+            continue
+        in_clause = ",".join(["%s"] * len(ids))
+        cur.execute(f"SELECT {columns} FROM {KIND_TO_TABLE[kind]} WHERE id IN ({in_clause})", tuple(ids))
+        for row in cur.fetchall():
+            if with_content:
+                try:
+                    row["content"] = json.loads(decode_row(row)["content"] or "{}")
+                except Exception:
+                    row["content"] = {}
+            found[(kind, row["id"])] = row
+    return found
+
+
+@sync_blueprint.route("/sync/records", methods=["GET", "OPTIONS"])
+def sync_records():
+    """
+    Changes to the caller's health records since `since` (0 or absent: everything).
+    reset=true means the token is from a different history (e.g. the account was recreated):
+    drop local records and apply the changes from scratch.
+    """
+    if request.method == "OPTIONS":
+        return "", 200
+
+    try:
+        try:
+            user_id, username = resolve_identity(request.args)
+        except AuthError as e:
+            return jsonify({"success": False, "message": e.message}), e.status
+        user_id = (user_id or "").strip() or None
+        username = (username or "").strip() or None
+        owner = owner_key(user_id, username)
+        if not owner:
+            return jsonify({"success": False, "message": "缺少用户标识（user_id 或 username）"}), 400
+
+        try:
+            since = int(request.args.get("since") or 0)
+            if since < 0:
+                raise ValueError
+        except (TypeError, ValueError):
+            return jsonify({"success": False, "message": "无效的同步令牌"}), 400
+
+        kinds = _parse_kinds(request.args.get("kinds"))
+        if kinds is None:
+            return jsonify({"success": False, "message": "非法的类型（仅支持 metrics/diet/case/symptoms）"}), 400
+
+        try:
+            limit = max(1, min(SYNC_MAX_PAGE_SIZE, int(request.args.get("limit") or SYNC_PAGE_SIZE)))
+        except (TypeError, ValueError):
+            limit = SYNC_PAGE_SIZE
+        with_content = (request.args.get("content") or "").lower() in ("1", "true", "yes")
+
+        conn = _get_conn()
+        try:
+            ensure_sync_tables(conn)
+            if with_content:
+                for kind in kinds:
+                    ensure_record_columns(conn, KIND_TO_TABLE[kind])
+            cur = conn.cursor(dictionary=True)
+            try:
+                cur.execute("SELECT seq, backfilled FROM record_sync_state WHERE owner=%s", (owner,))
+                state = cur.fetchone()
+                if state and state["backfilled"]:
+                    current = int(state["seq"])
+                else:
+                    conn.commit()
+                    current = _backfill(conn, owner, user_id, username)
+
+                reset = since > current
+                if reset:
+                    since = 0
+
+                kind_filter = ""
+                params = [owner, since, current]
+                if len(kinds) < len(KIND_TO_TABLE):
+                    kind_filter = " AND kind IN (" + ",".join(["%s"] * len(kinds)) + ")"
+                    params.extend(kinds)
+                params.append(limit + 1)
+                cur.execute(
+                    f"SELECT seq, kind, record_id, op FROM record_changes "
+                    f"WHERE owner=%s AND seq > %s AND seq <= %s{kind_filter} ORDER BY seq LIMIT %s",
+                    params,
+                )
+                rows = cur.fetchall()
+                has_more = len(rows) > limit
+                rows = rows[:limit]
+
+                # Only the newest change per record matters within a page
+                latest = {}
+                for r in rows:
+                    latest[(r["kind"], r["record_id"])] = r
+                ids_by_kind = {}
+                for (kind, record_id), r in latest.items():
+                    if r["op"] == OP_UPSERT:
+                        ids_by_kind.setdefault(kind, []).append(record_id)
+                records = _load_records(cur, ids_by_kind, with_content)
+            finally:
+                try:
+                    cur.close()
+                except Exception:
+                    pass
+            conn.commit()
+        finally:
+            try:
+                conn.close()
+            except Exception:
+                pass
+
+        changes = []
+        for (kind, record_id), r in sorted(latest.items(), key=lambda item: item[1]["seq"]):
+            record = records.get((kind, record_id)) if r["op"] == OP_UPSERT else None
+            if record is not None:
+                changes.append({"seq": r["seq"], "kind": kind, "id": record_id, "op": "upsert", "record": record})
+            else:
+                # Deleted, or removed without passing through the API: either way a tombstone
+                changes.append({"seq": r["seq"], "kind": kind, "id": record_id, "op": "delete"})
+
+        next_token = rows[-1]["seq"] if has_more else current
+        return jsonify({
+            "success": True,
+            "changes": changes,
+            "next_token": str(next_token),
+            "has_more": has_more,
+            "reset": reset,
+        })
+
+    except mysql_errors.Error as e:
+        if getattr(e, 'errno', None) in (3024, 1205, 1213):
+            logger.warning("/sync/records db timeout/deadlock errno=%s msg=%s", getattr(e, 'errno', None), str(e))
+            return jsonify({"success": False, "message": "数据库超时或死锁，请稍后重试"}), 504
+        logger.exception("/sync/records db error: %s", e)
+        return jsonify({"success": False, "message": "数据库错误", "error": str(e)}), 500
+    except Exception as e:
+        logger.exception("/sync/records server error: %s", e)
+        return jsonify({"success": False, "message": "服务器错误", "error": str(e)}), 500
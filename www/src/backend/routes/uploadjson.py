@@ -6,9 +6,17 @@ from datetime import datetime
 from typing import Optional
 
 from dotenv import load_dotenv
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, request, jsonify, g
 import mysql.connector
 from mysql.connector import errors as mysql_errors
+from routes.dbstats import trace_connection
+from routes.keyword_matcher import KeywordMatcher
+from routes.session_token import resolve_identity, AuthError
+from routes.sync import ensure_sync_tables, record_change, record_changes, owner_key, list_version, OP_UPSERT, OP_DELETE
+from routes.conditional import conditional
+from routes.idempotency import idempotent
+from routes import records
+from routes.records import CONTENT_COLUMNS, STORAGE_COLUMNS
 
 load_dotenv()
 
@@ -31,7 +39,7 @@ def _get_conn():
         cur.execute("SET SESSION MAX_EXECUTION_TIME=15000")
     finally:
         cur.close()
-    return conn
+    return trace_connection(conn)
 
 
 KIND_TO_TABLE = {
@@ -41,88 +49,144 @@ KIND_TO_TABLE = {
     "symptoms": "symptom_files",
 }
 
-def _analyze_data_type(content: dict) -> str:
+# exportInfo.dataType -> kind
+DATA_TYPE_TO_KIND = {
+    "health_metrics": "metrics",
+    "diet_record": "diet",
+    "case_record": "case",
+    "symptom_tracking": "symptoms",
+}
+
+# 结构特征：出现即可判定类型的键（小写）
+SIGNATURE_KEYS = {
+    "metricsdata": "metrics",
+    "dietdata": "diet",
+    "casedata": "case",
+    "symptomdata": "symptoms",
+}
+
+# 关键词评分（按类型顺序，得分相同时靠前者优先）
+TYPE_KEYWORDS = {
+    # 健康指标特征关键词
+    "metrics": [
+        'symptoms', 'temperature', 'urinalysis', 'blood-test',
+        'bleeding-point', 'self-rating', 'proteinuria', 'urinalysis-matrix',
+        '症状', '体温', '尿常规', '血常规', '出血点', '自我评分'
+    ],
+    # 饮食记录特征关键词
+    "diet": [
+        'meal', 'food', 'time', 'breakfast', 'lunch', 'dinner',
+        '餐', '食物', '时间', '早餐', '午餐', '晚餐'
+    ],
+    # 病例记录特征关键词
+    "case": [
+        'diagnosis', 'treatment', 'medication', 'doctor', 'hospital',
+        '诊断', '治疗', '药物', '医生', '医院'
+    ],
+    # 症状跟踪特征关键词
+    "symptoms": [
+        'symptom_tracking', 'symptomdata', 'skin-type', 'joint-type',
+        'abdominal-type', 'renal-type', '症状跟踪', '症状代码'
+    ],
+}
+
+# 每个关键词单独成组，命中集合即各类型命中的不同关键词
+_TYPE_MATCHER = KeywordMatcher({
+    keyword: [(kind, keyword) for kind, words in TYPE_KEYWORDS.items() if keyword in words]
+    for words in TYPE_KEYWORDS.values() for keyword in words
+})
+
+# 单个字符串最多扫描的字符数；data: URI（内嵌图片）直接跳过
+MAX_SCAN_CHARS = 4096
+
+MAX_RECORD_BYTES = 2 * 1024 * 1024
+# /uploadjson/batch：单次最多记录数 / 总字节数，每条 INSERT 最多行数
+UPLOAD_BATCH_MAX_RECORDS = int(os.getenv("UPLOAD_BATCH_MAX_RECORDS", "100"))
+UPLOAD_BATCH_MAX_BYTES = int(os.getenv("UPLOAD_BATCH_MAX_BYTES", str(8 * 1024 * 1024)))
+_INSERT_CHUNK = 50
+
+# 幂等键 -> 记录ID：同一用户同一键总是得到同一个ID，重试时主键冲突，不会产生重复记录
+_IDEMPOTENCY_NAMESPACE = uuid.uuid5(uuid.NAMESPACE_URL, "zdelf/uploadjson/batch")
+
+_tables_ready = set()
+
+
+def _classify_data_type(content: dict):
     """
-    自动分析数据类型并返回对应的表类型
-    根据数据内容特征判断是健康指标、饮食记录还是病例记录
+    自动分析数据类型，返回 (kind, confidence, signal)
+    - signal: dataType / structure / keywords / default
+    按以下顺序判定，命中即返回：
+    1. exportInfo.dataType
+    2. 顶层 *Data 键
+    3. 单次遍历整个结构：遇到嵌套的 *Data 键或 dataType 立即返回；否则对键名和字符串值做关键词评分
     """
     try:
         # 检查是否有exportInfo字段
-        export_info = content.get('exportInfo', {})
-        data_type = export_info.get('dataType', '')
-        
-        # 根据dataType字段判断
-        if data_type == 'health_metrics':
-            return 'metrics'
-        elif data_type == 'diet_record':
-            return 'diet'
-        elif data_type == 'case_record':
-            return 'case'
-        elif data_type == 'symptom_tracking':
-            return 'symptoms'
-        
+        export_info = content.get('exportInfo')
+        data_type = export_info.get('dataType') if isinstance(export_info, dict) else None
+        # dataType 来自客户端：列表 / 对象不可哈希，不能直接查表
+        kind = DATA_TYPE_TO_KIND.get(data_type) if isinstance(data_type, str) else None
+        if kind:
+            return kind, 1.0, "dataType"
+
         # 如果没有dataType字段，根据数据结构特征判断
-        if 'metricsData' in content:
-            return 'metrics'
-        elif 'dietData' in content:
-            return 'diet'
-        elif 'caseData' in content:
-            return 'case'
-        elif 'symptomData' in content:
-            return 'symptoms'
-        
-        # 根据数据内容特征进一步判断
-        content_str = json.dumps(content, ensure_ascii=False).lower()
-        
-        # 健康指标特征关键词
-        metrics_keywords = [
-            'symptoms', 'temperature', 'urinalysis', 'blood-test',
-            'bleeding-point', 'self-rating', 'proteinuria', 'urinalysis-matrix',
-            '症状', '体温', '尿常规', '血常规', '出血点', '自我评分'
-        ]
-        
-        # 饮食记录特征关键词
-        diet_keywords = [
-            'meal', 'food', 'time', 'breakfast', 'lunch', 'dinner',
-            '餐', '食物', '时间', '早餐', '午餐', '晚餐'
-        ]
-        
-        # 病例记录特征关键词
-        case_keywords = [
-            'diagnosis', 'treatment', 'medication', 'doctor', 'hospital',
-            '诊断', '治疗', '药物', '医生', '医院'
-        ]
-        
-        # 症状跟踪特征关键词
-        symptom_keywords = [
-            'symptom_tracking', 'symptomdata', 'skin-type', 'joint-type', 
-            'abdominal-type', 'renal-type', '症状跟踪', '症状代码'
-        ]
-        
-        # 计算匹配度
-        metrics_score = sum(1 for keyword in metrics_keywords if keyword in content_str)
-        diet_score = sum(1 for keyword in diet_keywords if keyword in content_str)
-        case_score = sum(1 for keyword in case_keywords if keyword in content_str)
-        symptom_score = sum(1 for keyword in symptom_keywords if keyword in content_str)
-        
-        # 返回得分最高的类型
-        scores = [
-            ('metrics', metrics_score),
-            ('diet', diet_score),
-            ('case', case_score),
-            ('symptoms', symptom_score)
-        ]
-        
-        # 找到得分最高的类型
-        best_type = max(scores, key=lambda x: x[1])
-        return best_type[0] if best_type[1] > 0 else 'metrics'
-            
+        for key, kind in (("metricsData", "metrics"), ("dietData", "diet"), ("caseData", "case"), ("symptomData", "symptoms")):
+            if key in content:
+                return kind, 0.95, "structure"
+
+        # 根据数据内容特征进一步判断（不重新序列化，逐个键/值扫描）
+        hits = set()
+        stack = [content]
+        while stack:
+            node = stack.pop()
+            if isinstance(node, dict):
+                for key, value in node.items():
+                    key_lower = str(key).lower()
+                    kind = SIGNATURE_KEYS.get(key_lower)
+                    if kind:
+                        return kind, 0.9, "structure"
+                    if key_lower == "datatype" and isinstance(value, str) and value in DATA_TYPE_TO_KIND:
+                        return DATA_TYPE_TO_KIND[value], 0.9, "structure"
+                    _TYPE_MATCHER.scan(key_lower, hits)
+                    if isinstance(value, (dict, list)):
+                        stack.append(value)
+                    elif isinstance(value, str):
+                        if not value.startswith("data:"):
+                            _TYPE_MATCHER.scan(value[:MAX_SCAN_CHARS].lower(), hits)
+            elif isinstance(node, list):
+                for value in node:
+                    if isinstance(value, (dict, list)):
+                        stack.append(value)
+                    elif isinstance(value, str) and not value.startswith("data:"):
+                        _TYPE_MATCHER.scan(value[:MAX_SCAN_CHARS].lower(), hits)
+
+        # 计算匹配度，返回得分最高的类型
+        scores = {kind: 0 for kind in TYPE_KEYWORDS}
+        for kind, _ in hits:
+            scores[kind] += 1
+        best_kind = max(scores, key=lambda k: scores[k])
+        best = scores[best_kind]
+        if best <= 0:
+            return 'metrics', 0.0, "default"
+        # 关键词评分只是启发式判断，置信度上限 0.8，按得分占比折算
+        return best_kind, round(0.8 * best / sum(scores.values()), 2), "keywords"
+
     except Exception as e:
         logger.warning(f"分析数据类型失败: {e}")
-        return 'metrics'  # 默认返回健康指标
+        return 'metrics', 0.0, "default"  # 默认返回健康指标
+
+
+def _analyze_data_type(content: dict) -> str:
+    """
+    自动分析数据类型并返回对应的表类型
+    根据数据内容特征判断是健康指标、饮食记录还是病例记录
+    """
+    return _classify_data_type(content)[0]
 
 
 def _ensure_table(conn, table_name: str) -> None:
+    if table_name in _tables_ready:
+        return
     ddl = f"""
     CREATE TABLE IF NOT EXISTS {table_name} (
         id VARCHAR(64) PRIMARY KEY,
@@ -130,6 +194,9 @@ def _ensure_table(conn, table_name: str) -> None:
         username VARCHAR(128) NULL,
         file_name VARCHAR(255) NOT NULL,
         content LONGTEXT NOT NULL,
+        content_codec TINYINT NOT NULL DEFAULT 0,
+        content_blob LONGBLOB NULL,
+        summary VARCHAR(1024) NULL,
         created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
         INDEX idx_user_id (user_id),
         INDEX idx_username (username),
@@ -139,7 +206,9 @@ def _ensure_table(conn, table_name: str) -> None:
     cur = conn.cursor()
     try:
         cur.execute(ddl)
+        records.ensure_columns(conn, table_name)
         conn.commit()
+        _tables_ready.add(table_name)
     finally:
         try:
             cur.close()
@@ -166,6 +235,7 @@ def _safe_json_dumps(obj) -> str:
 
 
 @uploadjson_blueprint.route("/uploadjson/auto", methods=["POST", "OPTIONS"])  # 自动分析数据类型
+@idempotent
 def upload_json_auto():
     """自动分析数据类型并存储到相应表"""
     if request.method == "OPTIONS":
@@ -173,7 +243,7 @@ def upload_json_auto():
 
     try:
         data = request.get_json(silent=True) or {}
-        logger.info("/uploadjson/auto body=%s", (str(data)[:800] + "...") if len(str(data)) > 800 else data)
+        logger.info("/uploadjson/auto body_keys=%s", list(data.keys()) if isinstance(data, dict) else None)
 
         user_id = (data.get("user_id") or "").strip() or None
         username = (data.get("username") or "").strip() or None
@@ -193,8 +263,8 @@ def upload_json_auto():
             content_dict = content
 
         # 自动分析数据类型
-        detected_kind = _analyze_data_type(content_dict)
-        logger.info(f"自动检测到数据类型: {detected_kind}")
+        detected_kind, confidence, signal = _classify_data_type(content_dict)
+        logger.info(f"自动检测到数据类型: {detected_kind} confidence={confidence} signal={signal}")
 
         # 生成文件名
         if custom_file_name:
@@ -213,13 +283,17 @@ def upload_json_auto():
         conn = _get_conn()
         try:
             _ensure_table(conn, table_name)
+            ensure_sync_tables(conn)
             cur = conn.cursor()
             try:
                 content_json = json.dumps(content_dict, ensure_ascii=False, separators=(",", ":"))
                 cur.execute(
-                    f"INSERT INTO {table_name} (id, user_id, username, file_name, content) VALUES (%s, %s, %s, %s, %s)",
-                    (file_id, user_id, username, file_name, content_json),
+                    f"INSERT INTO {table_name} (id, user_id, username, file_name, {STORAGE_COLUMNS}) "
+                    "VALUES (%s, %s, %s, %s, %s, %s, %s, %s)",
+                    (file_id, user_id, username, file_name)
+                    + records.storage_values(detected_kind, content_json, content_dict),
                 )
+                record_change(conn, user_id, username, detected_kind, file_id)
                 conn.commit()
                 logger.info(f"数据已存储到表 {table_name}, ID: {file_id}")
             finally:
@@ -233,6 +307,8 @@ def upload_json_auto():
             "data": {
                 "file_id": file_id,
                 "detected_type": detected_kind,
+                "confidence": confidence,
+                "detection_signal": signal,
                 "table_name": table_name,
                 "file_name": file_name
             }
@@ -244,6 +320,7 @@ def upload_json_auto():
 
 
 @uploadjson_blueprint.route("/uploadjson/<kind>", methods=["POST", "OPTIONS"])  # kind: metrics|diet|case
+@idempotent
 def upload_json(kind):
     if request.method == "OPTIONS":
         return "", 200
@@ -254,7 +331,7 @@ def upload_json(kind):
             return jsonify({"success": False, "message": "非法的类型（仅支持 metrics/diet/case）"}), 400
 
         data = request.get_json(silent=True) or {}
-        logger.info("/uploadjson/%s body=%s", kind, (str(data)[:800] + "...") if len(str(data)) > 800 else data)
+        logger.info("/uploadjson/%s body_keys=%s", kind, list(data.keys()) if isinstance(data, dict) else None)
 
         user_id = (data.get("user_id") or "").strip() or None
         username = (data.get("username") or "").strip() or None
@@ -265,7 +342,7 @@ def upload_json(kind):
             return jsonify({"success": False, "message": "缺少 payload(JSON)"}), 400
 
         payload_text = _safe_json_dumps(payload)
-        if len(payload_text.encode("utf-8")) > 2 * 1024 * 1024:
+        if len(payload_text.encode("utf-8")) > MAX_RECORD_BYTES:
             return jsonify({"success": False, "message": "JSON 体积过大（>2MB）"}), 413
 
         table_name = KIND_TO_TABLE[kind]
@@ -273,14 +350,18 @@ def upload_json(kind):
         conn = _get_conn()
         try:
             _ensure_table(conn, table_name)
+            ensure_sync_tables(conn)
 
             rec_id = uuid.uuid4().hex
             file_name = custom_file_name or _generate_file_name(username, user_id, kind)
 
             cur = conn.cursor()
             try:
-                sql = f"INSERT INTO {table_name} (id, user_id, username, file_name, content) VALUES (%s, %s, %s, %s, %s)"
-                cur.execute(sql, (rec_id, user_id, username, file_name, payload_text))
+                sql = (f"INSERT INTO {table_name} (id, user_id, username, file_name, {STORAGE_COLUMNS}) "
+                       "VALUES (%s, %s, %s, %s, %s, %s, %s, %s)")
+                cur.execute(sql, (rec_id, user_id, username, file_name)
+                            + records.storage_values(kind, payload_text, payload))
+                record_change(conn, user_id, username, kind, rec_id)
                 conn.commit()
             finally:
                 try:
@@ -303,7 +384,212 @@ def upload_json(kind):
         return jsonify({"success": False, "message": "服务器错误", "error": str(e)}), 500
 
 
+def _prepare_batch_record(index, item, user_id, username):
+    """校验并分类批量中的一条记录，返回 (record, None) 或 (None, 该条的错误结果)"""
+    def fail(status, message):
+        return None, {"index": index, "success": False, "status": status, "message": message}
+
+    if not isinstance(item, dict):
+        return fail(400, "记录格式错误")
+    payload = item.get("payload", item.get("content"))
+    if payload is None:
+        return fail(400, "缺少 payload(JSON)")
+
+    raw_kind = str(item.get("kind") or "auto").strip().lower()
+    detection = None
+    if raw_kind == "auto":
+        if isinstance(payload, str):
+            try:
+                payload = json.loads(payload)
+            except json.JSONDecodeError:
+                return fail(400, "payload 不是有效的JSON格式")
+        if not isinstance(payload, dict):
+            return fail(400, "自动识别类型需要 JSON 对象")
+        kind, confidence, signal = _classify_data_type(payload)
+        detection = {"detected_type": kind, "confidence": confidence, "detection_signal": signal}
+    else:
+        kind = _parse_kind(raw_kind)
+        if not kind:
+            return fail(400, "非法的类型（仅支持 metrics/diet/case/symptoms/auto）")
+
+    content = _safe_json_dumps(payload)
+    size = len(content.encode("utf-8"))
+    if size > MAX_RECORD_BYTES:
+        return fail(413, "JSON 体积过大（>2MB）")
+
+    key = str(item.get("idempotency_key") or "").strip()
+    if key:
+        rec_id = uuid.uuid5(_IDEMPOTENCY_NAMESPACE, f"{owner_key(user_id, username)}|{key}").hex
+    else:
+        rec_id = uuid.uuid4().hex
+    return {
+        "index": index,
+        "kind": kind,
+        "id": rec_id,
+        "keyed": bool(key),
+        "file_name": str(item.get("file_name") or "").strip() or _generate_file_name(username, user_id, kind),
+        "storage": records.storage_values(kind, content, payload if isinstance(payload, dict) else None),
+        "bytes": size,
+        "detection": detection,
+        "duplicate": False,
+    }, None
+
+
+def _insert_batch_rows(cur, table_name, chunk, user_id, username):
+    """
+    一条多行 INSERT 写入 chunk，返回主键已存在（此前或并发的重试已写入）的记录。
+    不用 INSERT IGNORE：截断 / 非法值仍应让请求失败。主键冲突时 MySQL 只回滚这一条语句，
+    于是逐行重试，找出冲突的是哪几条
+    """
+    insert = f"INSERT INTO {table_name} (id, user_id, username, file_name, {STORAGE_COLUMNS}) VALUES "
+    row_sql = "(%s, %s, %s, %s, %s, %s, %s, %s)"
+    rows = [(r["id"], user_id, username, r["file_name"]) + r["storage"] for r in chunk]
+    try:
+        cur.execute(insert + ", ".join([row_sql] * len(rows)), [v for row in rows for v in row])
+        return []
+    except mysql_errors.IntegrityError as e:
+        if getattr(e, 'errno', None) != 1062:
+            raise
+    duplicates = []
+    for r, row in zip(chunk, rows):
+        try:
+            cur.execute(insert + row_sql, row)
+        except mysql_errors.IntegrityError as e:
+            if getattr(e, 'errno', None) != 1062:
+                raise
+            duplicates.append(r)
+    return duplicates
+
+
+@uploadjson_blueprint.route("/uploadjson/batch", methods=["POST", "OPTIONS"])  # 批量上传（离线积攒的记录）
+@idempotent
+def upload_json_batch():
+    """
+    一次上传多条、可混合类型的记录：{records: [{kind?, payload, file_name?, idempotency_key?}, ...]}
+    - kind 省略或为 auto 时按内容自动识别；每条单独校验，不合格的在 results 中返回错误，其余照常写入
+    - 每张表一条多行 INSERT，全部记录与同步日志在同一事务中提交
+    - 带 idempotency_key 的记录 ID 由 (用户, 键) 决定，重试时已写入的记录（主键冲突）返回 duplicate 而不会重复，
+      并发重试也一样；只有真正插入的记录写同步日志
+    """
+    if request.method == "OPTIONS":
+        return "", 200
+
+    try:
+        data = request.get_json(silent=True) or {}
+        if not isinstance(data, dict):
+            return jsonify({"success": False, "message": "请求体格式错误"}), 400
+        try:
+            user_id, username = resolve_identity(data)
+        except AuthError as e:
+            return jsonify({"success": False, "message": e.message}), e.status
+        user_id = (user_id or "").strip() or None
+        username = (username or "").strip() or None
+        if not user_id and not username:
+            return jsonify({"success": False, "message": "缺少用户标识（user_id 或 username）"}), 400
+
+        items = data.get("records")
+        if not isinstance(items, list) or not items:
+            return jsonify({"success": False, "message": "缺少 records 数组"}), 400
+        if len(items) > UPLOAD_BATCH_MAX_RECORDS:
+            return jsonify({"success": False, "message": f"单次最多上传 {UPLOAD_BATCH_MAX_RECORDS} 条记录"}), 413
+        logger.info("/uploadjson/batch records=%d", len(items))
+
+        results = [None] * len(items)
+        prepared = []
+        total_bytes = 0
+        for index, item in enumerate(items):
+            record, error = _prepare_batch_record(index, item, user_id, username)
+            if error:
+                results[index] = error
+                continue
+            total_bytes += record["bytes"]
+            if total_bytes > UPLOAD_BATCH_MAX_BYTES:
+                return jsonify({"success": False, "message": "批量数据体积过大，请分批上传"}), 413
+            prepared.append(record)
+
+        if prepared:
+            by_table = {}
+            for record in prepared:
+                by_table.setdefault(KIND_TO_TABLE[record["kind"]], []).append(record)
+
+            conn = _get_conn()
+            try:
+                for table_name in by_table:
+                    _ensure_table(conn, table_name)
+                ensure_sync_tables(conn)
+                cur = conn.cursor()
+                try:
+                    for table_name, rows in by_table.items():
+                        seen = {}
+                        fresh = []
+                        for r in rows:
+                            if r["id"] in seen:  # same key twice in one request
+                                r["duplicate"] = True
+                                r["file_name"] = seen[r["id"]]
+                            else:
+                                seen[r["id"]] = r["file_name"]
+                                fresh.append(r)
+                        duplicates = []
+                        for i in range(0, len(fresh), _INSERT_CHUNK):
+                            duplicates.extend(_insert_batch_rows(cur, table_name, fresh[i:i + _INSERT_CHUNK],
+                                                                 user_id, username))
+                        if duplicates:
+                            # locking read: sees rows committed by a concurrent retry after this transaction began
+                            cur.execute(
+                                f"SELECT id, file_name FROM {table_name} WHERE id IN ({', '.join(['%s'] * len(duplicates))}) "
+                                "LOCK IN SHARE MODE",
+                                tuple(r["id"] for r in duplicates),
+                            )
+                            stored_names = {row[0]: row[1] for row in cur.fetchall()}
+                            for r in duplicates:
+                                r["duplicate"] = True
+                            for r in rows:
+                                if r["duplicate"]:
+                                    r["file_name"] = stored_names.get(r["id"], r["file_name"])
+                    record_changes(conn, user_id, username,
+                                   [(r["kind"], r["id"], OP_UPSERT) for r in prepared if not r["duplicate"]])
+                    conn.commit()
+                finally:
+                    try:
+                        cur.close()
+                    except Exception:
+                        pass
+            finally:
+                try:
+                    conn.close()
+                except Exception:
+                    pass
+
+        for r in prepared:
+            result = {"index": r["index"], "success": True, "id": r["id"], "kind": r["kind"],
+                      "file_name": r["file_name"], "duplicate": r["duplicate"]}
+            if r["detection"]:
+                result.update(r["detection"])
+            results[r["index"]] = result
+
+        stored = sum(1 for r in prepared if not r["duplicate"])
+        return jsonify({
+            "success": True,
+            "message": "批量上传完成",
+            "stored": stored,
+            "duplicates": len(prepared) - stored,
+            "failed": len(items) - len(prepared),
+            "results": results,
+        })
+
+    except mysql_errors.Error as e:
+        if getattr(e, 'errno', None) in (3024, 1205, 1213):
+            logger.warning("/uploadjson/batch db timeout/deadlock errno=%s msg=%s", getattr(e, 'errno', None), str(e))
+            return jsonify({"success": False, "message": "数据库超时或死锁，请稍后重试"}), 504
+        logger.exception("/uploadjson/batch db error: %s", e)
+        return jsonify({"success": False, "message": "数据库错误", "error": str(e)}), 500
+    except Exception as e:
+        logger.exception("/uploadjson/batch server error: %s", e)
+        return jsonify({"success": False, "message": "服务器错误", "error": str(e)}), 500
+
+
 @uploadjson_blueprint.route("/uploadjson/<kind>/list", methods=["GET", "OPTIONS"])  # 按用户列出
+@conditional(list_version)
 def list_user_files(kind):
     if request.method == "OPTIONS":
         return "", 200
@@ -373,10 +659,12 @@ def get_file(kind, file_id):
             cur = conn.cursor(dictionary=True)
             try:
                 cur.execute(
-                    f"SELECT id, user_id, username, file_name, content, created_at FROM {table_name} WHERE id=%s LIMIT 1",
+                    f"SELECT id, user_id, username, file_name, {CONTENT_COLUMNS}, created_at FROM {table_name} WHERE id=%s LIMIT 1",
                     (file_id,),
                 )
                 row = cur.fetchone()
+                if row:
+                    records.decode_row(row)
             finally:
                 try:
                     cur.close()
@@ -406,3 +694,60 @@ def get_file(kind, file_id):
         return jsonify({"success": False, "message": "服务器错误", "error": str(e)}), 500
 
 
+@uploadjson_blueprint.route("/uploadjson/<kind>/<file_id>", methods=["DELETE"])  # 删除单条（同步时下发墓碑）
+def delete_file(kind, file_id):
+    try:
+        kind = _parse_kind(kind)
+        if not kind:
+            return jsonify({"success": False, "message": "非法的类型（仅支持 metrics/diet/case）"}), 400
+
+        try:
+            resolve_identity(request.get_json(silent=True) or request.args)
+        except AuthError as e:
+            return jsonify({"success": False, "message": e.message}), e.status
+        # 删除会作为墓碑下发到用户的所有设备：只认会话令牌，不接受请求体 / 查询串里的身份
+        identity = g.get("identity")
+        if identity is None:
+            logger.warning("/uploadjson delete without session token kind=%s id=%s", kind, file_id)
+            return jsonify({"success": False, "message": "请先登录"}), 401
+        user_id, username = identity["user_id"], identity.get("username")
+
+        table_name = KIND_TO_TABLE[kind]
+        conn = _get_conn()
+        try:
+            _ensure_table(conn, table_name)
+            ensure_sync_tables(conn)
+            cur = conn.cursor()
+            try:
+                cur.execute(
+                    f"DELETE FROM {table_name} WHERE id=%s AND user_id=%s",
+                    (file_id, user_id),
+                )
+                deleted = cur.rowcount
+                if deleted:
+                    record_change(conn, user_id, username, kind, file_id, OP_DELETE)
+                conn.commit()
+            finally:
+                try:
+                    cur.close()
+                except Exception:
+                    pass
+        finally:
+            try:
+                conn.close()
+            except Exception:
+                pass
+
+        if not deleted:
+            return jsonify({"success": False, "message": "未找到记录"}), 404
+        return jsonify({"success": True, "message": "删除成功", "id": file_id, "kind": kind})
+
+    except mysql_errors.Error as e:
+        if getattr(e, 'errno', None) in (3024, 1205, 1213):
+            logger.warning("/uploadjson delete db timeout/deadlock errno=%s msg=%s", getattr(e, 'errno', None), str(e))
+            return jsonify({"success": False, "message": "数据库超时或死锁，请稍后重试"}), 504
+        logger.exception("/uploadjson delete db error: %s", e)
+        return jsonify({"success": False, "message": "数据库错误", "error": str(e)}), 500
+    except Exception as e:
+        logger.exception("/uploadjson delete server error: %s", e)
+        return jsonify({"success": False, "message": "服务器错误", "error": str(e)}), 500
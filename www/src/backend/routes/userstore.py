@@ -0,0 +1,77 @@
+"""
+users table: column projections and schema upkeep shared by the account routes
+- PROFILE_COLUMNS / LISTING_COLUMNS / AUTH_COLUMNS / AVATAR_COLUMNS are the only column lists routes
+  should select; the password column only ever appears in AUTH_COLUMNS (login), never in a response,
+  and multi-user listings use LISTING_COLUMNS (no phone_number or age)
+- ensure_users_schema() runs once per process: adds avatar_url, widens password for hashes and
+  creates covering indexes so login (username -> user_id, password) and phone lookups
+  (phone_number -> user_id, username) are answered from the index alone
+"""
+import logging
+
+from mysql.connector import errors as mysql_errors
+
+from routes.credentials import ensure_password_column
+
+logger = logging.getLogger("app.userstore")
+
+PROFILE_COLUMNS = "user_id, username, age, phone_number, avatar_url"
+LISTING_COLUMNS = "user_id, username, avatar_url"
+AUTH_COLUMNS = "user_id, username, password"
+AVATAR_COLUMNS = "user_id, avatar_url"
+
+# Paging for unfiltered listings
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 100
+
+_USERS_COLUMNS = (
+    "ALTER TABLE users ADD COLUMN avatar_url VARCHAR(500) NULL",
+    # last Square "related" comment the user has seen (watermark for /square/related/unread_count)
+    "ALTER TABLE users ADD COLUMN square_related_seen_at TIMESTAMP NULL",
+)
+_USERS_INDEXES = (
+    # InnoDB secondary indexes carry the primary key (user_id), so these cover the lookups
+    "ALTER TABLE users ADD INDEX idx_users_username_auth (username, password)",
+    "ALTER TABLE users ADD INDEX idx_users_phone_username (phone_number, username)",
+)
+
+_schema_ready = False
+
+
+def ensure_users_schema(conn):
+    """Apply users-table migrations on `conn` once per process (duplicate column/index errors are ignored)."""
+    global _schema_ready
+    if _schema_ready:
+        return
+    cur = conn.cursor()
+    try:
+        for stmt in _USERS_COLUMNS:
+            _apply(cur, stmt)
+        # Widen password before indexing it
+        ensure_password_column(conn)
+        for stmt in _USERS_INDEXES:
+            _apply(cur, stmt)
+        _schema_ready = True
+    finally:
+        try:
+            cur.close()
+        except Exception:
+            pass
+
+
+def _apply(cur, stmt):
+    try:
+        cur.execute(stmt)
+        logger.info("users schema: %s", stmt)
+    except mysql_errors.Error as e:
+        # 1060 duplicate column / 1061 duplicate key name: already migrated
+        if getattr(e, 'errno', None) not in (1060, 1061):
+            raise
+
+
+def page_size(value) -> int:
+    try:
+        size = int(value)
+    except (TypeError, ValueError):
+        return DEFAULT_PAGE_SIZE
+    return max(1, min(MAX_PAGE_SIZE, size))
@@ -0,0 +1,269 @@
+"""
+Write-behind journal: acknowledge inserts once they are on local disk, write them to MySQL in batches
+- append() adds one JSON line to this process's active segment
+  (<WRITE_BEHIND_DIR>/<name>-<pid>-<token>.jsonl) and returns once it is fsynced
+  (WRITE_BEHIND_FSYNC); concurrent appends share one fsync, so a burst costs one disk flush
+  rather than one InnoDB commit per request
+- a flusher thread per process rotates the active segment every WRITE_BEHIND_INTERVAL seconds
+  (sooner once WRITE_BEHIND_BATCH entries are waiting) and hands its entries, oldest first, to
+  the owner's flush(entries). A segment is deleted only after flush() returns, so flush() must
+  be idempotent (INSERT IGNORE on ids generated at append time): a crash between commit and
+  delete replays rows that are already there
+- segments are claimed by renaming them to *.<pid>.claimed. On start and every
+  _ORPHAN_SCAN_EVERY seconds the flusher also claims segments of processes that are gone
+  (worker restart or crash) and replays them, so nothing acknowledged is lost
+- a failed flush keeps its segment and is retried with backoff; stats() reports the counters
+- threads are started lazily and restarted after fork, like sms_queue
+"""
+import os
+import json
+import time
+import uuid
+import atexit
+import logging
+import threading
+
+logger = logging.getLogger("app.write_behind")
+
+_OFF = {"0", "false", "no", "off"}
+
+WRITE_BEHIND_DIR = os.getenv("WRITE_BEHIND_DIR") or os.path.join(os.path.dirname(__file__), "../../../journal")
+WRITE_BEHIND_INTERVAL = float(os.getenv("WRITE_BEHIND_INTERVAL", "0.2"))
+WRITE_BEHIND_BATCH = int(os.getenv("WRITE_BEHIND_BATCH", "500"))
+WRITE_BEHIND_FSYNC = os.getenv("WRITE_BEHIND_FSYNC", "1").strip().lower() not in _OFF
+
+_ORPHAN_SCAN_EVERY = 60
+_MAX_BACKOFF = 30
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class WriteBehindJournal:
+    def __init__(self, name: str, flush, directory: str = WRITE_BEHIND_DIR):
+        # flush(entries) writes a list of appended dicts to the database and raises on failure
+        self.name = name
+        self.directory = os.path.abspath(directory)
+        self._flush = flush
+        self._lock = threading.Lock()       # active segment and counters
+        self._sync_lock = threading.Lock()  # one fsync at a time; rotation holds it too
+        self._flush_lock = threading.Lock()  # flusher thread vs stop() at exit
+        self._wake = threading.Event()
+        self._pid = None
+        self._token = None
+        self._file = None
+        self._path = None
+        self._pending = 0
+        self._written = 0
+        self._synced = 0
+        self._claimed = []
+        self.appended = 0
+        self.flushed = 0
+        self.batches = 0
+        self.failures = 0
+        self.replayed_segments = 0
+        self.last_flush = None
+        self.last_error = None
+        atexit.register(self.stop)
+
+    # ---- lifecycle ----
+
+    def start(self):
+        self._ensure_started()
+
+    def _ensure_started(self):
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            # First use in this process (or after fork): the parent's open segment stays the parent's
+            os.makedirs(self.directory, exist_ok=True)
+            self._token = uuid.uuid4().hex[:8]
+            self._file = self._path = None
+            self._pending = self._written = self._synced = 0
+            self._claimed = []
+            self._wake = threading.Event()
+            self._pid = os.getpid()
+            threading.Thread(target=self._run, name=f"write-behind-{self.name}", daemon=True).start()
+
+    def stop(self):
+        """Flush what this process has appended (best effort, e.g. on worker shutdown)."""
+        if self._pid != os.getpid():
+            return
+        try:
+            self._rotate()
+            self._flush_claimed()
+        except Exception as e:
+            logger.warning("write-behind %s: flush at exit failed, segment kept for replay: %s", self.name, e)
+
+    # ---- append path ----
+
+    def append(self, entry: dict):
+        """Durably journal one entry; once this returns the entry will reach flush()."""
+        self._ensure_started()
+        line = (json.dumps(entry, ensure_ascii=False, separators=(",", ":")) + "\n").encode("utf-8")
+        with self._lock:
+            if self._file is None:
+                self._path = os.path.join(self.directory, f"{self.name}-{self._pid}-{self._token}.jsonl")
+                self._file = open(self._path, "ab")
+            self._file.write(line)
+            self._file.flush()
+            self._written += 1
+            ticket = self._written
+            self._pending += 1
+            self.appended += 1
+            if self._pending >= WRITE_BEHIND_BATCH:
+                self._wake.set()
+        if WRITE_BEHIND_FSYNC:
+            self._sync(ticket)
+
+    def _sync(self, ticket: int):
+        with self._sync_lock:
+            if self._synced >= ticket:
+                return  # another thread's fsync (or a rotation) already covered this line
+            with self._lock:
+                target = self._written
+                f = self._file
+            if f is not None:
+                os.fsync(f.fileno())
+            self._synced = max(self._synced, target)
+
+    # ---- flusher ----
+
+    def _rotate(self):
+        """Close the active segment and claim it for flushing."""
+        with self._sync_lock, self._lock:
+            if self._file is None or self._pending == 0:
+                return
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._file.close()
+            claimed = f"{self._path}.{self._pid}.claimed"
+            os.rename(self._path, claimed)
+            self._claimed.append(claimed)
+            self._file = self._path = None
+            self._pending = 0
+            self._synced = self._written
+
+    def _claim_orphans(self):
+        prefix = f"{self.name}-"
+        mine = f"{self.name}-{self._pid}-{self._token}.jsonl"
+        found = []
+        for fname in sorted(os.listdir(self.directory), key=self._mtime):
+            if not fname.startswith(prefix) or fname.startswith(mine):
+                continue
+            parts = fname.split(".")
+            try:
+                if fname.endswith(".jsonl"):
+                    owner = int(fname[len(prefix):].split("-")[0])
+                    # same pid but another token: a previous process that had this pid
+                    orphaned = owner == self._pid or not _pid_alive(owner)
+                elif fname.endswith(".claimed") and len(parts) >= 4:
+                    claimer = int(parts[-2])
+                    orphaned = claimer == self._pid or not _pid_alive(claimer)
+                else:
+                    continue
+            except ValueError:
+                continue
+            if orphaned:
+                claimed = self._claim(fname)
+                if claimed:
+                    found.append(claimed)
+        if found:
+            with self._lock:
+                # older than anything this process appended: flush them first, oldest first
+                self._claimed[:0] = [p for p in found if p not in self._claimed]
+
+    def _mtime(self, fname):
+        try:
+            return os.path.getmtime(os.path.join(self.directory, fname))
+        except OSError:
+            return 0
+
+    def _claim(self, fname):
+        src = os.path.join(self.directory, fname)
+        base = fname.split(".jsonl")[0] + ".jsonl"
+        dst = os.path.join(self.directory, f"{base}.{self._pid}.claimed")
+        with self._lock:
+            if dst in self._claimed:
+                return None
+        try:
+            os.rename(src, dst)
+        except FileNotFoundError:
+            return None  # another worker claimed it first
+        logger.info("write-behind %s: replaying %s", self.name, fname)
+        self.replayed_segments += 1
+        return dst
+
+    def _flush_claimed(self):
+        with self._flush_lock:
+            self._flush_claimed_locked()
+
+    def _flush_claimed_locked(self):
+        while True:
+            with self._lock:
+                if not self._claimed:
+                    return
+                path = self._claimed[0]
+            entries = []
+            with open(path, "rb") as f:
+                for raw in f:
+                    try:
+                        entries.append(json.loads(raw))
+                    except ValueError:
+                        # a torn last line was never acknowledged (append returns after the fsync)
+                        logger.warning("write-behind %s: skipping unreadable line in %s", self.name, path)
+            if entries:
+                self._flush(entries)
+            os.remove(path)
+            with self._lock:
+                self._claimed.pop(0)
+                self.flushed += len(entries)
+                self.batches += 1
+                self.last_flush = time.time()
+
+    def _run(self):
+        pid = self._pid
+        wake = self._wake
+        last_scan = 0.0
+        failures = 0
+        while self._pid == pid:
+            wake.wait(WRITE_BEHIND_INTERVAL if not failures else min(_MAX_BACKOFF, WRITE_BEHIND_INTERVAL * 2 ** failures))
+            wake.clear()
+            try:
+                if time.monotonic() - last_scan > _ORPHAN_SCAN_EVERY:
+                    last_scan = time.monotonic()
+                    self._claim_orphans()
+                self._rotate()
+                self._flush_claimed()
+                failures = 0
+            except Exception as e:
+                failures += 1
+                self.failures += 1
+                self.last_error = str(e)
+                logger.warning("write-behind %s: flush failed (attempt %d), will retry: %s", self.name, failures, e)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "name": self.name,
+                "pid": os.getpid(),
+                "started": self._pid == os.getpid(),
+                "pending": self._pending,
+                "claimed_segments": len(self._claimed),
+                "appended": self.appended,
+                "flushed": self.flushed,
+                "batches": self.batches,
+                "failures": self.failures,
+                "replayed_segments": self.replayed_segments,
+                "last_flush": self.last_flush,
+                "last_error": self.last_error,
+            }
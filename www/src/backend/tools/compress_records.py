@@ -0,0 +1,148 @@
+"""
+Convert stored health records to the compressed layout of routes/records.py
+- walks each <kind>_files table in primary-key order, --batch rows at a time, and rewrites the rows
+  not yet in the target codec as blob + summary; rows already converted only get their summary
+  filled in, or rewritten if it is from an older SUMMARY_VERSION
+- each batch is one short transaction and every UPDATE re-checks the row's old codec, so it is safe
+  to run while the app is serving, and to interrupt and run again
+- --codec plain converts back to JSON text in content (e.g. before rolling back to a version that
+  cannot read blobs); --summaries-only leaves the content as stored; --dry-run only reports
+- InnoDB keeps the freed pages inside the tablespace; run OPTIMIZE TABLE afterwards to hand them back
+
+Usage (from src/backend):
+    python -m tools.compress_records --dry-run
+    python -m tools.compress_records --kinds diet,case --batch 200 --sleep 0.2
+    python -m tools.compress_records --summaries-only
+"""
+import os
+import sys
+import json
+import time
+import argparse
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if BACKEND_DIR not in sys.path:
+    sys.path.insert(0, BACKEND_DIR)
+
+from routes import records
+from routes.uploadjson import KIND_TO_TABLE, _get_conn, _ensure_table
+
+CODECS = {
+    "plain": records.CODEC_PLAIN,
+    "zlib": records.CODEC_ZLIB_V1,
+    "zstd": records.CODEC_ZSTD_V1,
+}
+
+
+def convert_table(conn, kind: str, codec, batch: int, sleep: float, dry_run: bool) -> dict:
+    """codec None: keep each row's codec and only fill / refresh summaries."""
+    table = KIND_TO_TABLE[kind]
+    _ensure_table(conn, table)
+    stats = {"kind": kind, "scanned": 0, "converted": 0, "summarized": 0, "failed": 0,
+             "bytes_before": 0, "bytes_after": 0}
+    last_id = ""
+    while True:
+        cur = conn.cursor()
+        try:
+            stale = "summary IS NULL OR summary NOT LIKE %s"
+            if codec is None:
+                cur.execute(
+                    f"SELECT id, content, content_codec, content_blob, summary FROM {table} "
+                    f"WHERE id > %s AND ({stale}) ORDER BY id LIMIT %s",
+                    (last_id, records.SUMMARY_PREFIX + "%", batch),
+                )
+            else:
+                cur.execute(
+                    f"SELECT id, content, content_codec, content_blob, summary FROM {table} "
+                    f"WHERE id > %s AND (content_codec <> %s OR {stale}) ORDER BY id LIMIT %s",
+                    (last_id, codec, records.SUMMARY_PREFIX + "%", batch),
+                )
+            rows = cur.fetchall()
+            if not rows:
+                conn.commit()
+                return stats
+            updates = []
+            for rec_id, content, old_codec, blob, summary in rows:
+                last_id = rec_id
+                stats["scanned"] += 1
+                try:
+                    text = records.decode(content, old_codec, blob)
+                except ValueError as e:
+                    stats["failed"] += 1
+                    print(f"  {table} {rec_id}: {e}")
+                    continue
+                if codec is not None and old_codec != codec:
+                    new_content, new_codec, new_blob = records.encode(text, codec)
+                else:
+                    new_content, new_codec, new_blob = content, old_codec, blob
+                if not records.summary_current(summary):
+                    try:
+                        parsed = json.loads(text)
+                    except ValueError:
+                        parsed = None
+                    summary = records.summarize(kind, parsed)
+                    stats["summarized"] += 1
+                elif new_codec == old_codec:
+                    continue  # would not shrink: stays plain
+                if new_codec != old_codec:
+                    stats["converted"] += 1
+                    stats["bytes_before"] += len(blob) if old_codec else len((content or "").encode("utf-8"))
+                    stats["bytes_after"] += len(new_blob) if new_codec else len(new_content.encode("utf-8"))
+                updates.append((new_content, new_codec, new_blob, summary, rec_id, old_codec))
+            if updates and not dry_run:
+                cur.executemany(
+                    f"UPDATE {table} SET content=%s, content_codec=%s, content_blob=%s, summary=%s "
+                    "WHERE id=%s AND content_codec=%s",
+                    updates,
+                )
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            cur.close()
+        if sleep:
+            time.sleep(sleep)
+
+
+def main(argv=None) -> int:
+    ap = argparse.ArgumentParser(description="Compress stored health records and fill their summaries")
+    ap.add_argument("--kinds", default=",".join(KIND_TO_TABLE), help="comma-separated kinds (default: all)")
+    ap.add_argument("--codec", choices=sorted(CODECS), default=None,
+                    help="target codec (default: what new uploads use, see RECORD_CODEC)")
+    ap.add_argument("--batch", type=int, default=500, help="rows per transaction")
+    ap.add_argument("--sleep", type=float, default=0.0, help="seconds to pause between batches")
+    ap.add_argument("--summaries-only", action="store_true", help="only fill / refresh summaries, keep the content as stored")
+    ap.add_argument("--dry-run", action="store_true", help="report sizes without writing")
+    args = ap.parse_args(argv)
+
+    kinds = [k.strip() for k in args.kinds.split(",") if k.strip()]
+    unknown = [k for k in kinds if k not in KIND_TO_TABLE]
+    if unknown:
+        ap.error(f"unknown kind(s): {', '.join(unknown)}")
+    if args.summaries_only and args.codec:
+        ap.error("--summaries-only and --codec are mutually exclusive")
+    codec = records.WRITE_CODEC if args.codec is None else CODECS[args.codec]
+    if args.summaries_only:
+        codec = None
+    if codec == records.CODEC_ZSTD_V1 and records.zstandard is None:
+        ap.error("--codec zstd needs the zstandard module")
+
+    conn = _get_conn()
+    try:
+        for kind in kinds:
+            s = convert_table(conn, kind, codec, max(1, args.batch), args.sleep, args.dry_run)
+            saved = s["bytes_before"] - s["bytes_after"]
+            print(f"{s['kind']:<9} scanned {s['scanned']:>7}  converted {s['converted']:>7}  "
+                  f"summarized {s['summarized']:>7}  failed {s['failed']:>4}  "
+                  f"{s['bytes_before'] / 1048576:9.2f} MiB -> {s['bytes_after'] / 1048576:9.2f} MiB "
+                  f"({saved / 1048576:+.2f} MiB saved)")
+    finally:
+        conn.close()
+    if args.dry_run:
+        print("dry run: nothing written")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1776,8 +1776,11 @@ function loadUserDataCardsForSearch() {
 
       console.log(`🔍 搜索获取到 ${baseItems.length} 条基础数据`);
 
-      // 预取每条记录的 exportInfo 以获得排序用的 recordTime
+      // 预取每条记录的 exportInfo 以获得排序用的 recordTime（列表摘要已带 preview.time 时不再取详情）
       const augmented = await Promise.all(baseItems.map(async (it) => {
+        if (it.preview && it.preview.time) {
+          return { ...it, sortTime: it.preview.time };
+        }
         try {
           const res = await fetch(`${__API_BASE__}/getjson/${it.dataType}/${it.id}`);
           const detail = await res.json();
@@ -1908,6 +1911,17 @@ function loadUserDataCards() {
 
         // 预取每条记录的 exportInfo 以获得排序用的 recordTime（回退 exportTime 或 created_at）
         const augmented = await Promise.all(baseItems.map(async (it) => {
+          // 列表摘要已带 preview.time（recordTime，缺失为 exportTime）：直接用它排序和按日期过滤，不再取详情
+          if (it.preview && it.preview.time) {
+            if (selectedDate && it.dataType !== 'diet') {
+              const recordDate = getDateYMD(it.preview.time);
+              const targetDate = getDateYMD(String(selectedDate));
+              if (recordDate && targetDate && recordDate !== targetDate) {
+                return null;
+              }
+            }
+            return { ...it, sortTime: it.preview.time };
+          }
           try {
             const res = await fetch(`${__API_BASE__}/getjson/${it.dataType}/${it.id}`);
             const detail = await res.json();
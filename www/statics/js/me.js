@@ -759,8 +759,8 @@
           if (user.avatar_url && !user.avatar_url.startsWith('http')) {
             user.avatar_url = apiBase + user.avatar_url;
           }
-          // 添加时间戳参数避免缓存
-          if (user.avatar_url) {
+          // 版本化头像（/avatars/<id>.<hash>.png）地址随内容变化，无需时间戳；旧地址仍加时间戳避免缓存
+          if (user.avatar_url && !/\/avatars\/[^/?]+\.[0-9a-f]{12}\.png/.test(user.avatar_url)) {
             const separator = user.avatar_url.includes('?') ? '&' : '?';
             user.avatar_url = user.avatar_url + separator + 't=' + Date.now();
             console.log("[me] 完整头像URL（带时间戳）:", user.avatar_url);
@@ -3019,8 +3019,8 @@
         if (user.avatar_url && !user.avatar_url.startsWith('http')) {
           user.avatar_url = apiBase + user.avatar_url;
         }
-        // 添加时间戳参数避免缓存
-        if (user.avatar_url) {
+        // 版本化头像（/avatars/<id>.<hash>.png）地址随内容变化，无需时间戳；旧地址仍加时间戳避免缓存
+        if (user.avatar_url && !/\/avatars\/[^/?]+\.[0-9a-f]{12}\.png/.test(user.avatar_url)) {
           const separator = user.avatar_url.includes('?') ? '&' : '?';
           user.avatar_url = user.avatar_url + separator + 't=' + Date.now();
           console.log("[me] 完整头像URL（带时间戳）:", user.avatar_url);
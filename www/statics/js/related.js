@@ -140,7 +140,8 @@
     const resp = await fetch(API_BASE + '/square/related', {
       method: 'POST',
       headers: { 'Content-Type': 'application/json' },
-      body: JSON.stringify({ current_user_id: user_id, limit: 500 })
+      // mark_seen：服务端把“已读水位”推进到本次返回的最新评论，角标由 /square/related/unread_count 计算
+      body: JSON.stringify({ current_user_id: user_id, limit: 500, mark_seen: true })
     });
     const json = await resp.json();
     if (!json.success) throw new Error(json.message || '加载失败');
@@ -153,29 +154,6 @@
         return tb - ta;
       }) : [];
     render(rows, user_id);
-    
-    // 保存最新查看时间到缓存
-    // 如果有数据，保存最新数据的时间戳
-    // 如果没有数据，保存当前时间，表示用户已查看（虽然没有更新）
-    try {
-      let timeToSave = null;
-      if (rows.length > 0 && rows[0].created_at) {
-        const latestTime = Date.parse(rows[0].created_at);
-        if (!isNaN(latestTime)) {
-          timeToSave = latestTime;
-        }
-      } else {
-        // 如果没有数据，保存当前时间，表示用户已查看
-        timeToSave = Date.now();
-      }
-      
-      if (timeToSave !== null) {
-        localStorage.setItem('related_last_view_time', String(timeToSave));
-        console.log('已保存 relate 页面最新查看时间:', new Date(timeToSave).toLocaleString());
-      }
-    } catch (err) {
-      console.error('保存 relate 查看时间失败:', err);
-    }
   }
 
   document.addEventListener('DOMContentLoaded', () => {
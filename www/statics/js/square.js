@@ -34,6 +34,9 @@ let allMessages = []; // 存储所有消息用于搜索
 let searchTimeout = null; // 搜索防抖定时器
 let isDetailView = false; // 是否在详情视图
 let currentDetailPostId = null; // 当前详情视图的帖子ID
+let squareStream = null; // /square/stream 实时更新连接（EventSource）
+let squareStreamLastId = ''; // 最后收到的事件序号，重连时补发其后的事件
+let squareStreamRetryTimer = null;
 
 /**
  * 初始化广场页面
@@ -81,6 +84,11 @@ function initSquare(shadowRoot) {
   
   // 加载消息列表
   loadMessages();
+
+  // 订阅实时更新：新帖、评论和删除直接合并进列表
+  squareStreamLastId = '';
+  openSquareStream();
+  cleanupFns.push(closeSquareStream);
   
   // 检查 relate 页面更新（延迟执行，确保 DOM 已准备好）
   // 使用 requestAnimationFrame + setTimeout 确保 DOM 已渲染
@@ -107,7 +115,10 @@ function initSquare(shadowRoot) {
     const visibilityHandler = () => {
       if (document.hidden) {
         lastHiddenTime = Date.now();
+        // 后台时释放连接（服务端每个连接占一个线程），回到前台后带上 last_event_id 补齐
+        closeSquareStream();
       } else if (isInitialized && lastHiddenTime > 0) {
+        openSquareStream();
         // 页面从隐藏变为可见，且之前确实隐藏过，可能是从其他页面返回
         const hiddenDuration = Date.now() - lastHiddenTime;
         // 如果隐藏时间超过 100ms，才认为是切换页面后返回
@@ -841,16 +852,22 @@ function performSearch(query) {
   }
   
   // 搜索消息内容和作者名称
-  const filteredMessages = allMessages.filter(message => {
-    const textMatch = message.text && message.text.toLowerCase().includes(query.toLowerCase());
-    const authorMatch = message.author && message.author.toLowerCase().includes(query.toLowerCase());
-    return textMatch || authorMatch;
-  });
+  const filteredMessages = allMessages.filter(message => messageMatchesQuery(message, query));
   
   messages = filteredMessages;
   updateMessagesList();
 }
 
+/**
+ * 消息是否匹配搜索词（内容或作者名称）
+ */
+function messageMatchesQuery(message, query) {
+  const q = query.toLowerCase();
+  const textMatch = message.text && message.text.toLowerCase().includes(q);
+  const authorMatch = message.author && message.author.toLowerCase().includes(q);
+  return !!(textMatch || authorMatch);
+}
+
 /**
  * 清除搜索
  */
@@ -974,28 +991,7 @@ async function loadMessages() {
     const list = (data && data.success && Array.isArray(data.data)) ? data.data : [];
     
     // 归一化为现有渲染结构
-    const loadedMessages = list.map((it) => {
-      const apiBase = getApiBase();
-      const avatar = it.avatar_url ? (it.avatar_url.startsWith('http') ? it.avatar_url : (apiBase + it.avatar_url)) : null;
-      const imgs = Array.isArray(it.images) ? it.images : (Array.isArray(it.image_urls) ? it.image_urls : []);
-      const normImgs = imgs.map(u => (typeof u === 'string' ? (u.startsWith('http') ? u : (apiBase + u)) : '')).filter(Boolean);
-      
-      // 尝试多种可能的评论计数字段名
-      const commentCount = it.comment_count || it.comments_count || it.num_comments || it.comments || 0;
-      
-      return {
-        id: it.id,
-        author: it.username || '匿名用户',
-        authorId: it.user_id || '',
-        avatar: avatar,
-        text: it.text || it.text_content || '',
-        images: normImgs,
-        timestamp: it.created_at || new Date().toISOString(),
-        likes: 0,
-        comments: 0,
-        comments_count: commentCount
-      };
-    });
+    const loadedMessages = list.map(normalizePost);
     
     // 保存到 allMessages 用于搜索
     allMessages = [...loadedMessages];
@@ -1031,6 +1027,154 @@ async function loadMessages() {
   }
 }
 
+/**
+ * 将接口返回的帖子归一化为渲染结构（/square/list 与实时事件共用）
+ * @param {Object} it - 接口帖子对象
+ * @returns {Object} 消息对象
+ */
+function normalizePost(it) {
+  const apiBase = getApiBase();
+  const avatar = it.avatar_url ? (it.avatar_url.startsWith('http') ? it.avatar_url : (apiBase + it.avatar_url)) : null;
+  const imgs = Array.isArray(it.images) ? it.images : (Array.isArray(it.image_urls) ? it.image_urls : []);
+  const normImgs = imgs.map(u => (typeof u === 'string' ? (u.startsWith('http') ? u : (apiBase + u)) : '')).filter(Boolean);
+  
+  // 尝试多种可能的评论计数字段名
+  const commentCount = it.comment_count || it.comments_count || it.num_comments || it.comments || 0;
+  
+  return {
+    id: it.id,
+    author: it.username || '匿名用户',
+    authorId: it.user_id || '',
+    avatar: avatar,
+    text: it.text || it.text_content || '',
+    images: normImgs,
+    timestamp: it.created_at || new Date().toISOString(),
+    likes: 0,
+    comments: 0,
+    comments_count: commentCount
+  };
+}
+
+/**
+ * 订阅广场实时更新（/square/stream，Server-Sent Events）
+ * 连接不可用（如服务端连接已满返回 503）时稍后重试，期间列表仍可手动刷新
+ */
+function openSquareStream() {
+  if (squareStream) return;
+  if (typeof EventSource === 'undefined' || document.hidden) return;
+  if (squareStreamRetryTimer) {
+    clearTimeout(squareStreamRetryTimer);
+    squareStreamRetryTimer = null;
+  }
+  let userId = '';
+  try {
+    userId = localStorage.getItem('userId') || sessionStorage.getItem('userId') || '';
+  } catch (_) {}
+  const params = new URLSearchParams();
+  if (userId) params.set('current_user_id', userId);
+  if (squareStreamLastId) params.set('last_event_id', squareStreamLastId);
+
+  const es = new EventSource(getApiBase() + '/square/stream?' + params.toString());
+  squareStream = es;
+  const on = (type, handler) => {
+    es.addEventListener(type, (e) => {
+      if (e.lastEventId) squareStreamLastId = e.lastEventId;
+      let data = {};
+      try { data = JSON.parse(e.data || '{}'); } catch (_) { return; }
+      try { handler(data); } catch (err) { console.warn('[square] 处理实时事件失败:', type, err); }
+    });
+  };
+  on('ready', () => {});
+  on('post', handleStreamPost);
+  on('post_deleted', (data) => handleStreamPostDeleted(data.post_id));
+  on('comment', (data) => handleStreamCommentChange(data.comment && data.comment.post_id));
+  on('comment_deleted', (data) => handleStreamCommentChange(data.post_id));
+  on('resync', () => {
+    // 错过的事件太多：重新拉取
+    if (isDetailView && currentDetailPostId) {
+      loadComments(currentDetailPostId);
+    } else {
+      loadMessages();
+    }
+  });
+  es.onerror = () => {
+    // 网络中断浏览器会自动重连；连接被拒绝时 EventSource 关闭，由这里稍后重试
+    if (es.readyState === EventSource.CLOSED && squareStream === es) {
+      squareStream = null;
+      squareStreamRetryTimer = setTimeout(() => {
+        squareStreamRetryTimer = null;
+        if (isInitialized) openSquareStream();
+      }, 30000);
+    }
+  };
+}
+
+/**
+ * 关闭实时更新连接
+ */
+function closeSquareStream() {
+  if (squareStreamRetryTimer) {
+    clearTimeout(squareStreamRetryTimer);
+    squareStreamRetryTimer = null;
+  }
+  if (squareStream) {
+    try { squareStream.close(); } catch (_) {}
+    squareStream = null;
+  }
+}
+
+/**
+ * 实时事件：新帖子，插入到列表顶部
+ */
+function handleStreamPost(data) {
+  const it = data && data.post;
+  if (!it || !it.id || allMessages.some(m => m.id === it.id)) return;
+  const message = normalizePost(it);
+  allMessages.unshift(message);
+  if (searchQuery && !messageMatchesQuery(message, searchQuery)) return;
+  messages.unshift(message);
+  if (!messagesList) return;
+  if (messages.length === 1) {
+    updateMessagesList();
+    return;
+  }
+  const messageElement = createMessageElement(message, 0);
+  // 详情视图下其他帖子是隐藏的，返回列表时统一显示
+  if (isDetailView) messageElement.style.display = 'none';
+  messagesList.insertBefore(messageElement, messagesList.firstChild);
+  updateMessageCount();
+}
+
+/**
+ * 实时事件：帖子被删除
+ */
+function handleStreamPostDeleted(postId) {
+  if (!postId) return;
+  allMessages = allMessages.filter(m => m.id !== postId);
+  const before = messages.length;
+  messages = messages.filter(m => m.id !== postId);
+  if (messages.length === before) return;
+  if (isDetailView && currentDetailPostId === postId) {
+    backToList().then(() => updateMessagesList());
+    return;
+  }
+  const el = messagesList && messagesList.querySelector(`.message-item[data-post-id="${postId}"]`);
+  if (el && el.parentNode) el.parentNode.removeChild(el);
+  if (messages.length === 0) showEmpty();
+  updateMessageCount();
+}
+
+/**
+ * 实时事件：评论新增或删除，刷新评论数；正在查看该帖子时刷新评论列表
+ */
+function handleStreamCommentChange(postId) {
+  if (!postId || !allMessages.some(m => m.id === postId)) return;
+  loadAllCommentCounts([{ id: postId }]);
+  if (isDetailView && currentDetailPostId === postId) {
+    loadComments(postId);
+  }
+}
+
 /**
  * 检查 relate 页面更新
  * 调用相关 API 检查是否有新更新，并在 feedbackIconBtn 上方显示红色圆圈和数字
@@ -1047,12 +1191,8 @@ async function checkRelatedUpdates() {
       return;
     }
     
-    // 调用 /square/related API 获取相关更新（和 related.js 中的逻辑一样）
-    const resp = await fetch(API_BASE + '/square/related', {
-      method: 'POST',
-      headers: { 'Content-Type': 'application/json' },
-      body: JSON.stringify({ current_user_id: user_id, limit: 500 })
-    });
+    // 服务端按已读水位计算未读数（打开 relate 页面时推进水位），不再拉取完整列表
+    const resp = await fetch(API_BASE + '/square/related/unread_count?current_user_id=' + encodeURIComponent(user_id));
     
     if (!resp.ok) {
       console.error('检查 relate 更新失败: HTTP', resp.status);
@@ -1067,62 +1207,9 @@ async function checkRelatedUpdates() {
       return;
     }
     
-    // 过滤"自己回复自己"，并按时间倒序（最新在上）
-    const rows = Array.isArray(json.data) ? json.data
-      .filter(it => it && it.user_id !== user_id)
-      .sort((a, b) => {
-        const ta = a && a.created_at ? Date.parse(a.created_at) : 0;
-        const tb = b && b.created_at ? Date.parse(b.created_at) : 0;
-        return tb - ta;
-      }) : [];
-    
-    if (rows.length === 0) {
-      hideRelatedUpdateBadge();
-      return;
-    }
-    
-    // 获取缓存中的上次查看时间
-    let lastViewTime = null;
-    try {
-      const cachedTime = localStorage.getItem('related_last_view_time');
-      if (cachedTime) {
-        lastViewTime = parseInt(cachedTime, 10);
-      }
-    } catch (_) {}
-    
-    // 找到最新的更新时间
-    const latestTime = rows[0] && rows[0].created_at ? Date.parse(rows[0].created_at) : null;
-    
-    if (!latestTime) {
-      hideRelatedUpdateBadge();
-      return;
-    }
-    
-    // 如果没有上次查看时间，显示所有更新（首次使用）
-    if (!lastViewTime) {
-      if (rows.length > 0) {
-        showRelatedUpdateBadge(rows.length);
-      } else {
-        hideRelatedUpdateBadge();
-      }
-      return;
-    }
-    
-    // 如果有上次查看时间，只显示比它新的更新
-    // latestTime <= lastViewTime 表示没有新更新，隐藏红点
-    if (latestTime <= lastViewTime) {
-      hideRelatedUpdateBadge();
-      return;
-    }
-    
-    // 计算新更新的数量（只统计比 lastViewTime 新的更新）
-    const newUpdateCount = rows.filter(it => {
-      const itemTime = it && it.created_at ? Date.parse(it.created_at) : 0;
-      return itemTime > lastViewTime;
-    }).length;
-    
-    if (newUpdateCount > 0) {
-      showRelatedUpdateBadge(newUpdateCount);
+    const count = Number(json.count) || 0;
+    if (count > 0) {
+      showRelatedUpdateBadge(count);
     } else {
       hideRelatedUpdateBadge();
     }